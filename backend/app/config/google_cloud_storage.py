@@ -55,6 +55,7 @@ class GoogleCloudStorageConfig:
     resized_val_masks_dir: str = attr.ib(default="resized_augmented/val/masks")
     resized_test_images_dir: str = attr.ib(default="resized_augmented/test/images")
     resized_test_masks_dir: str = attr.ib(default="resized_augmented/test/masks")
+    augmented_data_dir: str = attr.ib(default="augmented")
     augmented_dir: str = attr.ib(default="augmented/combined")
 
     def __attrs_post_init__(self):
@@ -1,15 +1,17 @@
+import contextlib
 import gc
 import importlib.util
 import json
 import os
 import sys
-import zipfile
 
 from flask import Blueprint, request, jsonify
 from tensorflow.keras.backend import clear_session
 
-from app.services import DataSplitterAugmenterAndSaver, resize_augmented_data
+from app.services import BucketSink, DataSplitterAugmenterAndSaver, StreamingZipWriter, get_transfer_bucket, \
+    resize_augmented_data
 from app.services import session_store
+from app.services.data_preprocessing import supports_native_encoding
 from app.utils import list_filenames, get_file_extension
 
 augment = Blueprint('augment', __name__)
@@ -91,7 +93,7 @@ def augment_data():
     augmented_dir = directory_store.augmented
 
     directory_store = session_store.get_directory_store(session_id)
-    file_path = list_filenames(directory_store.image_dir)[0]
+    file_path = directory_store.get_file_index(directory_store.image_dir).first()
     extension = get_file_extension(file_path)
 
     try:
@@ -119,54 +121,95 @@ def augment_data():
         # set augmentation status to running
         session_store.set_augmentation_running(session_id=session_id)
 
-        augmenter = DataSplitterAugmenterAndSaver(images_directory=directory_store.image_dir,
-                                                  masks_directory=directory_store.mask_dir,
-                                                  train_directory=directory_store.train_dir,
-                                                  val_directory=directory_store.val_dir,
-                                                  test_directory=directory_store.test_dir,
-                                                  initial_save_id_train=aug_config.get("initialTrainSaveId"),
-                                                  initial_save_id_val=aug_config.get("initialValSaveId"),
-                                                  initial_save_id_test=aug_config.get("initialTestSaveId"),
-                                                  visual_attributes_json_path=stratification_data_filepath,
-                                                  image_mask_channels=tuple(aug_config.get("imageMaskChannels").values()),
-                                                  final_image_shape=final_image_shape,
-                                                  image_save_format=extension,
-                                                  image_save_prefix='img',
-                                                  mask_save_prefix='mask',
-                                                  val_size=aug_config.get('valRatio'),
-                                                  test_size=aug_config.get('testRatio'),
-                                                  seed=aug_config.get('seed'),
-                                                  crop_image_and_mask=aug_config.get('crop'),
-                                                  crop_dimension=tuple(aug_config.get("cropDimension").values()),
-                                                  augmentation_prob=6,
-                                                  augment_validation_data=aug_config.get('augmentValData'),
-                                                  random_crop=aug_config.get('randomCrop'),
-                                                  flip_left_right=aug_config.get('flipLeftRight'),
-                                                  flip_up_down=aug_config.get('flipUpDown'),
-                                                  random_rotate=aug_config.get('randomRotate'),
-                                                  corrupt_brightness=aug_config.get('corruptBrightness'),
-                                                  corrupt_contrast=aug_config.get('corruptContrast'),
-                                                  corrupt_saturation=aug_config.get('corruptSaturation'),
-                                                  cache_directory=None,
-                                                  display_split_histogram=False,
-                                                  number_of_training_images_after_augmentation=aug_config.get(
-                                                      'totalAugmentedImages'),
-                                                  parameter_for_stratified_splitting=aug_config.get('splitParameter'))
-        augmenter.process_data()
-
-        # Create a ZIP file containing augmented images and masks.
-        zip_path = os.path.join(augmented_dir, 'augmented_data.zip')
-
-        with zipfile.ZipFile(file=zip_path, mode='w') as zipf:
-            for root, _, files in os.walk(augmented_dir):
-                for file in files:
-                    if file != 'augmented_data.zip':  # Avoid including the ZIP file itself
-                        file_path = str(os.path.join(root, file))
-                        zipf.write(filename=file_path,
-                                   arcname=os.path.relpath(file_path, augmented_dir))
-
-        # Store a resized version of the augmented results
-        resize_augmented_data(session_id=session_id)
+        # Downscaled previews of the augmented images and masks are saved alongside them.
+        preview_directories = {
+            'train': {'images': directory_store.resized_train_image_dir,
+                      'masks': directory_store.resized_train_mask_dir},
+            'val': {'images': directory_store.resized_val_image_dir,
+                    'masks': directory_store.resized_val_mask_dir},
+            'test': {'images': directory_store.resized_test_image_dir,
+                     'masks': directory_store.resized_test_mask_dir}}
+
+        # If requested, the augmented images, masks, previews and ZIP file are uploaded to the session's bucket as
+        # they are produced, rather than saved in the backend and transferred afterwards.
+        stream_to_bucket = bool(aug_config.get('streamToBucket')) and supports_native_encoding(extension)
+
+        with contextlib.ExitStack() as stack:
+            storage_sink = None
+            zip_path = os.path.join(augmented_dir, 'augmented_data.zip')
+
+            if stream_to_bucket:
+                google_cloud_config = session_store.gcs_config
+                bucket = get_transfer_bucket(session_store.get_bucket_name(session_id=session_id))
+                storage_sink = stack.enter_context(BucketSink(
+                    bucket=bucket,
+                    path_prefixes={augmented_dir: google_cloud_config.augmented_data_dir,
+                                   directory_store.resized_augmented: google_cloud_config.resized_augmented}))
+                zip_path = stack.enter_context(
+                    storage_sink.open_object(f'{google_cloud_config.augmented_dir}/augmented_data.zip'))
+
+            # Create a ZIP file containing augmented images and masks, while they are being saved.
+            zip_writer = stack.enter_context(StreamingZipWriter(zip_path=zip_path, root_directory=augmented_dir))
+
+            augmenter = DataSplitterAugmenterAndSaver(images_directory=directory_store.image_dir,
+                                                      masks_directory=directory_store.mask_dir,
+                                                      train_directory=directory_store.train_dir,
+                                                      val_directory=directory_store.val_dir,
+                                                      test_directory=directory_store.test_dir,
+                                                      initial_save_id_train=aug_config.get("initialTrainSaveId"),
+                                                      initial_save_id_val=aug_config.get("initialValSaveId"),
+                                                      initial_save_id_test=aug_config.get("initialTestSaveId"),
+                                                      visual_attributes_json_path=stratification_data_filepath,
+                                                      image_mask_channels=tuple(aug_config.get("imageMaskChannels").values()),
+                                                      final_image_shape=final_image_shape,
+                                                      image_save_format=extension,
+                                                      image_save_prefix='img',
+                                                      mask_save_prefix='mask',
+                                                      png_compression=aug_config.get('pngCompression', -1),
+                                                      jpeg_quality=aug_config.get('jpegQuality', 95),
+                                                      val_size=aug_config.get('valRatio'),
+                                                      test_size=aug_config.get('testRatio'),
+                                                      seed=aug_config.get('seed'),
+                                                      crop_image_and_mask=aug_config.get('crop'),
+                                                      crop_dimension=tuple(aug_config.get("cropDimension").values()),
+                                                      augmentation_prob=6,
+                                                      augment_validation_data=aug_config.get('augmentValData'),
+                                                      random_crop=aug_config.get('randomCrop'),
+                                                      flip_left_right=aug_config.get('flipLeftRight'),
+                                                      flip_up_down=aug_config.get('flipUpDown'),
+                                                      random_rotate=aug_config.get('randomRotate'),
+                                                      corrupt_brightness=aug_config.get('corruptBrightness'),
+                                                      corrupt_contrast=aug_config.get('corruptContrast'),
+                                                      corrupt_saturation=aug_config.get('corruptSaturation'),
+                                                      cache_directory=None,
+                                                      display_split_histogram=False,
+                                                      number_of_training_images_after_augmentation=aug_config.get(
+                                                          'totalAugmentedImages'),
+                                                      parameter_for_stratified_splitting=aug_config.get('splitParameter'),
+                                                      num_workers=aug_config.get('numWorkers', 1),
+                                                      zip_writer=zip_writer,
+                                                      preview_directories=preview_directories,
+                                                      storage_sink=storage_sink)
+            augmenter.process_data()
+
+            # As when the whole augmented directory was archived, the files that earlier runs left there (e.g. under
+            # other save ids) are archived too.
+            zip_writer.add_directory(exclude=['augmented_data.zip'])
+
+            # The ZIP file is only completed, and published to the bucket, once every other file was uploaded.
+            if storage_sink is not None:
+                storage_sink.flush()
+
+        # The streamed outputs are listed from the sink's manifest, since none of them was saved locally. Outputs saved
+        # locally replace those of earlier streamed runs.
+        if storage_sink is not None:
+            session_store.add_streamed_objects(session_id=session_id, object_names=storage_sink.object_names)
+        else:
+            session_store.clear_streamed_objects(session_id=session_id)
+
+        # Store a resized version of the augmented results, if it was not saved during augmentation.
+        if not augmenter.previews_written:
+            resize_augmented_data(session_id=session_id)
 
         # Clear the augmentation status after completion
         session_store.clear_augmentation_running(session_id=session_id)
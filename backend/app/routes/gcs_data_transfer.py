@@ -5,9 +5,9 @@ import os.path
 from flask import Blueprint, jsonify, request
 from tensorflow.keras.backend import clear_session
 
-from app.services import session_store
+from app.services import get_transfer_bucket, session_store
 from app.services.gcs_client import upload_file_to_gcs_bucket, download_files_from_gcs_folder, \
-    upload_files_to_gcs_bucket
+    sync_files_to_gcs_bucket
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +24,7 @@ def transfer_augmented_zip_to_gcs():
 
     Expects sessionId as a query parameter. If the file exists in the backend's
     augmented directory, it is uploaded to the appropriate bucket and folder in GCS.
+    If it was already streamed to the bucket during augmentation, nothing is uploaded.
 
     Returns:
         JSON response indicating success or failure.
@@ -35,9 +36,10 @@ def transfer_augmented_zip_to_gcs():
     filename = 'augmented_data.zip'
 
     try:
+        google_cloud_config = session_store.gcs_config
+        destination_blob_name = google_cloud_config.augmented_dir + '/' + filename
+
         if os.path.exists(os.path.join(augmented_dir, filename)):
-            google_cloud_config = session_store.gcs_config
-            destination_blob_name = google_cloud_config.augmented_dir + '/' + filename
             source_file_name = os.path.join(augmented_dir, filename)
 
             upload_file_to_gcs_bucket(session_id=session_id,
@@ -47,6 +49,12 @@ def transfer_augmented_zip_to_gcs():
             return jsonify({'success': True,
                             'message': f"{source_file_name} uploaded to GCS bucket as {destination_blob_name}"}), 200
 
+        # The ZIP file was streamed to the bucket during augmentation.
+        elif get_transfer_bucket(session_store.get_bucket_name(session_id=session_id)).blob(
+                destination_blob_name).exists():
+            return jsonify({'success': True,
+                            'message': f"'{filename}' is already in the GCS bucket as {destination_blob_name}"}), 200
+
         else:
             return jsonify({'success': False,
                             'message': f"'{filename}', the file containing augmented results,"
@@ -61,8 +69,9 @@ def transfer_resized_augmented_data():
     """
     Uploads resized augmented images and masks to the GCS bucket.
 
-    Requires sessionId in query. Transfers files from resized_augmented directory
-    to the configured GCS folder.
+    Requires sessionId in query. Syncs the resized_augmented directory to the
+    configured GCS folder: only new or changed files are uploaded, and files
+    removed from the directory are deleted from the bucket.
 
     Returns:
         JSON response indicating the upload result.
@@ -74,12 +83,17 @@ def transfer_resized_augmented_data():
         google_cloud_config = session_store.gcs_config
         bucket_name = session_store.get_bucket_name(session_id=session_id)
 
-        upload_files_to_gcs_bucket(bucket_name=bucket_name,
-                                   source_folder_path=directory_store.resized_augmented,
-                                   destination_folder_path=google_cloud_config.resized_augmented,
-                                   copy=False)
+        result = sync_files_to_gcs_bucket(bucket_name=bucket_name,
+                                          source_folder_path=directory_store.resized_augmented,
+                                          destination_folder_path=google_cloud_config.resized_augmented,
+                                          recursive=True)
 
-        return jsonify({'success': True, 'message': "Successfully transferred resized original masks to bucket."}), 200
+        if not result.success:
+            return jsonify({'success': False,
+                            'error': f"{len(result.failed)} file(s) could not be transferred to bucket.",
+                            'transfer': result.to_dict()}), 500
+
+        return jsonify({'success': True, 'message': "Successfully transferred resized augmented data to bucket.", 'transfer': result.to_dict()}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -93,8 +107,8 @@ def transfer_resized_original_images():
     """
     Uploads resized original images to the GCS bucket.
 
-    Requires sessionId in query. Transfers files from resized_image_dir
-    to the configured GCS folder.
+    Requires sessionId in query. Syncs resized_image_dir to the configured
+    GCS folder, uploading only new or changed files.
 
     Returns:
         JSON response indicating the upload result.
@@ -105,12 +119,16 @@ def transfer_resized_original_images():
         google_cloud_config = session_store.gcs_config
         bucket_name = session_store.get_bucket_name(session_id=session_id)
 
-        upload_files_to_gcs_bucket(bucket_name=bucket_name,
-                                   source_folder_path=directory_store.resized_image_dir,
-                                   destination_folder_path=google_cloud_config.resized_image_dir,
-                                   copy=False)
+        result = sync_files_to_gcs_bucket(bucket_name=bucket_name,
+                                          source_folder_path=directory_store.resized_image_dir,
+                                          destination_folder_path=google_cloud_config.resized_image_dir)
+
+        if not result.success:
+            return jsonify({'success': False,
+                            'error': f"{len(result.failed)} file(s) could not be transferred to bucket.",
+                            'transfer': result.to_dict()}), 500
 
-        return jsonify({'success': True, 'message': "Successfully transferred resized original images to bucket."}), 200
+        return jsonify({'success': True, 'message': "Successfully transferred resized original images to bucket.", 'transfer': result.to_dict()}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -124,8 +142,8 @@ def transfer_resized_original_masks():
     """
     Uploads resized original masks to the GCS bucket.
 
-    Requires sessionId in query. Transfers files from resized_mask_dir
-    to the configured GCS folder.
+    Requires sessionId in query. Syncs resized_mask_dir to the configured
+    GCS folder, uploading only new or changed files.
 
     Returns:
         JSON response indicating the upload result.
@@ -136,12 +154,16 @@ def transfer_resized_original_masks():
         google_cloud_config = session_store.gcs_config
         bucket_name = session_store.get_bucket_name(session_id=session_id)
 
-        upload_files_to_gcs_bucket(bucket_name=bucket_name,
-                                   source_folder_path=directory_store.resized_mask_dir,
-                                   destination_folder_path=google_cloud_config.resized_mask_dir,
-                                   copy=False)
+        result = sync_files_to_gcs_bucket(bucket_name=bucket_name,
+                                          source_folder_path=directory_store.resized_mask_dir,
+                                          destination_folder_path=google_cloud_config.resized_mask_dir)
+
+        if not result.success:
+            return jsonify({'success': False,
+                            'error': f"{len(result.failed)} file(s) could not be transferred to bucket.",
+                            'transfer': result.to_dict()}), 500
 
-        return jsonify({'success': True, 'message': "Successfully transferred resized original masks to bucket."}), 200
+        return jsonify({'success': True, 'message': "Successfully transferred resized original masks to bucket.", 'transfer': result.to_dict()}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -167,15 +189,19 @@ def get_images_from_gcs():
         google_cloud_config = session_store.gcs_config
         bucket_name = session_store.get_bucket_name(session_id=session_id)
 
-        success, message = download_files_from_gcs_folder(bucket_name=bucket_name,
-                                                          source_folder_path=google_cloud_config.image_dir,
-                                                          destination_folder_path=directory_store.image_dir,
-                                                          copy=False)
+        result = download_files_from_gcs_folder(bucket_name=bucket_name,
+                                                source_folder_path=google_cloud_config.image_dir,
+                                                destination_folder_path=directory_store.image_dir,
+                                                copy=False)
 
-        if success:
-            return jsonify({'success': True, 'message': message}), 200
+        if result.success:
+            return jsonify({'success': True,
+                            'message': f"{result.files} file(s) downloaded successfully to {directory_store.image_dir}.",
+                            'transfer': result.to_dict()}), 200
         else:
-            return jsonify({'success': False, 'error': message}), 500
+            return jsonify({'success': False,
+                            'error': f"{len(result.failed)} file(s) could not be downloaded from GCS.",
+                            'transfer': result.to_dict()}), 500
 
     except Exception as e:
         logger.exception('Unexpected error while downloading images from GCS.')
@@ -203,15 +229,19 @@ def get_masks_from_gcs():
         google_cloud_config = session_store.gcs_config
         bucket_name = session_store.get_bucket_name(session_id=session_id)
 
-        success, message = download_files_from_gcs_folder(bucket_name=bucket_name,
-                                                          source_folder_path=google_cloud_config.mask_dir,
-                                                          destination_folder_path=directory_store.mask_dir,
-                                                          copy=False)
+        result = download_files_from_gcs_folder(bucket_name=bucket_name,
+                                                source_folder_path=google_cloud_config.mask_dir,
+                                                destination_folder_path=directory_store.mask_dir,
+                                                copy=False)
 
-        if success:
-            return jsonify({'success': True, 'message': message}), 200
+        if result.success:
+            return jsonify({'success': True,
+                            'message': f"{result.files} file(s) downloaded successfully to {directory_store.mask_dir}.",
+                            'transfer': result.to_dict()}), 200
         else:
-            return jsonify({'success': False, 'error': message}), 500
+            return jsonify({'success': False,
+                            'error': f"{len(result.failed)} file(s) could not be downloaded from GCS.",
+                            'transfer': result.to_dict()}), 500
 
     except Exception as e:
         logger.exception('Unexpected error while downloading masks from GCS.')
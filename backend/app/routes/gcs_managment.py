@@ -81,6 +81,7 @@ def delete_bucket():
         if bucket_deleted:
             session_store.clear_bucket(session_id=session_id)
             session_store.clear_signed_url_bucket(session_id=session_id)
+            session_store.clear_streamed_objects(session_id=session_id)
             return jsonify({'success': True,
                             'message': f"Google Cloud Storage bucket "
                                        f"{bucket_name} deleted successfully. "}), 200
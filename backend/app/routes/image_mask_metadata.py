@@ -3,11 +3,9 @@ import os
 from flask import Blueprint, jsonify, request
 from flask import send_from_directory, url_for
 
-from app.routes.signed_urls import generate_signed_urls_for_resized_images_and_masks, \
-    generate_signed_urls_for_resized_train_set, generate_signed_urls_for_resized_validation_set, \
-    generate_signed_urls_for_resized_test_set
+from app.routes.signed_urls import get_image_mask_names, sign_image_mask_urls
 from app.services import session_store
-from app.utils import get_sorted_filenames
+from app.utils import get_next_cursor, get_page_bounds, quote_filename, resolve_list_cursor, split_urls
 
 # Blueprint definition
 image_mask_metadata = Blueprint('image_mask_metadata', __name__)
@@ -86,47 +84,103 @@ def serve_test_mask(filename):
     return send_from_directory(directory_store.resized_test_mask_dir, filename, mimetype='image/png')
 
 
+def _get_paging_parameters(prefix: str = ''):
+    """
+    Reads the paging parameters of a request. Parameters of the combined split endpoints are prefixed with the name of
+    the split, e.g. 'train_cursor'.
+    """
+    return {'cursor': request.args.get(f'{prefix}cursor'),
+            'page': int(request.args.get(f'{prefix}page', 1)),
+            'page_size': int(request.args.get('page_size', 10)),
+            'columnar': request.args.get('format') == 'columnar'}
+
+
+def _get_url_prefix(endpoint: str, scheme: str):
+    """Returns the URL of the files served by an endpoint, up to the filename."""
+    placeholder = '__filename__'
+    url = url_for(endpoint, filename=placeholder, _external=True, _scheme=scheme)
+    return url[:url.index(placeholder)]
+
+
+def _get_local_metadata(directory_store, image_dir: str, mask_dir: str, image_endpoint: str, mask_endpoint: str,
+                        mismatch_error: str, cursor: str = None, page: int = 1, page_size: int = 10,
+                        columnar: bool = False):
+    """
+    Returns a page of the names and URLs of the images and masks in two of the session's directories.
+
+    The rows form lists an object per image-mask pair. The columnar form returns each URL prefix once, with arrays of
+    the image and mask names.
+
+    :raises ValueError: if the number of images and masks differ, or the cursor is invalid.
+    """
+    image_index = directory_store.get_file_index(image_dir)
+    mask_index = directory_store.get_file_index(mask_dir)
+    number_of_images = len(image_index)
+
+    # Ensure the number of images and mask align
+    if number_of_images != len(mask_index):
+        raise ValueError(mismatch_error)
+
+    # Paginate the data
+    start, end = get_page_bounds(total=number_of_images, page_size=page_size, resolve_cursor=image_index.resolve_cursor,
+                                 cursor=cursor, page=page)
+    paginated_images = image_index.page(start, end)
+    paginated_masks = mask_index.page(start, end)
+
+    scheme = get_scheme()
+    image_url_prefix = _get_url_prefix(image_endpoint, scheme)
+    mask_url_prefix = _get_url_prefix(mask_endpoint, scheme)
+
+    metadata = {'count': len(paginated_images),
+                'total': number_of_images,
+                'next': end < number_of_images,
+                'next_cursor': get_next_cursor(end, number_of_images, paginated_images)}
+
+    if columnar:
+        metadata.update({'image_url_prefix': image_url_prefix,
+                         'mask_url_prefix': mask_url_prefix,
+                         'image_names': paginated_images,
+                         'mask_names': paginated_masks})
+    else:
+        metadata['results'] = [{'image': {'name': image_name, 'url': image_url_prefix + quote_filename(image_name)},
+                                'mask': {'name': mask_name, 'url': mask_url_prefix + quote_filename(mask_name)}}
+                               for image_name, mask_name in zip(paginated_images, paginated_masks)]
+    return metadata
+
+
+SPLIT_MISMATCH_ERRORS = {'train': "Mismatch between number of images and masks.",
+                         'val': "Mismatch between number of images and masks.",
+                         'test': "Mismatch between number of test set images and masks."}
+
+
+def _get_resized_split_metadata(directory_store, split: str, **paging_parameters):
+    """Returns a page of the metadata of the resized images and masks of the train, val or test split."""
+    return _get_local_metadata(
+        directory_store,
+        image_dir=getattr(directory_store, f'resized_{split}_image_dir'),
+        mask_dir=getattr(directory_store, f'resized_{split}_mask_dir'),
+        image_endpoint=f'image_mask_metadata.serve_{split}_image',
+        mask_endpoint=f'image_mask_metadata.serve_{split}_mask',
+        mismatch_error=SPLIT_MISMATCH_ERRORS[split],
+        **paging_parameters)
+
+
 @image_mask_metadata.route('/metadata/uploaded_image_mask', methods=['GET'])
 def get_image_mask_metadata():
     try:
-        # Detect the scheme (http or https) dynamically
-        # scheme = request.scheme
-        scheme = get_scheme()
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
-
-        # Get sorted filenames for images and masks
-        image_files = get_sorted_filenames(directory_store.image_dir)
-        mask_files = get_sorted_filenames(directory_store.mask_dir)
-
-        # Ensure the number of images and mask align
-        if len(image_files) != len(mask_files):
-            return jsonify({'error': "Mismatch between number of original images and masks."}), 400
-
-        # Paginate the data
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_images = image_files[start:end]
-        paginated_masks = mask_files[start:end]
-
-        metadata = []
-        for image_name, mask_name in zip(paginated_images, paginated_masks):
-            image_path = url_for('image_mask_metadata.serve_image',
-                                 filename=image_name, _external=True, _scheme=scheme)
-            mask_path = url_for('image_mask_metadata.serve_mask',
-                                filename=mask_name, _external=True, _scheme=scheme)
-
-            metadata.append({'image': {'name': image_name, 'url': image_path},
-                             'mask': {'name': mask_name, 'url': mask_path}
-                             })
-
-        return jsonify({'count': len(metadata),
-                        'next': False if end >= len(image_files) else True,
-                        'results': metadata}), 200
+        metadata = _get_local_metadata(directory_store,
+                                       image_dir=directory_store.image_dir,
+                                       mask_dir=directory_store.mask_dir,
+                                       image_endpoint='image_mask_metadata.serve_image',
+                                       mask_endpoint='image_mask_metadata.serve_mask',
+                                       mismatch_error="Mismatch between number of original images and masks.",
+                                       **_get_paging_parameters())
+        return jsonify(metadata), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -134,44 +188,13 @@ def get_image_mask_metadata():
 @image_mask_metadata.route('/metadata/train_images_masks', methods=['GET'])
 def get_train_images_masks():
     try:
-        # Detect the scheme (http or https) dynamically
-        scheme = get_scheme()
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
-
-        # Get sorted filenames for images and masks
-        image_files = get_sorted_filenames(directory_store.resized_train_image_dir)
-        mask_files = get_sorted_filenames(directory_store.resized_train_mask_dir)
-
-        # Ensure the number of images and mask align
-        if len(image_files) != len(mask_files):
-            return jsonify({'error': "Mismatch between number of images and masks."}), 400
-
-        # Paginate the data
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_images = image_files[start:end]
-        paginated_masks = mask_files[start:end]
-
-        metadata = []
-        for image_name, mask_name in zip(paginated_images, paginated_masks):
-            image_path = url_for('image_mask_metadata.serve_train_image',
-                                 filename=image_name, _external=True, _scheme=scheme)
-            mask_path = url_for('image_mask_metadata.serve_train_mask',
-                                filename=mask_name, _external=True, _scheme=scheme)
-
-            metadata.append({'image': {'name': image_name, 'url': image_path},
-                             'mask': {'name': mask_name, 'url': mask_path}
-                             })
-
-        return jsonify({'count': len(metadata),
-                        'next': False if end >= len(image_files) else True,
-                        'results': metadata}), 200
+        metadata = _get_resized_split_metadata(directory_store, 'train', **_get_paging_parameters())
+        return jsonify(metadata), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -182,41 +205,10 @@ def get_val_images_masks():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        # Detect the scheme (http or https) dynamically
-        scheme = get_scheme()
-
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
-
-        # Get sorted filenames for images and masks
-        image_files = get_sorted_filenames(directory_store.resized_val_image_dir)
-        mask_files = get_sorted_filenames(directory_store.resized_val_mask_dir)
-
-        # Ensure the number of images and mask align
-        if len(image_files) != len(mask_files):
-            return jsonify({'error': "Mismatch between number of images and masks."}), 400
-
-        # Paginate the data
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_images = image_files[start:end]
-        paginated_masks = mask_files[start:end]
-
-        metadata = []
-        for image_name, mask_name in zip(paginated_images, paginated_masks):
-            image_path = url_for(
-                'image_mask_metadata.serve_val_image', filename=image_name, _external=True, _scheme=scheme)
-            mask_path = url_for(
-                'image_mask_metadata.serve_val_mask', filename=mask_name, _external=True, _scheme=scheme)
-
-            metadata.append({'image': {'name': image_name, 'url': image_path},
-                             'mask': {'name': mask_name, 'url': mask_path}
-                             })
-
-        return jsonify({'count': len(metadata),
-                        'next': False if end >= len(image_files) else True,
-                        'results': metadata}), 200
+        metadata = _get_resized_split_metadata(directory_store, 'val', **_get_paging_parameters())
+        return jsonify(metadata), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -227,70 +219,96 @@ def get_test_images_masks():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        # Detect the scheme (http or https) dynamically
-        scheme = get_scheme()
-
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
-
-        # Get sorted filenames for images and masks
-        image_files = get_sorted_filenames(directory_store.resized_test_image_dirR)
-        mask_files = get_sorted_filenames(directory_store.resized_test_mask_dir)
-
-        # Ensure the number of images and mask align
-        if len(image_files) != len(mask_files):
-            return jsonify({'error': "Mismatch between number of test set images and masks."}), 400
-
-        # Paginate the data
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_images = image_files[start:end]
-        paginated_masks = mask_files[start:end]
-
-        metadata = []
-        for image_name, mask_name in zip(paginated_images, paginated_masks):
-            image_path = url_for('image_mask_metadata.serve_test_image',
-                                 filename=image_name, _external=True, _scheme=scheme)
-            mask_path = url_for('image_mask_metadata.serve_test_mask',
-                                filename=mask_name, _external=True, _scheme=scheme)
-
-            metadata.append({'image': {'name': image_name, 'url': image_path},
-                             'mask': {'name': mask_name, 'url': mask_path}
-                             })
-
-        return jsonify({'count': len(metadata),
-                        'next': False if end >= len(image_files) else True,
-                        'results': metadata}), 200
+        metadata = _get_resized_split_metadata(directory_store, 'test', **_get_paging_parameters())
+        return jsonify(metadata), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@image_mask_metadata.route('/metadata/splits', methods=['GET'])
+def get_split_images_masks():
+    """
+    Fetch a page of the metadata of the resized train, val and test sets in one call. Each split is paged with its
+    own cursor ('train_cursor', 'val_cursor' and 'test_cursor') or page number ('train_page', ...).
+    """
+    try:
+        session_id = request.args.get('sessionId')
+        directory_store = session_store.get_directory_store(session_id)
+
+        splits = {}
+        for split in ('train', 'val', 'test'):
+            splits[split] = _get_resized_split_metadata(directory_store, split,
+                                                        **_get_paging_parameters(prefix=f'{split}_'))
+        return jsonify(splits), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _get_gcs_metadata(session_id: str, name_pairs: list, image_mask_set: str, cursor: str = None, page: int = 1,
+                      page_size: int = 10, columnar: bool = False):
+    """
+    Returns a page of the signed URLs of images and masks in the GCS bucket. Only the URLs of the page are signed;
+    URLs signed for earlier requests are reused until shortly before they expire.
+
+    The rows form lists an object per image-mask pair. The columnar form returns the URL prefix of the images and of
+    the masks once, with arrays of the names and of the signed query parameters of each URL.
+
+    :raises ValueError: if the cursor is invalid.
+    """
+    total = len(name_pairs)
+    start, end = get_page_bounds(
+        total=total, page_size=page_size, cursor=cursor, page=page,
+        resolve_cursor=lambda c: resolve_list_cursor(c, name_pairs, key=lambda pair: pair[0]))
+    paginated_metadata = sign_image_mask_urls(session_id, image_mask_set, name_pairs[start:end])
+    image_names = [item['image']['name'] for item in paginated_metadata]
+
+    metadata = {'count': len(paginated_metadata),
+                'total': total,
+                'next': end < total,
+                'next_cursor': get_next_cursor(end, total, image_names)}
+
+    if not columnar:
+        metadata['results'] = paginated_metadata
+        return metadata
+
+    mask_names = [item['mask']['name'] for item in paginated_metadata]
+    image_urls = [item['image']['url'] for item in paginated_metadata]
+    mask_urls = [item['mask']['url'] for item in paginated_metadata]
+    image_url_prefix, image_url_params = split_urls(image_urls, image_names)
+    mask_url_prefix, mask_url_params = split_urls(mask_urls, mask_names)
+
+    metadata.update({'image_names': image_names, 'mask_names': mask_names})
+
+    # URLs whose names were changed when they were signed do not share a prefix, and are returned in full.
+    if image_url_prefix is not None and mask_url_prefix is not None:
+        metadata.update({'image_url_prefix': image_url_prefix,
+                         'mask_url_prefix': mask_url_prefix,
+                         'image_url_params': image_url_params,
+                         'mask_url_params': mask_url_params})
+    else:
+        metadata.update({'image_urls': image_urls, 'mask_urls': mask_urls})
+    return metadata
+
+
 @image_mask_metadata.route('/metadata/gcs/resized_original_images_masks', methods=['GET'])
 def get_image_mask_metadata_from_gcs():
     """Fetch the metadata of the resized original images and masks in GCS bucket."""
     try:
         session_id = request.args.get('sessionId')
 
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
+        name_pairs = get_image_mask_names(session_id, 'resized')
 
-        # Get signed URLs (cached)
-        all_metadata = generate_signed_urls_for_resized_images_and_masks(session_id=session_id)
-
-        if not all_metadata:
+        if not name_pairs:
             return jsonify({'success': False, 'error': "No images/masks found."}), 400
 
-        # Paginate results
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_metadata = all_metadata[start:end]
-
-        return jsonify({'count': len(paginated_metadata),
-                        'next': end < len(all_metadata),
-                        'results': paginated_metadata}), 200
+        return jsonify(_get_gcs_metadata(session_id, name_pairs, 'resized', **_get_paging_parameters())), 200
 
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -301,25 +319,15 @@ def get_resized_training_image_mask_metadata_from_gcs():
     try:
         session_id = request.args.get('sessionId')
 
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
+        name_pairs = get_image_mask_names(session_id, 'train')
 
-        # Get signed URLs (cached)
-        all_metadata = generate_signed_urls_for_resized_train_set(session_id=session_id)
-
-        if not all_metadata:
+        if not name_pairs:
             return jsonify({'success': False, 'error': "No training images/masks found."}), 400
 
-        # Paginate results
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_metadata = all_metadata[start:end]
-
-        return jsonify({'count': len(paginated_metadata),
-                        'next': end < len(all_metadata),
-                        'results': paginated_metadata}), 200
+        return jsonify(_get_gcs_metadata(session_id, name_pairs, 'train', **_get_paging_parameters())), 200
 
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -330,25 +338,15 @@ def get_resized_validation_image_mask_metadata_from_gcs():
     try:
         session_id = request.args.get('sessionId')
 
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
+        name_pairs = get_image_mask_names(session_id, 'val')
 
-        # Get signed URLs (cached)
-        all_metadata = generate_signed_urls_for_resized_validation_set(session_id=session_id)
-
-        if not all_metadata:
+        if not name_pairs:
             return jsonify({'success': False, 'error': "No images/masks found."}), 400
 
-        # Paginate results
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_metadata = all_metadata[start:end]
-
-        return jsonify({'count': len(paginated_metadata),
-                        'next': end < len(all_metadata),
-                        'results': paginated_metadata}), 200
+        return jsonify(_get_gcs_metadata(session_id, name_pairs, 'val', **_get_paging_parameters())), 200
 
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -359,25 +357,35 @@ def get_resized_test_image_mask_metadata_from_gcs():
     try:
         session_id = request.args.get('sessionId')
 
-        # Pagination parameters
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 10))
+        name_pairs = get_image_mask_names(session_id, 'test')
 
-        # Get signed URLs (cached)
-        all_metadata = generate_signed_urls_for_resized_test_set(session_id=session_id)
-
-        if not all_metadata:
+        if not name_pairs:
             return jsonify({'success': False, 'error': "No images/masks found."}), 400
 
-        # Paginate results
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_metadata = all_metadata[start:end]
+        return jsonify(_get_gcs_metadata(session_id, name_pairs, 'test', **_get_paging_parameters())), 200
+
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@image_mask_metadata.route('/metadata/gcs/splits', methods=['GET'])
+def get_resized_split_metadata_from_gcs():
+    """
+    Fetch a page of the metadata of the resized train, val and test sets in the GCS bucket, in one call. Each split
+    is paged with its own cursor ('train_cursor', 'val_cursor' and 'test_cursor') or page number ('train_page', ...).
+    """
+    try:
+        session_id = request.args.get('sessionId')
 
-        return jsonify({'count': len(paginated_metadata),
-                        'next': end < len(all_metadata),
-                        'results': paginated_metadata}), 200
+        splits = {split: _get_gcs_metadata(session_id, get_image_mask_names(session_id, split), split,
+                                           **_get_paging_parameters(prefix=f'{split}_'))
+                  for split in ('train', 'val', 'test')}
+        return jsonify(splits), 200
 
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1,11 +1,9 @@
-import gc
 import os
 
 from flask import Blueprint, request, jsonify
-from tensorflow.keras.backend import clear_session
 from werkzeug.utils import secure_filename
 
-from app.services import ImageCropperResizerAndSaver, session_store
+from app.services import create_thumbnails, session_store
 
 image_upload = Blueprint('image_upload', __name__)
 
@@ -20,17 +18,24 @@ def upload_images():
         if not images:
             return jsonify({'message': 'No images uploaded'}), 400
 
+        filenames = []
+        filepaths = []
         for img in images:
             filename = secure_filename(img.filename)
             filepath = os.path.join(directory_store.image_dir, filename)
             img.save(filepath)
+            filenames.append(filename)
+            filepaths.append(filepath)
 
-        # resize images
-        resizer = ImageCropperResizerAndSaver(images_directory=directory_store.image_dir,
-                                              new_images_directory=directory_store.resized_image_dir,
-                                              image_channels=3,
-                                              final_image_shape=(256, 256))
-        resizer.process_data()
+        # Record the uploaded files in the session's index
+        directory_store.get_file_index(directory_store.image_dir).add(filenames)
+
+        # create previews of only the files received in this upload
+        create_thumbnails(image_paths=filepaths,
+                          thumbnail_directory=directory_store.resized_image_dir,
+                          size=(256, 256),
+                          is_mask=False,
+                          channels=3)
 
         return jsonify({'success': True}), 200
 
@@ -39,6 +44,4 @@ def upload_images():
 
     finally:
         del images
-        clear_session()
-        gc.collect()
 
@@ -1,11 +1,9 @@
-import gc
 import os
 
 from flask import Blueprint, request, jsonify
-from tensorflow.keras.backend import clear_session
 from werkzeug.utils import secure_filename
 
-from app.services import ImageCropperResizerAndSaver, session_store
+from app.services import create_thumbnails, session_store
 
 mask_upload = Blueprint('mask_upload', __name__)
 
@@ -20,17 +18,24 @@ def upload_masks():
         if not masks:
             return jsonify({'message': 'No mask uploaded'}), 400
 
+        filenames = []
+        filepaths = []
         for mask in masks:
             filename = secure_filename(mask.filename)
             filepath = os.path.join(directory_store.mask_dir, filename)
             mask.save(filepath)
-
-        # resize images
-        resizer = ImageCropperResizerAndSaver(images_directory=directory_store.mask_dir,
-                                              new_images_directory=directory_store.resized_mask_dir,
-                                              image_channels=3,
-                                              final_image_shape=(256, 256))
-        resizer.process_data()
+            filenames.append(filename)
+            filepaths.append(filepath)
+
+        # Record the uploaded files in the session's index
+        directory_store.get_file_index(directory_store.mask_dir).add(filenames)
+
+        # create previews of only the files received in this upload
+        create_thumbnails(image_paths=filepaths,
+                          thumbnail_directory=directory_store.resized_mask_dir,
+                          size=(256, 256),
+                          is_mask=True,
+                          channels=3)
         return jsonify({'success': True}), 200
 
     except Exception as e:
@@ -38,5 +43,3 @@ def upload_masks():
 
     finally:
         del masks
-        clear_session()
-        gc.collect()
@@ -1,12 +1,8 @@
 import os
-import gc
 
 from flask import Blueprint, jsonify, request
 
-from app.services import ImageCropperResizerAndSaver
-from app.utils import list_filenames, get_file_extension
-from app.services import get_resized_dimension, session_store
-from tensorflow.keras.backend import clear_session
+from app.services import create_thumbnails, get_resized_dimension, session_store
 
 
 resize_data = Blueprint(name='resize_data', import_name=__name__)
@@ -18,30 +14,26 @@ def resize_original_images():
     try:
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
+        image_index = directory_store.get_file_index(directory_store.image_dir)
 
-        sample_img_name = list_filenames(directory_store.image_dir)[0]
+        sample_img_name = image_index.first()
         sample_img_path = str(os.path.join(directory_store.image_dir, sample_img_name))
 
         resize_height, resize_width, channels, original_height, original_width = get_resized_dimension(sample_img_path)
         session_store.set_image_dimension(session_id, original_height, original_width)
-        extension = get_file_extension(sample_img_name)
 
         # Resize images
-        image_resizer = ImageCropperResizerAndSaver(images_directory=directory_store.image_dir,
-                                                    new_images_directory=directory_store.resized_image_dir,
-                                                    image_channels=channels,
-                                                    final_image_shape=(resize_height, resize_width),
-                                                    image_save_format=extension)
-        image_resizer.process_data()
+        create_thumbnails(image_paths=[os.path.join(directory_store.image_dir, name) for name in image_index.names()],
+                          thumbnail_directory=directory_store.resized_image_dir,
+                          size=(resize_height, resize_width),
+                          channels=channels,
+                          skip_up_to_date=True,
+                          remove_orphans=True)
 
         return jsonify({'success': True, 'message': 'Uploaded images resized successfully!'}), 201
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        # clear Tensorflow session and garbage collect unused variables
-        clear_session()
-        gc.collect()
 
 
 @resize_data.route('/resize-uploaded-masks', methods=['POST'])
@@ -50,29 +42,23 @@ def resize_original_masks():
     try:
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
+        mask_index = directory_store.get_file_index(directory_store.mask_dir)
 
-        sample_img_name = list_filenames(directory_store.mask_dir)[0]
+        sample_img_name = mask_index.first()
         sample_img_path = str(os.path.join(directory_store.mask_dir, sample_img_name))
 
         resize_height, resize_width, channels, _ , _ = get_resized_dimension(sample_img_path)
-        extension = get_file_extension(sample_img_name)
-
 
         # Resize masks
-        mask_resizer = ImageCropperResizerAndSaver(images_directory=directory_store.mask_dir,
-                                                    new_images_directory=directory_store.resized_mask_dir,
-                                                    image_channels=channels,
-                                                    final_image_shape=(resize_height, resize_width),
-                                                   image_save_format=extension)
-        mask_resizer.process_data()
+        create_thumbnails(image_paths=[os.path.join(directory_store.mask_dir, name) for name in mask_index.names()],
+                          thumbnail_directory=directory_store.resized_mask_dir,
+                          size=(resize_height, resize_width),
+                          is_mask=True,
+                          channels=channels,
+                          skip_up_to_date=True,
+                          remove_orphans=True)
 
         return jsonify({'success': True, 'message': 'Uploaded masks resized successfully!'}), 201
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
-
-    finally:
-        # clear Tensorflow session and garbage collect unused variables
-        clear_session()
-        gc.collect()
-
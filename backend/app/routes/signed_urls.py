@@ -1,8 +1,7 @@
 from flask import Blueprint, jsonify, request
 from werkzeug.utils import secure_filename
 
-from app.services import generate_signed_url, session_store
-from app.utils import get_sorted_filenames
+from app.services import generate_signed_urls, session_store
 
 google_cloud_signed_urls = Blueprint('signed_urls', __name__)
 
@@ -19,16 +18,12 @@ def generate_signed_download_urls():
         if not filenames:
             return jsonify({'success': False, 'error': "Filename parameter is required"}), 400
 
-        signed_urls = []
         google_cloud_config = session_store.gcs_config
-        for filename in filenames:
-            secure_file = secure_filename(filename)
-            url = generate_signed_url(
-                session_id=session_id,
-                blob_name = f"{google_cloud_config.augmented_dir}/{secure_file}",
-                )
+        urls = generate_signed_urls(
+            session_id=session_id,
+            blob_names=[f"{google_cloud_config.augmented_dir}/{secure_filename(filename)}" for filename in filenames])
 
-            signed_urls.append({"filename": filename, "url": url})
+        signed_urls = [{"filename": filename, "url": url} for filename, url in zip(filenames, urls)]
 
         return jsonify({'success': True,
                         'count': len(signed_urls),
@@ -50,18 +45,23 @@ def generate_signed_upload_urls():
         folder_path = data.get('folder_path', '')
         session_id = request.args.get('sessionId')
 
-        signed_urls = []
+        # Use corresponding type if provided; default to application/octet-stream
+        file_content_types = [content_types[i] if i < len(content_types) else 'application/octet-stream'
+                              for i in range(len(filenames))]
 
-        for i, filename in enumerate(filenames):
-            # Use corresponding type if provided; default to application/octet-stream
-            content_type = content_types[i] if i < len(content_types) else 'application/octet-stream'
+        # Sign the URLs of the files that share a content type together.
+        urls = [None] * len(filenames)
+        for content_type in set(file_content_types):
+            indices = [i for i, file_content_type in enumerate(file_content_types) if file_content_type == content_type]
+            content_type_urls = generate_signed_urls(session_id=session_id,
+                                                     blob_names=[f"{folder_path}/{filenames[i]}" for i in indices],
+                                                     method="PUT",
+                                                     content_type=content_type)
+            for i, url in zip(indices, content_type_urls):
+                urls[i] = url
 
-            url = generate_signed_url(session_id=session_id,
-                                      blob_name=f"{folder_path}/{filename}",
-                                      method="PUT",
-                                      content_type=content_type)
-
-            signed_urls.append({"filename": filename, "url": url, "content_type": content_type})
+        signed_urls = [{"filename": filename, "url": url, "content_type": content_type}
+                       for filename, url, content_type in zip(filenames, urls, file_content_types)]
 
         return jsonify({'success': True,
                         'count': len(signed_urls),
@@ -71,182 +71,86 @@ def generate_signed_upload_urls():
         return jsonify({'error': str(e)}), 500
 
 
-def generate_signed_urls_for_resized_images_and_masks(session_id: str):
-    """Generate signed url for downloading the resized uploaded images and masks from GCS bucket."""
+# For each set of images and masks: the DirectoryStore attributes of the local images and masks directories, and the
+# GoogleCloudStorageConfig attributes of the GCS folders their resized copies are uploaded to.
+IMAGE_MASK_SETS = {
+    'resized': ('image_dir', 'mask_dir', 'resized_image_dir', 'resized_mask_dir'),
+    'train': ('train_image_dir', 'train_mask_dir', 'resized_train_images_dir', 'resized_train_masks_dir'),
+    'val': ('val_image_dir', 'val_mask_dir', 'resized_val_images_dir', 'resized_val_masks_dir'),
+    'test': ('test_image_dir', 'test_mask_dir', 'resized_test_images_dir', 'resized_test_masks_dir'),
+}
 
-    signed_resized_image_mask_urls = session_store.get_signed_resized_image_mask_urls(session_id=session_id)
 
-    if signed_resized_image_mask_urls is not None:
-        print(f"Returning cached signed URLs for resized images and masks")
-        return signed_resized_image_mask_urls  # Return cached URLs if already generated
+def get_image_mask_names(session_id: str, image_mask_set: str):
+    """
+    Returns the (image name, mask name) pairs of a set of images and masks, e.g. 'resized' or 'train'. The names are
+    those of the local files, or of the files augmentation streamed to the bucket, if it did.
+    """
+    image_dir, mask_dir, gcs_image_dir, gcs_mask_dir = IMAGE_MASK_SETS[image_mask_set]
+    google_cloud_config = session_store.gcs_config
+    image_names = session_store.get_streamed_filenames(session_id, getattr(google_cloud_config, gcs_image_dir))
+    mask_names = session_store.get_streamed_filenames(session_id, getattr(google_cloud_config, gcs_mask_dir))
 
-    try:
+    if not image_names or not mask_names:
         directory_store = session_store.get_directory_store(session_id=session_id)
-        image_names = get_sorted_filenames(directory_path=directory_store.image_dir)
-        mask_names = get_sorted_filenames(directory_path=directory_store.mask_dir)
+        image_names = directory_store.get_file_index(getattr(directory_store, image_dir)).names()
+        mask_names = directory_store.get_file_index(getattr(directory_store, mask_dir)).names()
 
-        if not image_names or not mask_names:
-            return []
+    if not image_names or not mask_names:
+        return []
+    return list(zip(image_names, mask_names))
 
-        signed_urls = []
-        google_cloud_config = session_store.gcs_config
-        for image_name, mask_name in zip(image_names, mask_names):
-            secure_image_name = secure_filename(image_name)
-            secure_mask_name = secure_filename(mask_name)
 
-            image_url = generate_signed_url(
-                session_id=session_id,
-                blob_name = f"{google_cloud_config.resized_image_dir}/{secure_image_name}")
+def sign_image_mask_urls(session_id: str, image_mask_set: str, name_pairs: list):
+    """
+    Signs download URLs for (image name, mask name) pairs of a set of images and masks. URLs that were signed before
+    and are not about to expire are reused.
+    """
+    _, _, gcs_image_dir, gcs_mask_dir = IMAGE_MASK_SETS[image_mask_set]
+    google_cloud_config = session_store.gcs_config
+    gcs_image_dir = getattr(google_cloud_config, gcs_image_dir)
+    gcs_mask_dir = getattr(google_cloud_config, gcs_mask_dir)
 
-            mask_url = generate_signed_url(
-                session_id=session_id,
-                blob_name = f"{google_cloud_config.resized_mask_dir}/{secure_mask_name}")
+    image_urls = generate_signed_urls(
+        session_id=session_id,
+        blob_names=[f"{gcs_image_dir}/{secure_filename(image_name)}" for image_name, _ in name_pairs])
+    mask_urls = generate_signed_urls(
+        session_id=session_id,
+        blob_names=[f"{gcs_mask_dir}/{secure_filename(mask_name)}" for _, mask_name in name_pairs])
 
-            signed_urls.append({"image": {"name": image_name, "url": image_url},
-                                "mask": {"name": mask_name, "url": mask_url}})
+    return [{"image": {"name": image_name, "url": image_url},
+             "mask": {"name": mask_name, "url": mask_url}}
+            for (image_name, mask_name), image_url, mask_url in zip(name_pairs, image_urls, mask_urls)]
 
-        # Store in cache
-        session_store.set_signed_resized_image_mask_urls(session_id=session_id,
-                                                         urls=signed_urls)
 
-        return signed_urls
+def generate_signed_urls_for_image_mask_set(session_id: str, image_mask_set: str):
+    """Generate signed urls for downloading all the images and masks of a set from GCS bucket."""
+    try:
+        return sign_image_mask_urls(session_id, image_mask_set, get_image_mask_names(session_id, image_mask_set))
 
     except Exception as e:
-        print(f"Error generating signed urls for resized original images and masks: {e}")
+        print(f"Error generating signed urls for {image_mask_set} images and masks: {e}")
         return []
 
 
-def generate_signed_urls_for_resized_train_set(session_id: str):
-    """Generate signed url for downloading the resized training images and masks from GCS bucket."""
-
-    signed_training_set_urls = session_store.get_signed_training_set_urls(session_id=session_id)
-
-    if signed_training_set_urls is not None:
-        print(f"Returning cached signed URLs for resized training images and masks")
-        return signed_training_set_urls  # Return cached URLs if already generated
-
-    try:
-        directory_store = session_store.get_directory_store(session_id=session_id)
-        image_names = get_sorted_filenames(directory_path=directory_store.train_image_dir)
-        mask_names = get_sorted_filenames(directory_path=directory_store.train_mask_dir)
-
-        if not image_names or not mask_names:
-            return []
-
-        signed_urls = []
-        google_cloud_config = session_store.gcs_config
-        for image_name, mask_name in zip(image_names, mask_names):
-            secure_image_name = secure_filename(image_name)
-            secure_mask_name = secure_filename(mask_name)
-
-            image_url = generate_signed_url(
-                session_id=session_id,
-                blob_name = f"{google_cloud_config.resized_train_images_dir}/{secure_image_name}")
-
-            mask_url = generate_signed_url(
-                session_id=session_id,
-                blob_name = f"{google_cloud_config.resized_train_masks_dir}/{secure_mask_name}")
-
-            signed_urls.append({"image": {"name": image_name, "url": image_url},
-                                "mask": {"name": mask_name, "url": mask_url}})
+def generate_signed_urls_for_resized_images_and_masks(session_id: str):
+    """Generate signed url for downloading the resized uploaded images and masks from GCS bucket."""
+    return generate_signed_urls_for_image_mask_set(session_id, 'resized')
 
-        # Store in cache
-        session_store.set_signed_training_set_urls(session_id=session_id,
-                                                   urls=signed_urls)
-        return signed_urls
 
-    except Exception as e:
-        print(f"Error generating signed urls for resized training set: {e}")
-        return []
+def generate_signed_urls_for_resized_train_set(session_id: str):
+    """Generate signed url for downloading the resized training images and masks from GCS bucket."""
+    return generate_signed_urls_for_image_mask_set(session_id, 'train')
 
 
 def generate_signed_urls_for_resized_validation_set(session_id: str):
     """Generate signed url for downloading the resized augmented validation images and masks from GCS bucket."""
-
-    signed_validation_set_urls = session_store.get_signed_validation_set_urls(session_id=session_id)
-
-    if signed_validation_set_urls is not None:
-        print(f"Returning cached signed URLs for resized validation images and masks")
-        return signed_validation_set_urls  # Return cached URLs if already generated
-
-    try:
-        directory_store = session_store.get_directory_store(session_id=session_id)
-        image_names = get_sorted_filenames(directory_path=directory_store.val_image_dir)
-        mask_names = get_sorted_filenames(directory_path=directory_store.val_mask_dir)
-
-        if not image_names or not mask_names:
-            return []
-
-        signed_urls = []
-        google_cloud_config = session_store.gcs_config
-        for image_name, mask_name in zip(image_names, mask_names):
-            secure_image_name = secure_filename(image_name)
-            secure_mask_name = secure_filename(mask_name)
-
-            image_url = generate_signed_url(
-                session_id=session_id,
-                blob_name=f"{google_cloud_config.resized_val_images_dir}/{secure_image_name}")
-
-            mask_url = generate_signed_url(
-                session_id=session_id,
-                blob_name=f"{google_cloud_config.resized_val_masks_dir}/{secure_mask_name}")
-
-            signed_urls.append({"image": {"name": image_name, "url": image_url},
-                                "mask": {"name": mask_name, "url": mask_url}})
-
-        # Store in cache
-        session_store.set_signed_validation_set_urls(session_id=session_id,
-                                                     urls=signed_urls)
-        return signed_urls
-
-    except Exception as e:
-        print(f"Error generating signed urls for resized validation set: {e}")
-        return []
+    return generate_signed_urls_for_image_mask_set(session_id, 'val')
 
 
 def generate_signed_urls_for_resized_test_set(session_id: str):
     """Generate signed url for downloading the resized augmented test images and masks from GCS bucket."""
-
-    signed_test_set_urls = session_store.get_signed_test_set_urls(session_id=session_id)
-
-    if signed_test_set_urls is not None:
-        print(f"Returning cached signed URLs for resized test images and masks")
-        return signed_test_set_urls  # Return cached URLs if already generated
-
-    try:
-        directory_store = session_store.get_directory_store(session_id=session_id)
-        image_names = get_sorted_filenames(directory_path=directory_store.test_image_dir)
-        mask_names = get_sorted_filenames(directory_path=directory_store.test_mask_dir)
-
-        if not image_names or not mask_names:
-            return []
-
-        signed_urls = []
-        google_cloud_config = session_store.gcs_config
-        for image_name, mask_name in zip(image_names, mask_names):
-            secure_image_name = secure_filename(image_name)
-            secure_mask_name = secure_filename(mask_name)
-
-            image_url = generate_signed_url(
-                session_id=session_id,
-                blob_name=f"{google_cloud_config.resized_test_images_dir}/{secure_image_name}")
-
-            mask_url = generate_signed_url(
-                session_id=session_id,
-                blob_name=f"{google_cloud_config.resized_test_masks_dir}/{secure_mask_name}")
-
-            signed_urls.append({"image": {"name": image_name, "url": image_url},
-                                "mask": {"name": mask_name, "url": mask_url}})
-
-        # Store in cache
-        session_store.set_signed_test_set_urls(session_id=session_id,
-                                               urls=signed_urls)
-
-        return signed_urls
-
-    except Exception as e:
-        print(f"Error generating signed urls for resized testing set: {e}")
-        return []
+    return generate_signed_urls_for_image_mask_set(session_id, 'test')
 
 
 @google_cloud_signed_urls.route('/reset-signed-urls-for-resized-images-and-masks', methods=['POST'])
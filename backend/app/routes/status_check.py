@@ -3,7 +3,7 @@ import os
 from flask import Blueprint, jsonify, request
 
 from app.services import session_store
-from app.utils import directory_exit, list_filenames
+from app.utils import directory_exit
 
 status_checks = Blueprint('status_checks', __name__)
 
@@ -16,7 +16,7 @@ def images_upload_status():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        count = len(list_filenames(directory_store.image_dir))
+        count = len(directory_store.get_file_index(directory_store.image_dir))
         if count > 0:
             return jsonify({'success': True, 'count': count,
                             'message': 'images uploaded successfully'}), 200
@@ -36,7 +36,7 @@ def masks_upload_status():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        masks_count = len(list_filenames(directory_store.mask_dir))
+        masks_count = len(directory_store.get_file_index(directory_store.mask_dir))
 
         if masks_count > 0:
             return jsonify({'success': True,
@@ -94,8 +94,8 @@ def image_mask_balance_status():
     try:
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
-        images_count = len(list_filenames(directory_store.image_dir))
-        masks_count = len(list_filenames(directory_store.mask_dir))
+        images_count = len(directory_store.get_file_index(directory_store.image_dir))
+        masks_count = len(directory_store.get_file_index(directory_store.mask_dir))
 
         if images_count == masks_count:
             return jsonify({'success': True,
@@ -16,7 +16,7 @@ def upload_stratification_file():
         files = request.files.getlist("stratificationDataFile")
 
         directory_store = session_store.get_directory_store(session_id=session_id)
-        no_of_images = len(list_filenames(directory_store.image_dir))
+        no_of_images = len(directory_store.get_file_index(directory_store.image_dir))
 
         if not files:
             return jsonify({'success': False, 'error': "No file was uploaded", 'results': []}), 400
@@ -2,7 +2,7 @@ from flask import Blueprint, jsonify, request
 
 from app.services import session_store
 from app.services.gcs_client import list_files_in_bucket_directory
-from app.utils import get_sorted_filenames, list_filenames
+from app.utils import list_filenames
 
 uploaded_file_names = Blueprint('uploaded_file_names', __name__)
 
@@ -39,7 +39,7 @@ def get_uploaded_image_names_from_backend():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        image_files = get_sorted_filenames(directory_path=directory_store.image_dir)
+        image_files = directory_store.get_file_index(directory_store.image_dir).names()
 
         return jsonify({'success': True, 'count': len(image_files), 'results': image_files }), 200
     except Exception as e:
@@ -52,7 +52,7 @@ def get_uploaded_mask_names_from_backend():
         session_id = request.args.get('sessionId')
         directory_store = session_store.get_directory_store(session_id)
 
-        mask_files = get_sorted_filenames(directory_path=directory_store.mask_dir)
+        mask_files = directory_store.get_file_index(directory_store.mask_dir).names()
 
         return jsonify({'success': True, 'count': len(mask_files), 'results': mask_files}), 200
     except Exception as e:
@@ -4,6 +4,7 @@ from .data_preprocessing import resize_image, resize_images_and_masks, ImageAndM
     ImageCropperResizerAndSaver
 
 from .gcs_client import (generate_signed_url,
+                         generate_signed_urls,
                          create_google_cloud_storage_bucket,
                          delete_google_cloud_storage_bucket,
                          delete_and_recreate_directories_in_gcs_bucket,
@@ -11,10 +12,20 @@ from .gcs_client import (generate_signed_url,
                          list_files_in_bucket_directory,
                          upload_file_to_gcs_bucket,
                          upload_files_to_gcs_bucket,
+                         sync_files_to_gcs_bucket,
                          download_files_from_gcs_folder,
                          get_bucket,
+                         get_transfer_bucket,
                          create_folders_in_bucket)
 
+from .gcs_clients import StorageClientRegistry, storage_clients
+from .gcs_transfer import TransferManager, TransferProgress, TransferResult, LocalBucket
+from .gcs_sync import DirectorySync, SyncCache, SyncResult, sync_cache
+
 from .resize_augmented_data import resize_augmented_data, get_resized_dimension
 from .validation import validate_stratification_data_file
 from .session_store import session_store
+from .thumbnails import create_thumbnail, create_thumbnails, load_thumbnail
+from .url_signer import BatchUrlSigner, SignedUrlCache
+from .storage_sink import BucketSink
+from .zip_writer import StreamingZipWriter
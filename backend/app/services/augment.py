@@ -1,20 +1,44 @@
+import multiprocessing
 import os
 import random
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import Union, Tuple
 import gc
+import hashlib
 import matplotlib.pyplot as plt
 import pandas as pd
 import tensorflow as tf
-from keras.layers import RandomRotation
 from skimage import io
 from sklearn.model_selection import StratifiedShuffleSplit
 from sklearn.model_selection import train_test_split
 
-from app.utils import create_directory
+from app.utils import LRUCache, check_uniform_dimensions, create_directory, link_or_copy_file, probe_image
+from app.services.data_preprocessing import (decode_jpeg_region, encode_image, get_decoded_jpeg_shape,
+                                             get_jpeg_decode_ratio, get_save_path, is_jpeg_format,
+                                             supports_native_encoding)
 from app.services.visual_attributes_service import VisualAttributesDatasetCreator
+from app.services.storage_sink import BucketSink
+from app.services.zip_writer import StreamingZipWriter
 import numpy as np
 
+# Colours found within each set of masks, keyed by the name, size and modification time of every mask, so the masks are
+# only scanned for their colours once per dataset rather than on every run, and again once any of them changes.
+MASK_PALETTE_CACHE_SIZE = 128
+
+_mask_palette_cache = LRUCache(max_size=MASK_PALETTE_CACHE_SIZE)
+
+# Random numbers drawn for each augmented variant, in the order they are drawn from the variant's seed (see
+# `_get_variant_uniforms`). Every variant draws all of them, whether or not the augmentation they drive is enabled.
+RANDOM_DRAWS = ('rotate', 'rotation_angle', 'crop', 'crop_percent', 'crop_offset_y', 'crop_offset_x',
+                'flip_left_right', 'flip_left_right_side', 'flip_up_down', 'flip_up_down_side',
+                'brightness', 'brightness_delta', 'contrast', 'contrast_factor', 'saturation', 'saturation_factor')
+
+# Index of each set within the seeds of its variants, so the variants of the same position in two sets differ.
+SET_SEED_INDICES = {'train': 0, 'val': 1, 'test': 2}
+
 
 class DataSplitterAugmenterAndSaver:
     def __init__(self,
@@ -32,6 +56,8 @@ class DataSplitterAugmenterAndSaver:
                  image_save_format: Union[str, None] = 'png',
                  image_save_prefix: str = 'img',
                  mask_save_prefix: str = 'mask',
+                 png_compression: int = -1,
+                 jpeg_quality: int = 95,
                  val_size: float = 0.2,
                  test_size: float = 0.2,
                  seed: int = None,
@@ -52,7 +78,14 @@ class DataSplitterAugmenterAndSaver:
                  visual_attributes: tuple = ('eccentricity', 'equivalent_diameter', 'feret_diameter_max',
                                              'filled_area', 'perimeter', 'roundness', 'L', 'a', 'b', 'contrast',
                                              'correlation', 'energy', 'entropy', 'homogeneity', 'uniformity'),
-                 parameter_for_stratified_splitting: str = 'a'):
+                 parameter_for_stratified_splitting: str = 'a',
+                 num_workers: int = 1,
+                 cache_memory_budget: int = 2 * 1024 ** 3,
+                 max_variants_per_step: int = 8,
+                 zip_writer: StreamingZipWriter = None,
+                 preview_directories: Union[dict, None] = None,
+                 preview_size: int = 256,
+                 storage_sink: BucketSink = None):
         """
         The DataSplitterAugmenterAndSaver class is used to split a directory containing images and masks, into training,
         validation and test set images and masks, saved in their respective folders.
@@ -101,6 +134,9 @@ class DataSplitterAugmenterAndSaver:
             assigned to seed.
         :param image_save_prefix: (str): Prefix for saving the images. By default, it is left blank.
         :param mask_save_prefix: (str): Prefix for saving the mask. By default, it is left blank.
+        :param png_compression: (int): zlib compression level (0 - 9) used when saving PNG images and masks. -1 uses
+            the zlib default. Lower values save faster, but produce larger files.
+        :param jpeg_quality: (int): Quality (0 - 100) used when saving JPEG images and masks.
         :param initial_save_id_train: (int): A number that would be used to save the first image and mask in the
             training_dataset. Eg. if it set to 5, and the image_save_prefix is 'img', the first image would be saved as
             'img_5.jpg'
@@ -134,6 +170,29 @@ class DataSplitterAugmenterAndSaver:
             adjusted during data augmentation
         :param corrupt_saturation: (bool): If True, the saturation of the images in the training set would be randomly
             adjusted during data augmentation
+        :param num_workers: (int): Number of worker processes used by `process_data`. If greater than 1, the training,
+            validation and test paths are split into contiguous shards that are processed in parallel, each in its own
+            process. Every image and mask is saved with the same index, and augmented in the same way, as it would be in
+            a single process run.
+        :param cache_memory_budget: (int): Maximum number of bytes of decoded images and masks kept in memory while
+            they are augmented multiple times. Samples beyond this budget are cached in a file within
+            `cache_directory` (or the system's temporary directory). With several workers, the budget is shared
+            between them.
+        :param max_variants_per_step: (int): Maximum number of augmented variants created at once from a decoded image
+            and mask. Variants are augmented as a batch, so this bounds the memory used by each step. When more
+            variants are needed, the decoded images and masks are read again from the cache.
+        :param zip_writer: (StreamingZipWriter): If provided, every image and mask is added to this archive as soon as
+            it is saved. PNG and JPEG files are archived from their encoded bytes, without being read back from disk.
+        :param preview_directories: (dict): If provided, a downscaled preview of every image and mask is saved while
+            it is still in memory, with the same file name. Maps 'train', 'val' and 'test' to a dictionary with the
+            'images' and 'masks' directories of their previews. Previews are only written for PNG and JPEG save
+            formats, and when the images are not placed in the split directories unchanged. Check `previews_written`
+            after running `process_data`.
+        :param preview_size: (int): Length of the smaller side of the previews. Images whose height or width is
+            already at most this size are previewed at their full size.
+        :param storage_sink: (BucketSink): If provided, the images, masks and previews are uploaded through the sink as
+            soon as they are encoded, instead of being written to their directories. Only used for PNG and JPEG save
+            formats. The sink cannot be shared with worker processes, so the data is processed in a single process.
         """
 
         apply_data_augmentation = any([random_crop,
@@ -185,22 +244,25 @@ class DataSplitterAugmenterAndSaver:
         mask_path = self.original_mask_paths[0]
         self.image_format = self._get_image_format(image_path=img_path)
         self.image_save_format = image_save_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+
+        # PNG and JPEG files are encoded and written inside the tf.data pipeline. Other formats fall back to skimage.
+        self.native_encoding = supports_native_encoding(image_save_format)
 
         # Choose the method for decoding images and masks
-        if self.image_format.lower() in ['.jpg', '.jpeg']:
-            self.decode_image = tf.image.decode_jpeg
-        elif self.image_format.lower() == '.png':
-            self.decode_image = tf.image.decode_png
-        elif self.image_format.lower() == '.bmp':
-            self.decode_image = tf.image.decode_bmp
-        else:
-            self.decode_image = tf.image.decode_png
+        self.decode_image = self._get_decoder(self.image_format)
 
         self.image_mask_channels = image_mask_channels
         self.image_channels = self.image_mask_channels[0]
         self.mask_channels = self.image_mask_channels[1]
 
         # set the initial shape of the images and masks.
+        # Masks with several channels are stored as a single channel map of class indices, during augmentation.
+        # These are the colours of the classes (set by `process_data`), and their keys (see `_get_mask_keys`).
+        self.mask_palette = None
+        self.mask_palette_keys = None
+
         self.image_shape, self.mask_shape = self._get_image_and_mask_shape(image_path=img_path,
                                                                            mask_path=mask_path)
 
@@ -223,8 +285,6 @@ class DataSplitterAugmenterAndSaver:
         self.train_subdirectories = {}
         self.validation_subdirectories = {}
         self.test_subdirectories = {}
-        self.image_save_directory = None
-        self.mask_save_directory = None
 
         self.training_image_paths = []
         self.training_mask_paths = []
@@ -251,16 +311,28 @@ class DataSplitterAugmenterAndSaver:
         self.flip_left_right = flip_left_right
         self.flip_up_down = flip_up_down
         self.random_rotate = random_rotate
-        self.rotate = RandomRotation(factor=0.3)
+        self.rotation_factor = 0.3
         self.corrupt_brightness = corrupt_brightness
         self.corrupt_contrast = corrupt_contrast
         self.corrupt_saturation = corrupt_saturation
         self.number_of_training_images_after_augmentation = number_of_training_images_after_augmentation
         self.iterations = None
+        self.variants_per_train_image = None
+        self.extra_train_variants = 0
         self.current_train_index = initial_save_id_train
         self.current_val_index = initial_save_id_val
         self.current_test_index = initial_save_id_test
         self.tune = tf.data.experimental.AUTOTUNE
+
+        self.storage_sink = storage_sink if supports_native_encoding(image_save_format) else None
+        self.num_workers = max(1, num_workers) if self.storage_sink is None else 1
+
+        # Share the CPUs between the worker processes, so they do not oversubscribe the machine.
+        if self.num_workers > 1:
+            self.private_threadpool_size = max(1, (os.cpu_count() or 1) // self.num_workers)
+        else:
+            self.private_threadpool_size = None
+
         self.training_dataset = None
         self.validation_dataset = None
         self.test_dataset = None
@@ -275,6 +347,27 @@ class DataSplitterAugmenterAndSaver:
             self.cache_directory = None
             self.train_cache = self.val_cache = self.test_cache = ''
 
+        self.max_variants_per_step = max(1, max_variants_per_step)
+
+        # Worker processes cannot share the archive, so they record the files they save, which are then archived by
+        # the main process.
+        self.zip_writer = zip_writer
+        self.collect_saved_files = False
+        self.saved_files = []
+
+        self.preview_directories = None
+        if preview_directories is not None and self.native_encoding:
+            self.preview_directories = {set_name: dict(directories)
+                                        for set_name, directories in preview_directories.items()}
+        self.preview_size = preview_size
+        self.previews_written = False
+
+        # Each worker process gets an equal share of the memory budget.
+        self.cache_memory_budget = cache_memory_budget // self.num_workers
+        self.cache_files_directories = []
+        # How `_read_and_cache` divides each set between the memory cache and the cache file.
+        self.cache_plan = {}
+
         if seed is None:
             self.seed = random.randint(0, 1000)
         else:
@@ -319,6 +412,59 @@ class DataSplitterAugmenterAndSaver:
             self.new_image_height = self.image_shape[0]
             self.new_image_width = self.image_shape[1]
 
+        # JPEG images that are cropped are decoded within their crop window only, and those that are downsized are
+        # decoded at the smallest DCT scale that is still larger than the final shape.
+        self.crop_window = ((self.offset_height, self.offset_width, self.target_height, self.target_width)
+                            if self.crop_image_and_mask else None)
+        self.decode_jpeg_region = is_jpeg_format(self.image_format) and (self.crop_image_and_mask or self.resize_images)
+        self.jpeg_decode_ratio = 1
+        if self.decode_jpeg_region and self.resize_images:
+            self.jpeg_decode_ratio = get_jpeg_decode_ratio(source_shape=tuple(self.image_shape)[:2],
+                                                           target_shape=(self.new_image_height, self.new_image_width),
+                                                           crop_window=self.crop_window)
+        if self.decode_jpeg_region:
+            self.decoded_image_shape = get_decoded_jpeg_shape(source_shape=tuple(self.image_shape)[:2],
+                                                              channels=tuple(self.image_shape)[2],
+                                                              ratio=self.jpeg_decode_ratio,
+                                                              crop_window=self.crop_window)
+        else:
+            self.decoded_image_shape = self.image_shape
+
+        self.preview_shape = self._get_preview_shape(height=self.new_image_height, width=self.new_image_width,
+                                                     preview_size=self.preview_size)
+
+    def __getstate__(self):
+        """
+        Drops the attributes that cannot be pickled (TensorFlow functions, Keras layers and datasets), so the
+        instance can be sent to the worker processes.
+        """
+        state = self.__dict__.copy()
+        for attribute in ['decode_image', 'training_dataset', 'validation_dataset', 'test_dataset',
+                          'vis_attribute_creator']:
+            state.pop(attribute, None)
+        state['collect_saved_files'] = self.zip_writer is not None
+        state['zip_writer'] = None
+        state['storage_sink'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.decode_image = self._get_decoder(self.image_format)
+        self.training_dataset = None
+        self.validation_dataset = None
+        self.test_dataset = None
+
+    @staticmethod
+    def _get_decoder(image_format: str):
+        """Returns the TensorFlow function for decoding images of the given format."""
+        if image_format.lower() in ['.jpg', '.jpeg']:
+            return tf.image.decode_jpeg
+        elif image_format.lower() == '.png':
+            return tf.image.decode_png
+        elif image_format.lower() == '.bmp':
+            return tf.image.decode_bmp
+        else:
+            return tf.image.decode_png
 
     @staticmethod
     def sort_filenames(file_paths):
@@ -350,14 +496,29 @@ class DataSplitterAugmenterAndSaver:
     def _get_image_format(image_path):
         return os.path.splitext(image_path)[-1]
 
-    def _get_image_and_mask_shape(self, image_path, mask_path):
-        image = tf.io.read_file(image_path)
-        image = self.decode_image(image, channels=self.image_channels)
+    @staticmethod
+    def _get_native_channels(image_path):
+        """Returns the number of channels stored in an image file."""
+        return probe_image(image_path).channels
 
-        mask = tf.io.read_file(mask_path)
-        mask = self.decode_image(mask, channels=self.mask_channels)
+    @staticmethod
+    def _normalize_format(image_format):
+        image_format = (image_format or '').lower().lstrip('.')
+        return 'jpg' if image_format == 'jpeg' else image_format
 
-        return image.shape, mask.shape
+    def _get_image_and_mask_shape(self, image_path, mask_path):
+        """
+        Returns the shapes of the decoded images and masks, read from the file headers. Every image and mask is probed
+        (in parallel), so uploads with mixed dimensions are rejected before the pipeline sets a shape that does not fit
+        them.
+        """
+        check_uniform_dimensions(self.original_image_paths + self.original_mask_paths)
+        image_info = probe_image(image_path)
+        mask_info = probe_image(mask_path)
+
+        image_shape = (image_info.height, image_info.width, self.image_channels or image_info.channels)
+        mask_shape = (mask_info.height, mask_info.width, self.mask_channels or mask_info.channels)
+        return tf.TensorShape(image_shape), tf.TensorShape(mask_shape)
 
     def _stratified_split(self, dataframe, test_size: float, first_split: bool = None):
         """
@@ -451,12 +612,7 @@ class DataSplitterAugmenterAndSaver:
         self.no_of_val_examples = len(val_image_paths)
         self.no_of_test_examples = len(test_image_paths)
 
-        # The number of the times the data augmentation step has to be run per iteration, inorder to produce enough
-        # training and validation examples, to produce the total number of training images and mask required.
-        if self.apply_data_augmentation:
-            self.iterations = max(1, -(-self.number_of_training_images_after_augmentation // self.no_of_train_examples))
-        else:
-            self.iterations = 1
+        self._set_number_of_variants()
 
     def _split_paths_using_visual_attributes(self):
         """
@@ -492,12 +648,27 @@ class DataSplitterAugmenterAndSaver:
         self.no_of_val_examples = len(self.validation_image_paths)
         self.no_of_test_examples = len(self.test_image_paths)
 
-        # The number of the times the data augmentation step has to run per iteration, inorder to produce enough
-        # training and validation examples, to produce the total number of training images and mask required.
-        if self.apply_data_augmentation:
+        self._set_number_of_variants()
+
+    def _set_number_of_variants(self):
+        """
+        Sets the number of augmented variants created from each image.
+
+        The training set produces exactly `number_of_training_images_after_augmentation` images (but never fewer than
+        one per training image): every training image gets `variants_per_train_image` variants, and the first
+        `extra_train_variants` images get one more. The validation and test sets, when augmented, get `iterations`
+        variants of each image.
+        """
+        if self.apply_data_augmentation and self.no_of_train_examples:
+            # The number of the times the data augmentation step has to be run, inorder to produce enough
+            # training and validation examples, to produce the total number of training images and mask required.
             self.iterations = max(1, -(-self.number_of_training_images_after_augmentation // self.no_of_train_examples))
+            self.variants_per_train_image, self.extra_train_variants = divmod(
+                max(self.number_of_training_images_after_augmentation, self.no_of_train_examples),
+                self.no_of_train_examples)
         else:
             self.iterations = 1
+            self.variants_per_train_image, self.extra_train_variants = 1, 0
 
     def _split_paths_into_train_val_test(self):
         """
@@ -547,22 +718,39 @@ class DataSplitterAugmenterAndSaver:
             self.test_subdirectories['masks'] = create_directory(
                 dir_name=os.path.join(self.test_directory, 'masks'), return_dir=True)
 
+    @staticmethod
+    def _get_preview_shape(height: int, width: int, preview_size: int):
+        """
+        Returns the (height, width) of the previews: the smaller side is reduced to `preview_size`, and the other is
+        scaled to maintain the aspect ratio. Images with a side of at most `preview_size` keep their size.
+        """
+        if height <= preview_size or width <= preview_size:
+            return height, width
+        if width < height:
+            return (preview_size * height) // width, preview_size
+        return preview_size, (preview_size * width) // height
+
+    def _create_preview_directories(self):
+        """Creates the directories where the previews of the saved sets are written."""
+        sets = ['train']
+        if self.val_directory is not None:
+            sets.append('val')
+        if self.test_directory is not None:
+            sets.append('test')
+
+        for set_name in sets:
+            for subdirectory in ['images', 'masks']:
+                self.preview_directories[set_name][subdirectory] = create_directory(
+                    dir_name=self.preview_directories[set_name][subdirectory], return_dir=True)
+
     def _set_original_shape(self, image, mask):
         """ Sets width and height information to the image and mask tensors.
 
         """
-        image.set_shape(self.image_shape)
+        image.set_shape(self.decoded_image_shape)
         mask.set_shape(self.mask_shape)
         return image, mask
 
-    def _set_final_shape(self, image, mask):
-        """
-        Sets width and height information to the image and mask tensors.
-        """
-        image.set_shape(self.final_image_shape)
-        mask.set_shape(self.final_mask_shape)
-        return image, mask
-
     def _read_and_decode_image_and_mask(self, image_path: str, mask_path: str):
         """
         Reads and decodes and image and its corresponding masks.
@@ -574,17 +762,109 @@ class DataSplitterAugmenterAndSaver:
         image = tf.io.read_file(image_path)
         mask = tf.io.read_file(mask_path)
 
-        image = self.decode_image(contents=image, channels=self.image_channels)
+        if self.decode_jpeg_region:
+            image = decode_jpeg_region(image, channels=self.image_channels, ratio=self.jpeg_decode_ratio,
+                                       crop_window=self.crop_window)
+        else:
+            image = self.decode_image(contents=image, channels=self.image_channels)
         mask = self.decode_image(contents=mask, channels=self.mask_channels)
         image, mask = self._set_original_shape(image, mask)
+
+        if self.mask_palette is not None:
+            mask = self._mask_to_class_indices(mask)
         return image, mask
 
+    @property
+    def _stored_mask_channels(self):
+        """Number of channels of the masks while they are augmented."""
+        return 1 if self.mask_palette is not None else self.mask_channels
+
+    def _get_mask_keys(self, mask):
+        """Packs the channels of each pixel of a uint8 mask into a single int64 key."""
+        weights = tf.constant([256 ** (self.mask_channels - 1 - channel) for channel in range(self.mask_channels)],
+                              dtype=tf.int64)
+        return tf.reduce_sum(tf.cast(mask, tf.int64) * weights, axis=-1)
+
+    def _get_unique_mask_keys(self, mask_path):
+        mask = self.decode_image(contents=tf.io.read_file(mask_path), channels=self.mask_channels)
+        return tf.unique(tf.reshape(self._get_mask_keys(mask), [-1])).y
+
+    def _find_mask_keys(self, max_classes: int):
+        """Returns the sorted keys of the colours within the masks, or None if there are more than `max_classes`."""
+        dataset = tf.data.Dataset.from_tensor_slices(self.original_mask_paths)
+        dataset = dataset.map(self._get_unique_mask_keys, num_parallel_calls=self.tune)
+
+        keys = set()
+        for mask_keys in dataset.as_numpy_iterator():
+            keys.update(mask_keys.tolist())
+            if len(keys) > max_classes:
+                return None
+        return np.array(sorted(keys), dtype=np.int64)
+
+    def _get_mask_palette_cache_key(self, max_classes: int):
+        """
+        Returns the key of the masks' palette in the cache. A mask overwritten under the same name changes its size or
+        modification time, but not necessarily the directory's, so every mask is part of the key.
+        """
+        digest = hashlib.sha1()
+        for mask_path in self.original_mask_paths:
+            stat = os.stat(mask_path)
+            digest.update(f'{os.path.basename(mask_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+        return os.path.abspath(self.masks_directory), digest.hexdigest(), self.mask_channels, max_classes
+
+    def _set_mask_palette(self, max_classes: int = 256):
+        """
+        Finds the colours used within the masks, in a parallel pass over the masks that is cached per set of
+        masks. When the masks have several channels and use at most `max_classes` colours, each mask is then stored as
+        a single channel map of class indices while it is augmented, and expanded back to its colours when it is saved.
+        """
+        if self.mask_channels == 1:
+            return
+
+        cache_key = self._get_mask_palette_cache_key(max_classes)
+        # Entries are wrapped in a tuple, so masks with too many colours (None) are cached too.
+        entry = _mask_palette_cache.get(cache_key)
+        if entry is None:
+            entry = (self._find_mask_keys(max_classes),)
+            _mask_palette_cache.set(cache_key, entry)
+
+        if entry[0] is None:
+            return
+
+        self.mask_palette_keys = entry[0]
+        self.mask_palette = np.stack([(self.mask_palette_keys // 256 ** (self.mask_channels - 1 - channel)) % 256
+                                      for channel in range(self.mask_channels)], axis=-1).astype(np.uint8)
+
+    def _mask_to_class_indices(self, mask):
+        """
+        Converts a mask to a (height, width, 1) map of the indices of its colours within the mask palette.
+
+        :raises tf.errors.InvalidArgumentError: if the mask has a colour that is not in the palette.
+        """
+        keys = self._get_mask_keys(mask)
+        flat_keys = tf.reshape(keys, [-1])
+        palette_keys = tf.constant(self.mask_palette_keys)
+
+        # searchsorted returns the position a missing colour would be inserted at, so it is checked to be a match.
+        indices = tf.minimum(tf.searchsorted(palette_keys, flat_keys), len(self.mask_palette_keys) - 1)
+        check = tf.debugging.assert_equal(tf.gather(palette_keys, indices), flat_keys,
+                                          message='A mask has a colour that is not in the palette of the masks.')
+        with tf.control_dependencies([check]):
+            indices = tf.identity(indices)
+        return tf.cast(tf.reshape(indices, tf.shape(keys))[..., tf.newaxis], tf.uint8)
+
+    def _class_indices_to_mask(self, mask):
+        """Expands a map of class indices back to the colours of the mask palette."""
+        return tf.gather(tf.constant(self.mask_palette), tf.cast(mask[..., 0], tf.int32))
+
     def _crop_image_and_mask(self, image, mask):
         """Crops out a portion of the image and mask."""
         # crop image and mask
         if self.crop_image_and_mask and self.crop_dimension is not None:
-            image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width,
-                                                  self.target_height, self.target_width)
+            # JPEG images were already cropped while they were decoded.
+            if not self.decode_jpeg_region:
+                image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width,
+                                                      self.target_height, self.target_width)
 
             # mask = tf.expand_dims(mask, axis=-1) if len(mask.shape) == 2 else mask
 
@@ -603,12 +883,11 @@ class DataSplitterAugmenterAndSaver:
             mask = tf.expand_dims(mask, axis=-1) if mask.ndim == 2 else mask
             mask = tf.image.resize(images=mask, size=(self.new_image_height, self.new_image_width),
                                    method='nearest')
-            mask = tf.reshape(tensor=mask, shape=(self.new_image_height, self.new_image_width, self.mask_channels))
+            mask = tf.reshape(tensor=mask, shape=(self.new_image_height, self.new_image_width,
+                                                  self._stored_mask_channels))
 
-            # The resize operation returns image & mask in float values (eg. 125.2, 233. 4),
-            # before augmentation, these pixel values need to be normalized to the range [0 - 1],
-            # because the tensorflow.keras augmentation layer only accept values in the normalize range of [0 - 1]. To ensure we correctly normalize , we will first
-            # round up the current float pixel intensities to whole numbers using tf.cast(image, tf.uint8).
+            # The resize operation returns image & mask in float values (eg. 125.2, 233. 4). The augmentation methods
+            # work directly on uint8 data, so the pixel intensities are cast back to whole numbers.
             image, mask = self._cast_image_mask_to_uint8(image, mask)
 
         return image, mask
@@ -619,29 +898,6 @@ class DataSplitterAugmenterAndSaver:
         mask = tf.cast(mask, tf.uint8)
         return image, mask
 
-    @staticmethod
-    def _cast_image_mask_to_float(image, mask):
-        image = tf.cast(image, tf.float32)
-        mask = tf.cast(mask, tf.float32)
-        return image, mask
-
-    @staticmethod
-    def _denormalize_image_mask_to_0_255(image, mask):
-        image = tf.image.convert_image_dtype(image, dtype=tf.uint8)
-        mask = tf.image.convert_image_dtype(mask, dtype=tf.uint8)
-        return image, mask
-
-    @staticmethod
-    def _normalize_image_mask_to_0_1(image, mask):
-        image = tf.image.convert_image_dtype(image, dtype=tf.float32)
-        mask = tf.image.convert_image_dtype(mask, dtype=tf.float32)
-        return image, mask
-
-    @staticmethod
-    def _normalize_image_to_0_1(image, mask):
-        image = tf.image.convert_image_dtype(image, dtype=tf.float32)
-        return image, mask
-
     def _step1_read_crop_and_resize(self, image_path: str, mask_path: str):
         """
         Reads and decodes and image and its corresponding masks.
@@ -660,139 +916,288 @@ class DataSplitterAugmenterAndSaver:
         image, mask = self._read_and_decode_image_and_mask(image_path=image_path, mask_path=mask_path)
         image, mask = self._crop_image_and_mask(image=image, mask=mask)
         image, mask = self._resize_image_and_mask(image=image, mask=mask)
-        image, mask = self._normalize_image_mask_to_0_1(image=image, mask=mask)
         return image, mask
 
-    def _random_rotate(self, image, mask):
-        """randomly rotates the image and mask"""
-        if self.random_rotate:
-            comb_tensor = tf.concat([image, mask], axis=-1)
-
-            # determine whether to rotate image and mask
-            cond_rotate = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), dtype=tf.bool)
-            rotated_tensor = tf.cond(cond_rotate,
-                                     true_fn=lambda: self.rotate(tf.expand_dims(comb_tensor, 0)),
-                                     false_fn=lambda: tf.identity(tf.expand_dims(comb_tensor, 0)))
-
-            rotated_tensor = tf.squeeze(rotated_tensor)
-            image, mask = tf.split(rotated_tensor, [self.image_channels, self.mask_channels], axis=-1)
-        return image, mask
+    def _get_variant_seeds(self, set_name: str, position, variants):
+        """
+        Returns the (count, 2) stateless seeds of variants of a sample. A seed only depends on the augmenter's seed,
+        the set, the sample's position within the full set and the variant's number, so a variant is augmented the
+        same way however the sets are sharded and whichever thread augments it.
+        """
+        key = (SET_SEED_INDICES[set_name] * 2 ** 56) + tf.cast(position, tf.int64) * 2 ** 16 + variants
+        return tf.stack([tf.fill(tf.shape(variants), tf.constant(self.seed, tf.int64)), key], axis=-1)
 
     @staticmethod
-    def _compute_crop_percent():
-        return tf.random.uniform(shape=[], minval=0.5, maxval=1, dtype=tf.float32)
-
-    def _random_crop(self, image, mask):
-        """ Randomly crop image and mask in accord"""
-        if self.random_crop:
-            # compute a percentage by which the image would be cropped
-            crop_percent = self._compute_crop_percent()
+    def _get_variant_uniforms(seeds):
+        """Returns a (count, len(RANDOM_DRAWS)) tensor of uniform numbers in [0, 1), drawn from each variant's seed."""
+        return tf.map_fn(lambda seed: tf.random.stateless_uniform([len(RANDOM_DRAWS)], seed=seed, dtype=tf.float32),
+                         seeds, fn_output_signature=tf.float32)
 
-            # Get the shape of image, so it can be resized after random crop
-            image_shape = image.shape
-            height = image_shape[0]
-            width = image_shape[1]
+    @staticmethod
+    def _draw(uniforms, name: str, minval: float = 0., maxval: float = 1.):
+        """Returns the `name` random number of each variant, scaled to [minval, maxval)."""
+        return minval + uniforms[:, RANDOM_DRAWS.index(name)] * (maxval - minval)
 
-            # extract and convert the shape of the frame to decimals/floats
-            shape = tf.cast(tf.shape(image), tf.float32)
+    def _random_condition(self, uniforms, name: str):
+        """Returns booleans that decide whether an augmentation method is applied to each variant."""
+        # Like a random integer in [0, augmentation_prob) cast to bool: False with probability 1 / augmentation_prob.
+        return tf.floor(self._draw(uniforms, name) * self.augmentation_prob) > 0
 
-            h = tf.cast(shape[0] * crop_percent, tf.int32)
-            w = tf.cast(shape[1] * crop_percent, tf.int32)
+    @staticmethod
+    def _stack_matrices(rows):
+        """Stacks a 3x3 nested list of (count,) tensors into a (count, 3, 3) tensor."""
+        return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=-2)
 
-            # concatenate the image and the mask
-            comb_tensor = tf.concat([image, mask], axis=-1)
+    @staticmethod
+    def _transform_or_identity(condition, matrices):
+        identity = tf.eye(3, batch_shape=tf.shape(condition), dtype=tf.float32)
+        return tf.where(condition[:, tf.newaxis, tf.newaxis], matrices, identity)
 
-            # Generates a conditional if cond_crop_image is True or False
-            cond_crop_image = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), tf.bool)
+    def _get_rotation_matrices(self, height, width, uniforms):
+        """
+        Returns the matrices that map each pixel of the rotated frames to the frame before the rotation. Each frame is
+        rotated about its centre by a random angle within +/- rotation_factor * 2pi.
+        """
+        max_angle = self.rotation_factor * 2 * np.pi
+        angle = self._draw(uniforms, 'rotation_angle', minval=-max_angle, maxval=max_angle)
+        cos, sin = tf.cos(angle), tf.sin(angle)
+        zeros, ones = tf.zeros_like(angle), tf.ones_like(angle)
+        center_x = (width - 1) / 2
+        center_y = (height - 1) / 2
+        matrices = self._stack_matrices([[cos, -sin, center_x - cos * center_x + sin * center_y],
+                                         [sin, cos, center_y - sin * center_x - cos * center_y],
+                                         [zeros, zeros, ones]])
+        return self._transform_or_identity(self._random_condition(uniforms, 'rotate'), matrices)
+
+    def _get_crop_matrices(self, height, width, uniforms):
+        """
+        Returns the matrices that map each pixel of the full-size frames to a random crop of the frame before it was
+        cropped, i.e. a random crop followed by a resize back to (height, width).
+        """
+        crop_percent = self._draw(uniforms, 'crop_percent', minval=0.5, maxval=1.)
+        crop_height = tf.floor(height * crop_percent)
+        crop_width = tf.floor(width * crop_percent)
+
+        offset_y = tf.floor(self._draw(uniforms, 'crop_offset_y') * (height - crop_height + 1))
+        offset_x = tf.floor(self._draw(uniforms, 'crop_offset_x') * (width - crop_width + 1))
+
+        # Resizing uses half-pixel centres: source = (destination + 0.5) * scale - 0.5
+        scale_y = crop_height / height
+        scale_x = crop_width / width
+        zeros, ones = tf.zeros_like(scale_x), tf.ones_like(scale_x)
+        matrices = self._stack_matrices([[scale_x, zeros, 0.5 * scale_x - 0.5 + offset_x],
+                                         [zeros, scale_y, 0.5 * scale_y - 0.5 + offset_y],
+                                         [zeros, zeros, ones]])
+        return self._transform_or_identity(self._random_condition(uniforms, 'crop'), matrices)
+
+    def _get_flip_matrices(self, height, width, uniforms, left_right: bool):
+        """Returns the matrices of random left-right or up-down flips."""
+        name = 'flip_left_right' if left_right else 'flip_up_down'
+        # As with tf.image.random_flip_*, a selected frame is flipped half of the time.
+        condition = tf.logical_and(self._random_condition(uniforms, name),
+                                   self._draw(uniforms, f'{name}_side') < 0.5)
+        count = tf.shape(uniforms)[0]
+        zeros, ones = tf.zeros([count], tf.float32), tf.ones([count], tf.float32)
+        if left_right:
+            matrices = self._stack_matrices([[-ones, zeros, (width - 1) * ones],
+                                             [zeros, ones, zeros],
+                                             [zeros, zeros, ones]])
+        else:
+            matrices = self._stack_matrices([[ones, zeros, zeros],
+                                             [zeros, -ones, (height - 1) * ones],
+                                             [zeros, zeros, ones]])
+        return self._transform_or_identity(condition, matrices)
 
-            comb_tensor = tf.cond(cond_crop_image,
-                                  lambda: tf.image.random_crop(
-                                      value=comb_tensor,
-                                      size=[h, w, self.image_channels + self.mask_channels],
-                                      seed=self.seed),
-                                  lambda: tf.identity(comb_tensor))
+    def _get_geometric_transforms(self, height, width, uniforms):
+        """
+        Composes the enabled geometric augmentations (rotation, random crop, left-right and up-down flips, applied in
+        that order) of each variant into one 3x3 matrix that maps each output pixel to its source location.
+        """
+        transforms = tf.eye(3, batch_shape=tf.shape(uniforms)[:1], dtype=tf.float32)
+        if self.random_rotate:
+            transforms = tf.matmul(transforms, self._get_rotation_matrices(height, width, uniforms))
+        if self.random_crop:
+            transforms = tf.matmul(transforms, self._get_crop_matrices(height, width, uniforms))
+        if self.flip_left_right:
+            transforms = tf.matmul(transforms, self._get_flip_matrices(height, width, uniforms, left_right=True))
+        if self.flip_up_down:
+            transforms = tf.matmul(transforms, self._get_flip_matrices(height, width, uniforms, left_right=False))
+        return transforms
 
-            comb_tensor = tf.cond(cond_crop_image,
-                                  lambda: tf.image.resize(images=comb_tensor, size=(height, width), method='nearest'),
-                                  lambda: tf.identity(comb_tensor))
+    @staticmethod
+    def _warp(frames, transforms, interpolation: str):
+        """
+        Applies one projective transform (in the 8 parameter form used by TensorFlow) to each of the (N, H, W, C)
+        frames.
+        """
+        warped = tf.raw_ops.ImageProjectiveTransformV3(images=frames,
+                                                       transforms=transforms,
+                                                       output_shape=tf.shape(frames)[1:3],
+                                                       fill_value=tf.constant(0, tf.float32),
+                                                       interpolation=interpolation,
+                                                       fill_mode='REFLECT')
+        warped.set_shape(frames.shape)
+        return warped
+
+    def _geometric_augmentation(self, images, masks, uniforms):
+        """
+        Randomly rotates, crops and flips each variant of the image and mask in accord, in a single pass over each
+        frame. The images are resampled bilinearly, while the masks use nearest neighbour sampling so no new labels
+        are created.
 
-            image, mask = tf.split(comb_tensor, [self.image_channels, self.mask_channels], axis=-1)
-            image, mask = self._set_final_shape(image, mask)
+        :param uniforms: (tensor) random numbers of each variant (see `_get_variant_uniforms`).
+        """
+        if not any([self.random_rotate, self.random_crop, self.flip_left_right, self.flip_up_down]):
+            return images, masks
+
+        shape = tf.cast(tf.shape(images), tf.float32)
+        count = tf.shape(images)[0]
+        transforms = self._get_geometric_transforms(height=shape[1], width=shape[2], uniforms=uniforms)
+        is_identity = tf.reduce_all(tf.equal(transforms, tf.eye(3, dtype=tf.float32)))
+
+        transforms = tf.reshape(transforms / transforms[:, 2:, 2:], [count, 9])[:, :8]
+        images = tf.cond(is_identity,
+                         lambda: tf.identity(images),
+                         lambda: self._warp(images, transforms, interpolation='BILINEAR'))
+        masks = tf.cond(is_identity,
+                        lambda: tf.identity(masks),
+                        lambda: self._warp(masks, transforms, interpolation='NEAREST'))
+        return images, masks
+
+    def _sample_photometric_parameters(self, uniforms):
+        """
+        Samples the parameters of every enabled colour augmentation for each variant. Disabled or unselected
+        augmentations get parameters that leave the image unchanged.
 
-        return image, mask
+        :return: (tensors) brightness deltas (in the range [-51, 51]), contrast factors and saturation factors.
+        """
+        count = tf.shape(uniforms)[0]
+        brightness_delta = tf.zeros([count], tf.float32)
+        contrast_factor = tf.ones([count], tf.float32)
+        saturation_factor = tf.ones([count], tf.float32)
 
-    def _corrupt_brightness(self, image, mask):
-        """Randomly applies a random brightness change"""
         if self.corrupt_brightness:
-            # determine if the image's brightness should be altered.
-            cond_brightness = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), tf.bool)
-
-            image = tf.cond(cond_brightness,
-                            lambda: tf.image.random_brightness(image, 0.2),
-                            lambda: tf.identity(image))
-        return image, mask
-
-    def _corrupt_contrast(self, image, mask):
-        """Randomly applies a random contrast the frame"""
+            brightness_delta = tf.where(self._random_condition(uniforms, 'brightness'),
+                                        self._draw(uniforms, 'brightness_delta', minval=-0.2, maxval=0.2) * 255.,
+                                        brightness_delta)
         if self.corrupt_contrast:
-            cond_contrast = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), tf.bool)
-            image = tf.cond(cond_contrast,
-                            lambda: tf.image.random_contrast(image, 0.1, 0.8),
-                            lambda: tf.identity(image))
-        return image, mask
+            contrast_factor = tf.where(self._random_condition(uniforms, 'contrast'),
+                                       self._draw(uniforms, 'contrast_factor', minval=0.1, maxval=0.8),
+                                       contrast_factor)
+        if self.corrupt_saturation and self.image_channels == 3:
+            saturation_factor = tf.where(self._random_condition(uniforms, 'saturation'),
+                                         self._draw(uniforms, 'saturation_factor', minval=0.1, maxval=0.8),
+                                         saturation_factor)
+        return brightness_delta, contrast_factor, saturation_factor
 
-    def _corrupt_saturation(self, image, mask):
-        """Randomly adjusts the saturation of an image."""
-        if self.corrupt_saturation:
-            cond_saturation = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), tf.bool)
-            image = tf.cond(cond_saturation,
-                            lambda: tf.image.random_saturation(image, 0.1, 0.8),
-                            lambda: tf.identity(image))
-        return image, mask
+    @staticmethod
+    def _get_brightness_contrast_tables(channel_mean, brightness_delta, contrast_factor):
+        """
+        Returns (count, 256, channels) lookup tables applying a brightness shift followed by a contrast change.
+        `channel_mean` holds the (count, 1, channels) channel means of the variants, or zeros without a contrast change.
 
-    def _flip_left_right(self, image, mask):
+        Brightness adds a delta to every pixel, and contrast scales each channel about its mean:
+        (x + delta - mean(x + delta)) * factor + mean(x + delta) = factor * x + (1 - factor) * mean(x) + delta,
+        so both reduce to one affine map per channel.
         """
-        Randomly flips image and mask left or fight in accord.
+        values = tf.range(256, dtype=tf.float32)[tf.newaxis, :, tf.newaxis]
+        contrast_factor = contrast_factor[:, tf.newaxis, tf.newaxis]
+        brightness_delta = brightness_delta[:, tf.newaxis, tf.newaxis]
+        tables = contrast_factor * values + (1. - contrast_factor) * channel_mean + brightness_delta
+        return tf.cast(tf.clip_by_value(tf.round(tables), 0., 255.), tf.uint8)
+
+    def _apply_tables(self, images, tables):
+        """Maps every pixel of a batch of uint8 images through the lookup table of its image and channel."""
+        shape = tf.shape(images)
+        channels = []
+        for channel in range(self.image_channels):
+            pixels = tf.reshape(tf.cast(images[..., channel], tf.int32), [shape[0], shape[1] * shape[2]])
+            pixels = tf.gather(tables[:, :, channel], pixels, batch_dims=1)
+            channels.append(tf.reshape(pixels, shape[:-1]))
+        return tf.stack(channels, axis=-1)
+
+    @staticmethod
+    def _adjust_saturation(images, saturation_factor):
         """
-        if self.flip_left_right:
-            cond_flip_left_right = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32),
-                                           tf.bool)
-
-            comb_tensor = tf.concat([image, mask], axis=2)
-            comb_tensor = tf.cond(cond_flip_left_right,
-                                  lambda: tf.image.random_flip_left_right(image=comb_tensor, seed=self.seed),
-                                  lambda: tf.identity(comb_tensor))
-            image, mask = tf.split(comb_tensor, [self.image_channels, self.mask_channels], axis=2)
-        return image, mask
+        Blends each RGB pixel with its grey level, using a single 3x3 colour matrix per image:
+        output = factor * pixel + (1 - factor) * luma(pixel).
+        """
+        luma_weights = tf.repeat(tf.constant([[0.299, 0.587, 0.114]], tf.float32), 3, axis=0)
+        saturation_factor = saturation_factor[:, tf.newaxis, tf.newaxis]
+        matrices = saturation_factor * tf.eye(3, dtype=tf.float32) + (1. - saturation_factor) * luma_weights
+        images = tf.einsum('nij,nhwj->nhwi', matrices, tf.cast(images, tf.float32))
+        return tf.cast(tf.clip_by_value(tf.round(images), 0., 255.), tf.uint8)
 
-    def _flip_up_down(self, image, mask):
+    def _photometric_augmentation(self, images, masks, uniforms):
         """
-        Randomly flip up side down
+        Randomly alters the brightness, contrast and saturation of each variant of a uint8 image in a single pass.
+        Brightness and contrast are applied through a per-channel lookup table, and saturation through a colour
+        matrix. The contrast of each variant is scaled about the channel means of that variant, as it is after the
+        geometric augmentation. The masks are left unchanged.
+
+        :param uniforms: (tensor) random numbers of each variant (see `_get_variant_uniforms`).
         """
-        if self.flip_up_down:
-            cond_flip_up_down = tf.cast(tf.random.uniform([], maxval=self.augmentation_prob, dtype=tf.int32), tf.bool)
+        if not any([self.corrupt_brightness, self.corrupt_contrast, self.corrupt_saturation]):
+            return images, masks
 
-            comb_tensor = tf.concat([image, mask], axis=2)
-            comb_tensor = tf.cond(cond_flip_up_down,
-                                  lambda: tf.image.random_flip_up_down(comb_tensor, seed=self.seed),
-                                  lambda: tf.identity(comb_tensor))
-            image, mask = tf.split(comb_tensor, [self.image_channels, self.mask_channels], axis=2)
-        return image, mask
+        images_shape = images.shape
+        brightness_delta, contrast_factor, saturation_factor = self._sample_photometric_parameters(uniforms)
 
-    def _augment_image_and_mask(self, image, mask):
-        """Augments the image and mask."""
-        if self.apply_data_augmentation:
-            image, mask = self._random_rotate(image, mask)
-            image, mask = self._random_crop(image, mask)
-            image, mask = self._corrupt_brightness(image, mask)
-            image, mask = self._corrupt_contrast(image, mask)
-            image, mask = self._corrupt_saturation(image, mask)
-            image, mask = self._flip_left_right(image, mask)
-            image, mask = self._flip_up_down(image, mask)
-        return image, mask
+        adjust_tables = tf.reduce_any(tf.logical_or(tf.not_equal(brightness_delta, 0.),
+                                                    tf.not_equal(contrast_factor, 1.)))
+        if self.corrupt_contrast:
+            channel_mean = tf.reduce_mean(tf.cast(images, tf.float32), axis=[1, 2])[:, tf.newaxis, :]
+        else:
+            channel_mean = tf.zeros([self.image_channels], tf.float32)
+        images = tf.cond(adjust_tables,
+                         lambda: self._apply_tables(images, self._get_brightness_contrast_tables(
+                             channel_mean, brightness_delta, contrast_factor)),
+                         lambda: tf.identity(images))
+
+        if self.corrupt_saturation and self.image_channels == 3:
+            images = tf.cond(tf.reduce_any(tf.not_equal(saturation_factor, 1.)),
+                             lambda: self._adjust_saturation(images, saturation_factor),
+                             lambda: tf.identity(images))
 
-    def _save_data(self, index, image, mask):
+        images.set_shape(images_shape)
+        return images, masks
+
+    def _augment_variants(self, image, mask, seeds):
+        """
+        Creates augmented variants of an image and its mask, one per seed. The augmentation parameters of each variant
+        are drawn from its own seed, and the variants are augmented as a batch.
+
+        :param image: (tensor) uint8 image
+        :param mask: (tensor) uint8 mask
+        :param seeds: (tensor) (count, 2) stateless seeds of the variants (see `_get_variant_seeds`)
+        :return: (tensors) batches of `count` images and masks
+        """
+        count = tf.shape(seeds)[0]
+        uniforms = self._get_variant_uniforms(seeds)
+        images = tf.repeat(tf.expand_dims(image, 0), count, axis=0)
+        masks = tf.repeat(tf.expand_dims(mask, 0), count, axis=0)
+        images, masks = self._geometric_augmentation(images, masks, uniforms)
+        images, masks = self._photometric_augmentation(images, masks, uniforms)
+        return images, masks
+
+    @property
+    def _archive_saved_files(self):
+        return self.zip_writer is not None or self.collect_saved_files
+
+    def _archive(self, file_path: str, data: bytes = None):
+        """Adds a saved file to the archive (from its content, if available), or records it in a worker process."""
+        if self.zip_writer is not None:
+            if data is None:
+                self.zip_writer.add_file(file_path)
+            else:
+                self.zip_writer.add_bytes(file_path, data)
+        elif self.collect_saved_files:
+            self.saved_files.append(file_path)
+
+    def _save_data(self, index, image, mask, image_directory, mask_directory):
         """saves the image and mask."""
+        image_directory = image_directory.numpy().decode()
+        mask_directory = mask_directory.numpy().decode()
 
         if image.shape[-1] == 1:  # Single-channel (H, W, 1)
             image = np.squeeze(image, axis=-1)  # Remove last dimension -> (H, W) so it can be saved as grayscale
@@ -800,133 +1205,495 @@ class DataSplitterAugmenterAndSaver:
         if mask.shape[-1] == 1:  # Single-channel (H, W, 1)
             mask = np.squeeze(mask, axis=-1)  # Remove last dimension -> (H, W) so it can be saved as grayscale
 
-        io.imsave(fname=f'{self.image_save_directory}/{self.image_save_prefix}_{index}.{self.image_save_format}',
-                  arr=image, check_contrast=False)
+        image_path = os.path.join(image_directory, f'{self.image_save_prefix}_{index}.{self.image_save_format}')
+        mask_path = os.path.join(mask_directory, f'{self.mask_save_prefix}_{index}.{self.image_save_format}')
+
+        io.imsave(fname=image_path, arr=image, check_contrast=False)
+        io.imsave(fname=mask_path, arr=mask, check_contrast=False)
 
-        io.imsave(fname=f'{self.mask_save_directory}/{self.mask_save_prefix}_{index}.{self.image_save_format}',
-                  arr=mask, check_contrast=False)
+        self._archive(image_path)
+        self._archive(mask_path)
 
         return index
 
-    def _tf_save_data(self, index, image, mask):
+    def _write_data(self, index, image, mask, directories: dict):
+        """
+        Encodes and writes the image and mask without leaving the TensorFlow graph.
+
+        :param directories: (dict) the save directories of the image and mask's set. See `_get_save_directories`.
+        :return: The save index or, when the saved files are archived, the path and encoded content of the image
+            and the mask. With a storage sink, the path and encoded content of the image, the mask and their previews.
+        """
+        image_path = get_save_path(directories['images'], self.image_save_prefix, index, self.image_save_format)
+        mask_path = get_save_path(directories['masks'], self.mask_save_prefix, index, self.image_save_format)
+
+        encoded_image = encode_image(image, image_format=self.image_save_format,
+                                     png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+        encoded_mask = encode_image(mask, image_format=self.image_save_format,
+                                    png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+
+        files = [(image_path, encoded_image), (mask_path, encoded_mask)]
+        if self.preview_directories is not None:
+            files += self._encode_previews(index, image, mask, encoded_image, encoded_mask, directories)
+
+        # Files for the storage sink are returned as (path, content) pairs, and uploaded by `_save_dataset`.
+        if self.storage_sink is not None:
+            return tuple(tensor for file in files for tensor in file)
+
+        write_ops = [tf.io.write_file(file_path, contents) for file_path, contents in files]
+        with tf.control_dependencies(write_ops):
+            if self._archive_saved_files:
+                return (tf.identity(image_path), tf.identity(encoded_image),
+                        tf.identity(mask_path), tf.identity(encoded_mask))
+            return tf.identity(index)
+
+    def _encode_previews(self, index, image, mask, encoded_image, encoded_mask, directories: dict):
+        """
+        Encodes the previews of an image and its mask. The image is downscaled bilinearly, and the mask with nearest
+        neighbour sampling so it keeps its labels. When no downscaling is needed, the encoded image and mask are
+        used as they are.
+
+        :return: The (path, encoded content) of the image's and the mask's previews.
+        """
+        image_path = get_save_path(directories['preview_images'], self.image_save_prefix, index,
+                                   self.image_save_format)
+        mask_path = get_save_path(directories['preview_masks'], self.mask_save_prefix, index, self.image_save_format)
+
+        if tuple(self.preview_shape) == (self.new_image_height, self.new_image_width):
+            return [(image_path, encoded_image), (mask_path, encoded_mask)]
+
+        preview_image = tf.image.resize(image, size=self.preview_shape, method='bilinear')
+        preview_image = tf.saturate_cast(tf.round(preview_image), tf.uint8)
+        preview_mask = tf.image.resize(mask, size=self.preview_shape, method='nearest')
+
+        return [(image_path, encode_image(preview_image, image_format=self.image_save_format,
+                                          png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)),
+                (mask_path, encode_image(preview_mask, image_format=self.image_save_format,
+                                         png_compression=self.png_compression, jpeg_quality=self.jpeg_quality))]
+
+    def _tf_save_data(self, index, image, mask, directories: dict):
+        if self.mask_palette is not None:
+            mask = self._class_indices_to_mask(mask)
+
+        if self.native_encoding:
+            return self._write_data(index, image, mask, directories)
+
         index_shape = index.shape
-        [index, ] = tf.py_function(func=self._save_data, inp=[index, image, mask], Tout=[tf.int64])
+        [index, ] = tf.py_function(func=self._save_data,
+                                   inp=[index, image, mask, directories['images'], directories['masks']],
+                                   Tout=[tf.int64])
         index.set_shape(index_shape)
         return index
 
-    # Get training, validation and test sets
-    def _process_and_save_training_data(self, image_paths, mask_paths):
+    def _save_dataset(self, dataset):
         """
-        Prepares shuffled batches of the training set.
+        Runs the dataset, whose elements are saved as they are produced, and archives the saved files. With a storage
+        sink, the files are uploaded here; this blocks while the sink's upload window is full, which holds the
+        pipeline back to the speed of the uploads.
+        """
+        archive_encoded_data = self.native_encoding and self._archive_saved_files
+        for element in dataset.as_numpy_iterator():
+            if self.storage_sink is not None:
+                for file_path, contents in zip(element[::2], element[1::2]):
+                    self.storage_sink.write(file_path.decode(), contents)
+
+            if archive_encoded_data:
+                image_path, encoded_image, mask_path, encoded_mask = element[:4]
+                self._archive(image_path.decode(), encoded_image)
+                self._archive(mask_path.decode(), encoded_mask)
+
+    def _read_dataset(self, image_paths, mask_paths, positions):
+        """
+        Creates a dataset of (position, image, mask), where position is the index of the image and mask within the
+        full (unsharded) list of paths of their set.
+        """
+        dataset = tf.data.Dataset.from_tensor_slices((tf.constant(positions, tf.int64), image_paths, mask_paths))
+        dataset = dataset.map(lambda position, image_path, mask_path: (
+            position, *self._step1_read_crop_and_resize(image_path=image_path, mask_path=mask_path)),
+                              num_parallel_calls=self.tune)
+        return self._apply_dataset_options(dataset)
+
+    def _fan_out(self, dataset, set_name: str, number_of_variants: int, augment: bool, shard_size: int,
+                 extra_variants: int = 0):
+        """
+        Turns a dataset of (position, image, mask) into a dataset of (position, variant, image, mask), holding
+        `number_of_variants` variants of every sample, plus one more for the samples at a position below
+        `extra_variants`.
+
+        Up to `max_variants_per_step` variants of a sample are created from a single read of the sample. When more
+        variants are needed, the dataset must be repeated once per group of variants (see `_get_number_of_passes`);
+        its k-th element then belongs to pass k // shard_size.
+
+        :param dataset: tf Dataset of (position, image, mask)
+        :param set_name: (str) 'train', 'val' or 'test', which the seeds of the variants depend on.
+        :param number_of_variants: (int) number of variants created from each sample.
+        :param augment: (bool) if False, each sample is passed on unchanged as variant 0.
+        :param shard_size: (int) number of samples in one pass over the dataset.
+        :param extra_variants: (int) number of samples (counted from position 0 of the full set) that get an
+            extra variant.
+        """
+        if not augment:
+            return dataset.map(lambda position, image, mask: (position, tf.constant(0, tf.int64), image, mask))
 
-        :param image_paths: (list) paths to each image file in the training set
-        :param mask_paths: (list) paths to each mask in the training set
-        :return: tf Dataset containing the preprocessed training set
-        """
-        training_dataset = tf.data.Dataset.from_tensor_slices((image_paths, mask_paths))
-        training_dataset = training_dataset.map(self._step1_read_crop_and_resize, num_parallel_calls=self.tune)
-        training_dataset = training_dataset.cache(self.train_cache)
-        training_dataset = training_dataset.repeat(count=self.iterations) if \
-            self.apply_data_augmentation else training_dataset.repeat(count=1)
-        training_dataset = training_dataset.map(self._augment_image_and_mask, num_parallel_calls=self.tune)
-        training_dataset = training_dataset.map(self._denormalize_image_mask_to_0_255, num_parallel_calls=self.tune)
-
-        counter = tf.data.Dataset.counter(start=self.current_train_index)
-        training_dataset = tf.data.Dataset.zip((counter, training_dataset))
-        training_dataset = training_dataset.map(lambda x, y: (x, y[0], y[1]))
-        self.training_dataset = training_dataset
+        variants_per_step = min(number_of_variants + (1 if extra_variants else 0), self.max_variants_per_step)
+        shard_size = max(1, shard_size)
 
-        self.image_save_directory = self.train_subdirectories['images']
-        self.mask_save_directory = self.train_subdirectories['masks']
+        def create_variants(k, sample):
+            position, image, mask = sample
+            first_variant = (k // shard_size) * variants_per_step
+            total_variants = number_of_variants + tf.cast(position < extra_variants, tf.int64)
+            count = tf.clip_by_value(total_variants - first_variant, 0, variants_per_step)
 
-        training_dataset = training_dataset.map(self._tf_save_data, num_parallel_calls=self.tune)
-        training_dataset = training_dataset.prefetch(buffer_size=self.tune)
-        list(training_dataset.as_numpy_iterator())
+            variants = tf.range(first_variant, first_variant + count)
+            images, masks = self._augment_variants(image, mask, self._get_variant_seeds(set_name, position, variants))
+            positions = tf.fill([count], position)
+            return positions, variants, images, masks
 
-        print('\n\t1. Training images and masks saved')
-        del training_dataset
+        dataset = dataset.enumerate().map(create_variants, num_parallel_calls=self.tune)
+        return dataset.unbatch()
 
-    def _process_and_save_validation_data(self, image_paths, mask_paths):
+    def _get_number_of_passes(self, number_of_variants: int, augment: bool, extra_variants: int = 0):
+        """Returns the number of times a set is read to create `number_of_variants` variants of each sample."""
+        if not augment:
+            return 1
+        return -(-(number_of_variants + (1 if extra_variants else 0)) // self.max_variants_per_step)
+
+    @staticmethod
+    def _add_save_index(dataset, start_index: int, number_of_examples: int):
         """
-        Prepares shuffled batches of the training set.
+        Replaces the position and variant of each sample with the index used to save it.
 
-        :param image_paths: (list) paths to each image file in the training set
-        :param mask_paths: (list) paths to each mask in the training set
-        :return: tf Dataset containing the preprocessed training set
-        """
-        validation_dataset = tf.data.Dataset.from_tensor_slices((image_paths, mask_paths))
-        validation_dataset = validation_dataset.map(self._step1_read_crop_and_resize, num_parallel_calls=self.tune)
-        validation_dataset = validation_dataset.cache(self.val_cache)
-        validation_dataset = validation_dataset.repeat(count=self.iterations) if \
-            self.augment_validation_data else validation_dataset.repeat(count=1)
-        validation_dataset = validation_dataset.map(self._augment_image_and_mask, num_parallel_calls=self.tune) if \
-            self.augment_validation_data else validation_dataset
-        validation_dataset = validation_dataset.map(self._denormalize_image_mask_to_0_255, num_parallel_calls=self.tune)
-
-        counter = tf.data.Dataset.counter(start=self.current_val_index)
-        validation_dataset = tf.data.Dataset.zip((counter, validation_dataset))
-        validation_dataset = validation_dataset.map(lambda x, y: (x, y[0], y[1]))
-        self.validation_dataset = validation_dataset
+        Variant `v` of the sample at `position` is saved as `start_index + v * number_of_examples + position`, the
+        same index a single process run (where the shard holds every example) assigns to it.
+        """
+        return dataset.map(lambda position, variant, image, mask: (
+            start_index + variant * number_of_examples + position, image, mask))
+
+    def _apply_dataset_options(self, dataset):
+        """Limits the threads used by the dataset when several worker processes share the CPUs."""
+        if self.private_threadpool_size is None:
+            return dataset
+        options = tf.data.Options()
+        options.threading.private_threadpool_size = self.private_threadpool_size
+        return dataset.with_options(options)
+
+    def _get_sample_bytes(self):
+        """Returns the number of bytes of a decoded uint8 image and its mask, as they are cached."""
+        return self.new_image_height * self.new_image_width * (self.image_channels + self._stored_mask_channels)
+
+    def _read_and_cache(self, image_paths, mask_paths, positions, set_name: str, cache_directory: str, count: int):
+        """
+        Reads a set as a dataset of (position, image, mask), repeated `count` times.
+
+        When the set is read more than once, the samples are cached as uint8 while the first pass decodes them, and
+        the following passes read them back from the cache. The cache is filled within the tf.data pipeline. The first
+        samples that fit within the memory budget are cached in memory, and the others in a cache file.
 
-        self.image_save_directory = self.validation_subdirectories['images']
-        self.mask_save_directory = self.validation_subdirectories['masks']
+        The split is recorded in `cache_plan` as it is planned from the size of a decoded sample. tf.data does not
+        report cache hits or evictions, so these are the samples assigned to each cache, not measured traffic.
 
-        validation_dataset = validation_dataset.map(self._tf_save_data, num_parallel_calls=self.tune)
-        validation_dataset = validation_dataset.prefetch(buffer_size=self.tune)
-        list(validation_dataset.as_numpy_iterator())
+        :param set_name: (str) 'train', 'val' or 'test'. Used to record the cache plan of the set.
+        :param cache_directory: (str) directory where the cache file of the samples beyond the memory budget is written.
+        :param count: (int) number of times the dataset is repeated.
+        """
+        if count <= 1:
+            return self._read_dataset(image_paths, mask_paths, positions).prefetch(self.tune)
+
+        sample_bytes = self._get_sample_bytes()
+        memory_samples = min(len(positions), self.cache_memory_budget // max(1, sample_bytes))
+        file_samples = len(positions) - memory_samples
+
+        dataset = None
+        if memory_samples:
+            dataset = self._read_dataset(image_paths[:memory_samples], mask_paths[:memory_samples],
+                                         positions[:memory_samples]).cache()
+        if file_samples:
+            # Each set (and worker process) writes its cache file to its own directory, removed once it is saved.
+            files_directory = tempfile.mkdtemp(prefix=f'{set_name}_', dir=cache_directory or None)
+            self.cache_files_directories.append(files_directory)
+            file_cached = self._read_dataset(image_paths[memory_samples:], mask_paths[memory_samples:],
+                                             positions[memory_samples:]).cache(os.path.join(files_directory, 'samples'))
+            dataset = file_cached if dataset is None else dataset.concatenate(file_cached)
+
+        self.cache_plan[set_name] = {'memory_samples': memory_samples,
+                                     'memory_bytes': memory_samples * sample_bytes,
+                                     'file_samples': file_samples,
+                                     'file_bytes': file_samples * sample_bytes}
+        # The set decodes ahead of its augmentation in a background thread of its own, so the sets interleaved by
+        # `_process_images_and_masks` are decoded (and their caches filled) at the same time.
+        return dataset.repeat(count).prefetch(self.tune)
+
+    def _remove_cache_files(self):
+        """Deletes the cache files of the sets."""
+        for files_directory in self.cache_files_directories:
+            shutil.rmtree(files_directory, ignore_errors=True)
+        self.cache_files_directories = []
+
+    @staticmethod
+    def _get_positions(image_paths, positions):
+        return list(range(len(image_paths))) if positions is None else positions
 
-        print('\t2. Validation images and masks saved')
-        del validation_dataset
+    def _get_save_directories(self, set_name: str):
+        """
+        Returns the directories where the images and masks of a set (and their previews) are saved. Each set's
+        pipeline looks up its own directories, so the sets can be processed concurrently.
+        """
+        subdirectories = {'train': self.train_subdirectories,
+                          'val': self.validation_subdirectories,
+                          'test': self.test_subdirectories}[set_name]
+        directories = {'images': subdirectories['images'], 'masks': subdirectories['masks']}
+        if self.preview_directories is not None:
+            directories['preview_images'] = self.preview_directories[set_name]['images']
+            directories['preview_masks'] = self.preview_directories[set_name]['masks']
+        return directories
+
+    def _add_save_step(self, dataset, set_name: str):
+        """Maps each (index, image, mask) of a set to the operation saving it in the set's directories."""
+        directories = self._get_save_directories(set_name)
+        dataset = dataset.map(lambda index, image, mask: self._tf_save_data(index, image, mask, directories),
+                              num_parallel_calls=self.tune)
+        return dataset.prefetch(buffer_size=self.tune)
 
-    def _process_and_save_test_data(self, image_paths, mask_paths):
+    # Get training, validation and test sets
+    def _get_training_dataset(self, image_paths, mask_paths, positions=None):
         """
-        Prepares shuffled batches of the training set.
+        Prepares the pipeline that augments and saves the training set.
 
         :param image_paths: (list) paths to each image file in the training set
         :param mask_paths: (list) paths to each mask in the training set
-        :return: tf Dataset containing the preprocessed training set
-        """
-        test_dataset = tf.data.Dataset.from_tensor_slices((image_paths, mask_paths))
-        test_dataset = test_dataset.map(self._step1_read_crop_and_resize, num_parallel_calls=self.tune)
-        test_dataset = test_dataset.cache(self.test_cache)
-        test_dataset = test_dataset.repeat(count=self.iterations) if \
-            self.augment_validation_data else test_dataset.repeat(count=1)
-        test_dataset = test_dataset.map(self._augment_image_and_mask, num_parallel_calls=self.tune) if \
-            self.augment_validation_data else test_dataset
-        test_dataset = test_dataset.map(self._denormalize_image_mask_to_0_255, num_parallel_calls=self.tune)
-
-        counter = tf.data.Dataset.counter(start=self.current_test_index)
-        test_dataset = tf.data.Dataset.zip((counter, test_dataset))
-        test_dataset = test_dataset.map(lambda x, y: (x, y[0], y[1]))
+        :param positions: (list) index of each image within `training_image_paths`. Only needed when processing a
+            shard of the training set.
+        :return: tf Dataset that saves the training set as it is iterated, and the number of images it saves.
+        """
+        positions = self._get_positions(image_paths, positions)
+        passes = self._get_number_of_passes(self.variants_per_train_image, augment=self.apply_data_augmentation,
+                                            extra_variants=self.extra_train_variants)
+        training_dataset = self._read_and_cache(image_paths, mask_paths, positions, set_name='train',
+                                                cache_directory=self.train_cache, count=passes)
+        training_dataset = self._fan_out(training_dataset, set_name='train',
+                                         number_of_variants=self.variants_per_train_image,
+                                         augment=self.apply_data_augmentation, shard_size=len(positions),
+                                         extra_variants=self.extra_train_variants)
+
+        training_dataset = self._add_save_index(training_dataset, start_index=self.current_train_index,
+                                                number_of_examples=self.no_of_train_examples)
+        self.training_dataset = training_dataset
+
+        number_of_images = len(positions) * self.variants_per_train_image + sum(
+            1 for position in positions if position < self.extra_train_variants)
+        return self._add_save_step(training_dataset, set_name='train'), number_of_images
+
+    def _get_validation_dataset(self, image_paths, mask_paths, positions=None):
+        """
+        Prepares the pipeline that (optionally augments and) saves the validation set.
+
+        :param image_paths: (list) paths to each image file in the validation set
+        :param mask_paths: (list) paths to each mask in the validation set
+        :param positions: (list) index of each image within `validation_image_paths`. Only needed when processing a
+            shard of the validation set.
+        :return: tf Dataset that saves the validation set as it is iterated, and the number of images it saves.
+        """
+        positions = self._get_positions(image_paths, positions)
+        passes = self._get_number_of_passes(self.iterations, augment=self.augment_validation_data)
+        validation_dataset = self._read_and_cache(image_paths, mask_paths, positions, set_name='val',
+                                                  cache_directory=self.val_cache, count=passes)
+        validation_dataset = self._fan_out(validation_dataset, set_name='val', number_of_variants=self.iterations,
+                                           augment=self.augment_validation_data, shard_size=len(positions))
+
+        validation_dataset = self._add_save_index(validation_dataset, start_index=self.current_val_index,
+                                                  number_of_examples=self.no_of_val_examples)
+        self.validation_dataset = validation_dataset
+
+        number_of_images = len(positions) * (self.iterations if self.augment_validation_data else 1)
+        return self._add_save_step(validation_dataset, set_name='val'), number_of_images
+
+    def _get_test_dataset(self, image_paths, mask_paths, positions=None):
+        """
+        Prepares the pipeline that (optionally augments and) saves the test set.
+
+        :param image_paths: (list) paths to each image file in the test set
+        :param mask_paths: (list) paths to each mask in the test set
+        :param positions: (list) index of each image within `test_image_paths`. Only needed when processing a
+            shard of the test set.
+        :return: tf Dataset that saves the test set as it is iterated, and the number of images it saves.
+        """
+        positions = self._get_positions(image_paths, positions)
+        passes = self._get_number_of_passes(self.iterations, augment=self.augment_validation_data)
+        test_dataset = self._read_and_cache(image_paths, mask_paths, positions, set_name='test',
+                                            cache_directory=self.test_cache, count=passes)
+        test_dataset = self._fan_out(test_dataset, set_name='test', number_of_variants=self.iterations,
+                                     augment=self.augment_validation_data, shard_size=len(positions))
+
+        test_dataset = self._add_save_index(test_dataset, start_index=self.current_test_index,
+                                            number_of_examples=self.no_of_test_examples)
         self.test_dataset = test_dataset
 
-        self.image_save_directory = self.test_subdirectories['images']
-        self.mask_save_directory = self.test_subdirectories['masks']
+        number_of_images = len(positions) * (self.iterations if self.augment_validation_data else 1)
+        return self._add_save_step(test_dataset, set_name='test'), number_of_images
+
+    def _get_shard_bounds(self, number_of_examples: int):
+        """Returns the (start, end) of `num_workers` contiguous shards whose sizes differ by at most one."""
+        shard_size, remainder = divmod(number_of_examples, self.num_workers)
+        bounds = []
+        start = 0
+        for shard_id in range(self.num_workers):
+            end = start + shard_size + (1 if shard_id < remainder else 0)
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    def _get_shards(self):
+        """
+        Splits the training, validation and test paths into `num_workers` shards.
 
-        test_dataset = test_dataset.map(self._tf_save_data, num_parallel_calls=self.tune)
-        test_dataset = test_dataset.prefetch(buffer_size=self.tune)
-        list(test_dataset.as_numpy_iterator())
+        :return: A list of dictionaries, one per shard, mapping 'train', 'val' and 'test' to a tuple of
+            (image_paths, mask_paths, positions). Shards without any image are dropped.
+        """
+        sets = {'train': (self.training_image_paths, self.training_mask_paths),
+                'val': (self.validation_image_paths, self.validation_mask_paths),
+                'test': (self.test_image_paths, self.test_mask_paths)}
 
-        print('\t3. Test images and masks saved')
-        del test_dataset
+        shards = [{} for _ in range(self.num_workers)]
+        for set_name, (image_paths, mask_paths) in sets.items():
+            for shard_id, (start, end) in enumerate(self._get_shard_bounds(len(image_paths))):
+                shards[shard_id][set_name] = (image_paths[start:end], mask_paths[start:end], list(range(start, end)))
 
-    def _process_images_and_masks(self):
-        self._process_and_save_training_data(image_paths=self.training_image_paths,
-                                             mask_paths=self.training_mask_paths)
+        return [shard for shard in shards if any(len(paths[0]) for paths in shard.values())]
 
-        if self.val_directory:
-            self._process_and_save_validation_data(image_paths=self.validation_image_paths,
-                                                   mask_paths=self.validation_mask_paths)
+    def _process_images_and_masks(self, shard: dict = None):
+        """
+        Augments and saves the training, validation and test sets concurrently. The pipelines of the sets are only
+        built here; nothing is decoded until they run. They are interleaved into a single dataset, in proportion to
+        the number of images each one saves, so they share the same thread pool and the smaller sets do not wait
+        behind the training set. Each set decodes and caches its samples ahead of the interleaving, in parallel with
+        the other sets.
+        """
+        if shard is None:
+            shard = {'train': (self.training_image_paths, self.training_mask_paths, None),
+                     'val': (self.validation_image_paths, self.validation_mask_paths, None),
+                     'test': (self.test_image_paths, self.test_mask_paths, None)}
+
+        try:
+            datasets = []
+            image_paths, mask_paths, positions = shard['train']
+            if len(image_paths):
+                datasets.append(self._get_training_dataset(image_paths=image_paths, mask_paths=mask_paths,
+                                                           positions=positions))
+
+            image_paths, mask_paths, positions = shard['val']
+            if self.val_directory and len(image_paths):
+                datasets.append(self._get_validation_dataset(image_paths=image_paths, mask_paths=mask_paths,
+                                                             positions=positions))
+
+            image_paths, mask_paths, positions = shard['test']
+            if self.test_directory and len(image_paths):
+                datasets.append(self._get_test_dataset(image_paths=image_paths, mask_paths=mask_paths,
+                                                       positions=positions))
+
+            if not datasets:
+                return
+
+            if len(datasets) == 1:
+                dataset = datasets[0][0]
+            else:
+                total_images = sum(number_of_images for _, number_of_images in datasets)
+                dataset = tf.data.Dataset.sample_from_datasets(
+                    [set_dataset for set_dataset, _ in datasets],
+                    weights=[number_of_images / total_images for _, number_of_images in datasets],
+                    seed=self.seed,
+                    stop_on_empty_dataset=False)
+
+            self._save_dataset(self._apply_dataset_options(dataset))
+        finally:
+            self._remove_cache_files()
+
+        print('\n\tTraining, validation and test images and masks saved')
+
+    def _process_shards_in_parallel(self):
+        """Processes each shard of the training, validation and test sets in a separate process."""
+        shards = self._get_shards()
+
+        # TensorFlow is not fork-safe, so the workers are spawned.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+            futures = [executor.submit(_process_shard, self, shard_id, shard) for shard_id, shard in enumerate(shards)]
+            for future in as_completed(futures):
+                shard_id, saved_files = future.result()
+                for file_path in saved_files:
+                    self._archive(file_path)
+                print(f'\tShard {shard_id + 1}/{len(shards)} completed')
+
+    def _can_copy_original_files(self):
+        """
+        Returns True when the images and masks would be saved unchanged, i.e. they are not augmented, cropped or resized,
+        and they already have the save format and the number of channels required. The original files can then be
+        placed in the train, validation and test directories without being decoded and re-encoded.
+        """
+        if self.apply_data_augmentation or self.crop_image_and_mask or self.resize_images:
+            return False
+
+        # The pipeline is needed to produce the previews uploaded with the images and masks.
+        if self.storage_sink is not None:
+            return False
+
+        save_format = self._normalize_format(self.image_save_format)
+        for path in self.original_image_paths + self.original_mask_paths:
+            if self._normalize_format(self._get_image_format(path)) != save_format:
+                return False
 
+        return (self._get_native_channels(self.original_image_paths[0]) == self.image_channels and
+                self._get_native_channels(self.original_mask_paths[0]) == self.mask_channels)
+
+    def _copy_original_files(self):
+        """
+        Links (or copies) the original images and masks into the train, validation and test directories. Each file is
+        named with the index it would have been saved with by the augmentation pipeline.
+        """
+        sets = [(self.training_image_paths, self.training_mask_paths, self.train_subdirectories,
+                 self.current_train_index)]
+        if self.val_directory:
+            sets.append((self.validation_image_paths, self.validation_mask_paths, self.validation_subdirectories,
+                         self.current_val_index))
         if self.test_directory:
-            self._process_and_save_test_data(image_paths=self.test_image_paths,
-                                             mask_paths=self.test_mask_paths)
+            sets.append((self.test_image_paths, self.test_mask_paths, self.test_subdirectories,
+                         self.current_test_index))
+
+        copies = []
+        for image_paths, mask_paths, subdirectories, start_index in sets:
+            for position, (image_path, mask_path) in enumerate(zip(image_paths, mask_paths)):
+                index = start_index + position
+                copies.append((image_path, os.path.join(
+                    subdirectories['images'], f'{self.image_save_prefix}_{index}.{self.image_save_format}')))
+                copies.append((mask_path, os.path.join(
+                    subdirectories['masks'], f'{self.mask_save_prefix}_{index}.{self.image_save_format}')))
+
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            list(executor.map(lambda paths: link_or_copy_file(*paths), copies))
+
+        for _, destination_path in copies:
+            self._archive(destination_path)
+
+        print(f'\n\t{len(copies) // 2} images and masks placed in the train, validation and test directories')
 
     def process_data(self):
         print('\nProcess started . . . ', end='\n')
-        self._process_images_and_masks()
+        if self._can_copy_original_files():
+            self._copy_original_files()
+        else:
+            if self.preview_directories is not None:
+                self._create_preview_directories()
+            self._set_mask_palette()
+
+            if self.num_workers > 1:
+                self._process_shards_in_parallel()
+            else:
+                self._process_images_and_masks()
+            self.previews_written = self.preview_directories is not None
         print(f'\nProcess completed!!\n')
         gc.collect()
 
 
-
+def _process_shard(augmenter: DataSplitterAugmenterAndSaver, shard_id: int, shard: dict):
+    """Entry point of the worker processes started by `DataSplitterAugmenterAndSaver.process_data`."""
+    augmenter._process_images_and_masks(shard=shard)
+    return shard_id, augmenter.saved_files
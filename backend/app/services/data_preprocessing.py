@@ -1,13 +1,19 @@
 import os
 import re
-from typing import Union, Tuple, Optional
+from typing import List, Union, Tuple, Optional
 
 import numpy as np
 import tensorflow as tf
-from PIL import Image
 from skimage import io
 
-from app.utils import create_directory
+from app.utils import LRUCache, check_uniform_dimensions, create_directory, probe_image
+from app.services.thumbnails import load_thumbnail, output_is_up_to_date
+
+# Class labels found within each directory of masks, keyed by the directory's path, modification time, number of
+# images and number of channels, so they are only computed once per dataset. Only the most recent datasets are kept.
+CLASS_LABELS_CACHE_SIZE = 128
+
+_class_labels_cache = LRUCache(max_size=CLASS_LABELS_CACHE_SIZE)
 
 
 class ImageOrMaskDatasetCreator:
@@ -28,12 +34,15 @@ class ImageOrMaskDatasetCreator:
                  return_type: tf.DType = tf.uint8,
                  cache_directory: Union[str, None] = '',
                  crop_multiple_images_from_parent_image: bool = False,
-                 crop_grid: Tuple[int, int] = (2, 2),
+                 crop_grid: Union[Tuple[int, int], None] = (2, 2),
                  child_image_dimension: Union[Tuple[int, int], None] = (512, 512),
+                 tile_overlap: Union[int, Tuple[int, int]] = 0,
                  start_save_index: int = 1,
                  save_directory: str = None,
                  image_save_prefix: str = 'img',
-                 image_save_format: str = 'png'):
+                 image_save_format: str = 'png',
+                 png_compression: int = -1,
+                 jpeg_quality: int = 95):
 
         """
         Class for creating a Tensorflow dataset that is made up of either images or masks. The dataset could be batched
@@ -62,9 +71,15 @@ class ImageOrMaskDatasetCreator:
             If final_image_shape is set, the new images would be cropped from the original image after it has been resized to
             the final_image_shape.
         :param crop_grid: (tuple) The [number_of_images_per_column, number_of_images_per_row] that would be generated
-            from the input image
+            from the input image. If None, the grid is the smallest one that covers the whole image with child images
+            that overlap by at least tile_overlap pixels.
+        :param tile_overlap: (int, tuple) Minimum overlap, in pixels, between neighbouring child images as an int or a
+            (vertical, horizontal) tuple. Only used when crop_grid is None.
         :param image_save_prefix: (str) prefix for saving the images
         :param image_save_format: (str) the format for saving the images
+        :param png_compression: (int) zlib compression level (0 - 9) used when saving PNG images. -1 uses the zlib
+            default. Lower values save faster but produce larger files.
+        :param jpeg_quality: (int) Quality (0 - 100) used when saving JPEG images.
         :param add_label_channels_to_mask: (bool) This functionality is only used if the image_directory contains masks.
             If add_label_channels_to_mask is set to True, the output mask is made up of n-channels. Where n is the
             number of classes in the mask. The assumption here is that each mask must contain all the classes.
@@ -86,10 +101,14 @@ class ImageOrMaskDatasetCreator:
         """
         self.image_save_format = image_save_format
         self.image_save_prefix = image_save_prefix
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        self.native_encoding = supports_native_encoding(image_save_format)
         self.start_save_index = start_save_index
         self.crop_multiple_images_from_parent_image = crop_multiple_images_from_parent_image
         self.child_image_dimension = child_image_dimension
         self.crop_grid = crop_grid
+        self.tile_overlap = tile_overlap
         self.resize_method = resize_method
 
         if cache_directory == "":
@@ -176,10 +195,10 @@ class ImageOrMaskDatasetCreator:
             self.cropped_dataset = None
             self.save_directory = create_directory(dir_name=save_directory, return_dir=True)
 
-            self.crop_dimension_list = produce_multiple_crop_dimensions(
-                parent_image_shape=self.final_image_shape[:2], new_image_shape=child_image_dimension,
-                resulting_image_grid=crop_grid)
-            self.images_per_grids = crop_grid[0] * crop_grid[1]
+            self.crop_grid, self.tile_strides = get_tile_grid(
+                parent_image_shape=tuple(self.final_image_shape)[:2], new_image_shape=child_image_dimension,
+                resulting_image_grid=crop_grid, overlap=tile_overlap)
+            self.images_per_grids = self.crop_grid[0] * self.crop_grid[1]
 
         self.process_data()
 
@@ -215,22 +234,33 @@ class ImageOrMaskDatasetCreator:
             self.get_dataset_class_labels()
         return self.unique_intensities
 
+    def _get_intensity_histogram(self, image_path):
+        """Returns the number of pixels of an image with each of the 256 intensities."""
+        image = self._read_and_decode_image(image_path=image_path)
+        return tf.math.bincount(tf.reshape(tf.cast(image, tf.int32), [-1]), minlength=256, maxlength=256,
+                                dtype=tf.int64)
+
+    def _get_class_labels_cache_key(self):
+        return (os.path.abspath(self.image_directory), os.stat(self.image_directory).st_mtime_ns,
+                self.number_of_images, self.image_channels)
+
     def get_dataset_class_labels(self):
         """
         Compute the unique pixel intensities on all the images in the dataset.
 
-         For the operation, instead of using all images in the dataset,
-         we either the first 20 images, or 10% of the images, whichever is smaller.
+        The intensity histograms of the images are computed in parallel and summed, and the intensities found are
+        cached for the dataset, so they are only computed once.
         """
-        # check the unique intensities of the first fifty or 10% of the image (the larger number)
-        num = max(50, (self.number_of_images // 10) + 1)
-        img_paths = self.images_paths[:num]
+        cache_key = self._get_class_labels_cache_key()
+        class_labels = _class_labels_cache.get(cache_key)
+        if class_labels is None:
+            dataset = tf.data.Dataset.from_tensor_slices(self.images_paths)
+            dataset = dataset.map(self._get_intensity_histogram, num_parallel_calls=self.tune)
+            histogram = dataset.reduce(tf.zeros([256], dtype=tf.int64), lambda total, counts: total + counts)
+            class_labels = np.flatnonzero(histogram.numpy()).tolist()
+            _class_labels_cache.set(cache_key, class_labels)
 
-        unique_intensities = set()
-
-        for path in img_paths:
-            unique_intensities.update(self.get_image_unique_intensities(path))
-        self.unique_intensities = unique_intensities
+        self.unique_intensities = list(class_labels)
 
     def _get_filepath_to_images(self):
         """
@@ -241,10 +271,10 @@ class ImageOrMaskDatasetCreator:
 
         self.number_of_images = len(self.images_paths)
 
-        # compute the image shape
-        image = self._read_and_decode_image(image_path=self.images_paths[0])
-        self.image_shape = image.shape
-        self.image_channels = tuple(self.image_shape)[2]
+        # compute the image shape from the file headers, after checking that all the images have the same dimensions.
+        image_info = check_uniform_dimensions(self.images_paths)
+        self.image_channels = self.image_channels or image_info.channels
+        self.image_shape = tf.TensorShape((image_info.height, image_info.width, self.image_channels))
 
         # To assign separate channels for each class, get the unique pixel
         # intensity for each class in the mask.
@@ -284,14 +314,12 @@ class ImageOrMaskDatasetCreator:
         return image
 
     def crop_multiple_images_from_image(self, image):
-
-        new_images_list = []
-
-        for crop_dimension in self.crop_dimension_list:
-            new_image = self.crop_sub_image(image, crop_dimension=crop_dimension)
-            new_images_list.append(new_image)
-
-        return new_images_list
+        """
+        Crops all the child images out of the image in a single patch extraction, and returns them as a batch of shape
+        [images_per_grids, child_height, child_width, channels], ordered column by column.
+        """
+        image = tf.expand_dims(image, axis=-1) if image.shape.ndims == 2 else image
+        return extract_tiles(image, tile_shape=self.child_image_shape, grid=self.crop_grid, strides=self.tile_strides)
 
     def _reshape_image(self, image):
         """Reshape the image and mask to the predefined dimension."""
@@ -307,27 +335,27 @@ class ImageOrMaskDatasetCreator:
             image = tf.cast(image, dtype=self.return_type)
         return image
 
+    def _get_class_index_table(self):
+        """
+        Returns a lookup table mapping each of the 256 pixel intensities to the index of its class. Intensities that
+        are not class labels map to -1.
+        """
+        table = np.full(256, -1, dtype=np.int32)
+        table[self.unique_intensities] = np.arange(len(self.unique_intensities), dtype=np.int32)
+        return tf.constant(table)
+
     def _add_label_channels_to_mask(self, mask):
-        """Adds label channels to the mask."""
-
-        mask = tf.cast(mask, dtype=tf.uint8)
-        stack_list = []
-
-        # Create individual tensor array for each class. Each tensor would display the area on the original
-        # mask that is occupied by individual classes. if we have three class - background, pea, and outline,
-        # we would have three tensor arrays.
-        # for class_index in range(self.number_of_classes):
-        for intensity in self.unique_intensities:
-            # Produce a temporary mask depicting all the pixel locations on the original tensor named 'mask'
-            # that have the same pixel intensity as  the integer 'class_index'. we want to
-            temp_mask = tf.equal(mask[..., 0], tf.constant(intensity, dtype=tf.uint8))
-            # add each temporary mask to the stack_list.
-            stack_list.append(tf.cast(temp_mask, dtype=self.return_type))
-
-        # stack all the temporary masks within the stack_list, so together they form the third axis of the
-        # overall mask. Hence, the overall mask would be of dimension [height, width, number_of_classes]
-        mask = tf.stack(stack_list, axis=-1)  # Axis starts from 0, so axis of 2 represents the third axis
-        return mask
+        """
+        Adds label channels to the mask. Each class gets its own channel, which is 1 at the pixel locations of the
+        mask occupied by the class, and 0 elsewhere. if we have three class - background, pea, and outline, we would
+        have three channels, so the mask would be of dimension [height, width, number_of_classes].
+        """
+        mask = tf.cast(mask, dtype=tf.int32)
+
+        # Look up the class index of each pixel, then expand the indices into one channel per class. Pixels with
+        # an intensity that is not a class label (index -1) are 0 in every channel.
+        class_indices = tf.gather(self._get_class_index_table(), mask[..., 0])
+        return tf.one_hot(class_indices, depth=len(self.unique_intensities), dtype=self.return_type)
 
     def _normalize_image(self, image):
         """Normalizes the pixel values of image to lie between [0, 1] or [-1, 1]."""
@@ -368,7 +396,7 @@ class ImageOrMaskDatasetCreator:
         # saves image
 
         n = index
-        for image in images:
+        for image in images.numpy():
             if image.shape[-1] == 1:
                 image = np.squeeze(image)
 
@@ -377,7 +405,23 @@ class ImageOrMaskDatasetCreator:
             n += 1
         return index
 
+    def _write_image(self, index, images):
+        # encodes and saves the batch of child images without leaving the TensorFlow graph. The number of child images
+        # is fixed, so the writes are independent ops that run in parallel.
+        file_paths = get_save_path(self.save_directory, self.image_save_prefix,
+                                   index + tf.range(self.images_per_grids, dtype=index.dtype), self.image_save_format)
+        write_ops = []
+        for n in range(self.images_per_grids):
+            write_ops.append(write_image(images[n], file_paths[n], image_format=self.image_save_format,
+                                         png_compression=self.png_compression, jpeg_quality=self.jpeg_quality))
+
+        with tf.control_dependencies(write_ops):
+            return tf.identity(index)
+
     def _tf_save_image(self, index, images):
+        if self.native_encoding:
+            return self._write_image(index, images)
+
         index_shape = index.shape
         [index_ans, ] = tf.py_function(func=self._save_image, inp=[index, images], Tout=[tf.int64])
         index_ans.set_shape(index_shape)
@@ -449,7 +493,11 @@ class ImageCropperResizerAndSaver:
                  image_save_prefix: Union[str, None] = 'img',
                  image_save_format: str = 'png',
                  cache_dir: Union[None, str] = None,
-                 assign_dataset=False):
+                 assign_dataset=False,
+                 png_compression: int = -1,
+                 jpeg_quality: int = 95,
+                 image_paths: Union[List[str], None] = None,
+                 skip_up_to_date: bool = False):
         """
         This Class contains methods that are used to crop, resize and re-save a collection of images and their
         corresponding mask. If the image is cropped, after cropping the result is automatically resized to the
@@ -468,6 +516,13 @@ class ImageCropperResizerAndSaver:
         :param image_save_prefix: (str): Prefix for saving the images. By default, it is left blank.
         :param mask_save_prefix: (str): Prefix for saving the mask. By default, it is left blank.
         :param image_save_format: (str): File format for saving the processed images. By default, it is set to 'jpg'
+        :param png_compression: (int) zlib compression level (0 - 9) used when saving PNG images. -1 uses the zlib
+            default.
+        :param jpeg_quality: (int) Quality (0 - 100) used when saving JPEG images.
+        :param image_paths: (list) Paths of the images to process, e.g. the files of an upload. By default, every
+            image in the images_directory is processed.
+        :param skip_up_to_date: (bool) If True, images saved with their original names are skipped when their output
+            is newer than the image and already has the final dimensions.
         :param crop_image: (bool): If 'True' the all the input masks and images would be cropped before
             resizing them to the required size (image_size)
         :param crop_dimension: (Tuple): A tuple (offset_height, offset_width, target_height, target_width) containing
@@ -498,7 +553,11 @@ class ImageCropperResizerAndSaver:
                                                      overwrite_if_existing=False)
 
         # Generate filepaths to the images and masks
-        self.original_image_paths = self._get_sorted_filepaths_to_images_and_masks(images_directory)
+        if image_paths is not None:
+            self.original_image_paths = self.sort_filenames(image_paths)
+        else:
+            self.original_image_paths = self._get_sorted_filepaths_to_images_and_masks(images_directory)
+        self.skip_up_to_date = skip_up_to_date
 
         # Extract image and mask format and assign save format
         img_path = self.original_image_paths[0]
@@ -519,6 +578,15 @@ class ImageCropperResizerAndSaver:
 
         self.image_save_prefix = image_save_prefix
         self.image_save_format = image_save_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+
+        # Images saved with a new name use the save format, while those saved with their base name keep the format
+        # of the original image.
+        if self.create_new_name:
+            self.native_encoding = supports_native_encoding(self.image_save_format)
+        else:
+            self.native_encoding = supports_native_encoding(self.image_format)
 
         # set the initial shape of the images and masks.
         self.image_shape = self._get_image_and_mask_shape(image_path=img_path)
@@ -560,6 +628,24 @@ class ImageCropperResizerAndSaver:
         else:
             self.crop_image = False
 
+        # JPEG images that are cropped are decoded within their crop window only, and those that are downsized are
+        # decoded at the smallest DCT scale that is still larger than the final shape.
+        self.crop_window = ((self.offset_height, self.offset_width, self.target_height, self.target_width)
+                            if self.crop_image else None)
+        self.decode_jpeg_region = is_jpeg_format(self.image_format) and (self.crop_image or self.resize_images)
+        self.jpeg_decode_ratio = 1
+        if self.decode_jpeg_region and self.resize_images:
+            self.jpeg_decode_ratio = get_jpeg_decode_ratio(source_shape=tuple(self.image_shape)[:2],
+                                                           target_shape=(self.new_image_height, self.new_image_width),
+                                                           crop_window=self.crop_window)
+        if self.decode_jpeg_region:
+            self.decoded_image_shape = get_decoded_jpeg_shape(source_shape=tuple(self.image_shape)[:2],
+                                                              channels=tuple(self.image_shape)[2],
+                                                              ratio=self.jpeg_decode_ratio,
+                                                              crop_window=self.crop_window)
+        else:
+            self.decoded_image_shape = self.image_shape
+
         if cache_dir is not None:
             self.cache_directory = create_directory(dir_name=cache_dir, return_dir=True, overwrite_if_existing=True)
         else:
@@ -595,16 +681,15 @@ class ImageCropperResizerAndSaver:
         return os.path.splitext(image_path)[-1]
 
     def _get_image_and_mask_shape(self, image_path):
-        image = tf.io.read_file(image_path)
-        image = self.decode_image(image, channels=self.image_channels)
-
-        return image.shape
+        """Returns the shape of the decoded image, read from the file header."""
+        image_info = probe_image(image_path)
+        return tf.TensorShape((image_info.height, image_info.width, self.image_channels or image_info.channels))
 
     def _set_original_shape(self, image):
         """ Sets width and height information to the image tensors.
 
         """
-        image.set_shape(self.image_shape)
+        image.set_shape(self.decoded_image_shape)
         return image
 
     def _set_final_shape(self, image):
@@ -622,14 +707,19 @@ class ImageCropperResizerAndSaver:
         """
         # Read image and mask
         image = tf.io.read_file(image_path)
-        image = self.decode_image(image, channels=self.image_channels)
+        if self.decode_jpeg_region:
+            image = decode_jpeg_region(image, channels=self.image_channels, ratio=self.jpeg_decode_ratio,
+                                       crop_window=self.crop_window)
+        else:
+            image = self.decode_image(image, channels=self.image_channels)
         image = self._set_original_shape(image)
         return image
 
     def _crop_image(self, image):
         """Crops out a portion of the image and mask."""
         # crop image
-        if self.crop_image and self.crop_dimension is not None:
+        # JPEG images were already cropped while they were decoded.
+        if self.crop_image and self.crop_dimension is not None and not self.decode_jpeg_region:
             image = tf.expand_dims(image, axis=-1) if image.ndim == 2 else image
             image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width,
                                                   self.target_height, self.target_width)
@@ -709,7 +799,18 @@ class ImageCropperResizerAndSaver:
                   arr=image, check_contrast=False)
         return index
 
+    def _write_image(self, index, image):
+        # encodes and saves the image without leaving the TensorFlow graph
+        file_path = get_save_path(self.new_images_directory, self.image_save_prefix, index, self.image_save_format)
+        write_op = write_image(image, file_path, image_format=self.image_save_format,
+                               png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+        with tf.control_dependencies([write_op]):
+            return tf.identity(index)
+
     def _tf_save_image(self, index, image):
+        if self.native_encoding:
+            return self._write_image(index, image)
+
         index_shape = index.shape
         [index_ans, ] = tf.py_function(func=self._save_image, inp=[index, image], Tout=[tf.int64])
         index_ans.set_shape(index_shape)
@@ -733,7 +834,18 @@ class ImageCropperResizerAndSaver:
 
         return tf.constant(1, tf.int64)
 
+    def _write_image_with_basename(self, image, image_name):
+        # encodes and saves the image under its original name, without leaving the TensorFlow graph
+        file_path = tf.strings.join([self.new_images_directory, image_name])
+        write_op = write_image(image, file_path, image_format=self.image_format,
+                               png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+        with tf.control_dependencies([write_op]):
+            return tf.constant(1, tf.int64)
+
     def _tf_save_image_with_basename(self, image, image_name):
+        if self.native_encoding:
+            return self._write_image_with_basename(image, image_name)
+
         [index_ans, ] = tf.py_function(func=self._save_image_with_base_name, inp=[image, image_name], Tout=[tf.int64])
         return index_ans
 
@@ -778,10 +890,23 @@ class ImageCropperResizerAndSaver:
             list(dataset.as_numpy_iterator())
             del dataset
 
+    def _get_image_paths_to_process(self):
+        """Returns the paths of the images whose outputs are missing or out of date."""
+        if not self.skip_up_to_date or self.create_new_name:
+            return self.original_image_paths
+
+        return [image_path for image_path in self.original_image_paths
+                if not output_is_up_to_date(image_path, os.path.join(self.new_images_directory,
+                                                                     os.path.basename(image_path)),
+                                            self.new_image_height, self.new_image_width,
+                                            channels=self.image_channels)]
+
     def process_data(self):
         print('\nProcessing started....')
-        self._process_and_save_image_dataset(image_paths=self.original_image_paths)
-        print("\nProcess complete!")
+        image_paths = self._get_image_paths_to_process()
+        if image_paths:
+            self._process_and_save_image_dataset(image_paths=image_paths)
+        print(f"\nProcess complete! {len(image_paths)} of {len(self.original_image_paths)} images processed.")
 
 
 class ImageAndMaskCropperResizerAndSaver:
@@ -800,7 +925,12 @@ class ImageAndMaskCropperResizerAndSaver:
                  image_save_format: str = 'png',
                  mask_save_format: str = 'png',
                  cache_dir: Union[None, str] = None,
-                 assign_dataset=False):
+                 assign_dataset=False,
+                 png_compression: int = -1,
+                 jpeg_quality: int = 95,
+                 image_paths: Union[List[str], None] = None,
+                 mask_paths: Union[List[str], None] = None,
+                 skip_up_to_date: bool = False):
         """
         This Class contains methods that are used to crop, resize and re-save a collection of images and their
         corresponding mask. If the image is cropped, after cropping the result is automatically resized to the
@@ -819,6 +949,14 @@ class ImageAndMaskCropperResizerAndSaver:
         :param image_save_prefix: (str): Prefix for saving the images. By default, it is left blank.
         :param mask_save_prefix: (str): Prefix for saving the mask. By default, it is left blank.
         :param image_save_format: (str): File format for saving the processed images. By default, it is set to 'jpg'
+        :param png_compression: (int) zlib compression level (0 - 9) used when saving PNG images and masks. -1 uses
+            the zlib default.
+        :param jpeg_quality: (int) Quality (0 - 100) used when saving JPEG images and masks.
+        :param image_paths: (list) Paths of the images to process. By default, every image in the images_directory
+            is processed.
+        :param mask_paths: (list) Paths of the masks that correspond to image_paths. Required if image_paths is given.
+        :param skip_up_to_date: (bool) If True, image-mask pairs saved with their original names are skipped when both
+            outputs are newer than their sources and already have the final dimensions.
         :param crop_image_and_mask: (bool): If 'True' the all the input masks and images would be cropped before
             resizing them to the required size (image_size)
         :param crop_dimension: (Tuple): A tuple (offset_height, offset_width, target_height, target_width) containing
@@ -836,8 +974,15 @@ class ImageAndMaskCropperResizerAndSaver:
                                                     overwrite_if_existing=False)
 
         # Generate filepaths to the images and masks
-        self.original_image_paths, self.original_mask_paths = self._get_sorted_filepaths_to_images_and_masks(
-            images_directory, masks_directory)
+        if image_paths is not None:
+            if mask_paths is None or len(mask_paths) != len(image_paths):
+                raise ValueError("'mask_paths' must contain one mask for each of the 'image_paths'.")
+            self.original_image_paths = self.sort_filenames(image_paths)
+            self.original_mask_paths = self.sort_filenames(mask_paths)
+        else:
+            self.original_image_paths, self.original_mask_paths = self._get_sorted_filepaths_to_images_and_masks(
+                images_directory, masks_directory)
+        self.skip_up_to_date = skip_up_to_date
 
         # Extract image and mask format and assign save format
         img_path = self.original_image_paths[0]
@@ -873,6 +1018,17 @@ class ImageAndMaskCropperResizerAndSaver:
         self.mask_save_prefix = mask_save_prefix
         self.image_save_format = image_save_format
         self.mask_save_format = mask_save_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+
+        # Images and masks saved with a new name use the save formats, while those saved with their base names keep
+        # the formats of the original files.
+        if self.create_new_name:
+            self.native_encoding = (supports_native_encoding(self.image_save_format) and
+                                    supports_native_encoding(self.mask_save_format))
+        else:
+            self.native_encoding = (supports_native_encoding(self.image_format) and
+                                    supports_native_encoding(self.mask_format))
 
         # set the initial shape of the images and masks.
         self.image_shape, self.mask_shape = self._get_image_and_mask_shape(image_path=img_path,
@@ -916,6 +1072,25 @@ class ImageAndMaskCropperResizerAndSaver:
         else:
             self.crop_image_and_mask = False
 
+        # JPEG images that are cropped are decoded within their crop window only, and those that are downsized are
+        # decoded at the smallest DCT scale that is still larger than the final shape.
+        self.crop_window = ((self.offset_height, self.offset_width, self.target_height, self.target_width)
+                            if self.crop_image_and_mask else None)
+        self.decode_jpeg_region = is_jpeg_format(self.image_format) and (self.crop_image_and_mask or
+                                                                         self.resize_images)
+        self.jpeg_decode_ratio = 1
+        if self.decode_jpeg_region and self.resize_images:
+            self.jpeg_decode_ratio = get_jpeg_decode_ratio(source_shape=tuple(self.image_shape)[:2],
+                                                           target_shape=(self.new_image_height, self.new_image_width),
+                                                           crop_window=self.crop_window)
+        if self.decode_jpeg_region:
+            self.decoded_image_shape = get_decoded_jpeg_shape(source_shape=tuple(self.image_shape)[:2],
+                                                              channels=tuple(self.image_shape)[2],
+                                                              ratio=self.jpeg_decode_ratio,
+                                                              crop_window=self.crop_window)
+        else:
+            self.decoded_image_shape = self.image_shape
+
         if cache_dir is not None:
             self.cache_directory = create_directory(dir_name=cache_dir, return_dir=True, overwrite_if_existing=True)
         else:
@@ -954,19 +1129,19 @@ class ImageAndMaskCropperResizerAndSaver:
         return os.path.splitext(image_path)[-1]
 
     def _get_image_and_mask_shape(self, image_path, mask_path):
-        image = tf.io.read_file(image_path)
-        image = self.decode_image(image, channels=self.image_channels)
-
-        mask = tf.io.read_file(mask_path)
-        mask = self.decode_image(mask, channels=self.mask_channels)
+        """Returns the shapes of the decoded image and mask, read from the file headers."""
+        image_info = probe_image(image_path)
+        mask_info = probe_image(mask_path)
 
-        return image.shape, mask.shape
+        image_shape = (image_info.height, image_info.width, self.image_channels or image_info.channels)
+        mask_shape = (mask_info.height, mask_info.width, self.mask_channels or mask_info.channels)
+        return tf.TensorShape(image_shape), tf.TensorShape(mask_shape)
 
     def _set_original_shape(self, image, mask):
         """ Sets width and height information to the image and mask tensors.
 
         """
-        image.set_shape(self.image_shape)
+        image.set_shape(self.decoded_image_shape)
         mask.set_shape(self.mask_shape)
         return image, mask
 
@@ -989,7 +1164,11 @@ class ImageAndMaskCropperResizerAndSaver:
         image = tf.io.read_file(image_path)
         mask = tf.io.read_file(mask_path)
 
-        image = self.decode_image(image, channels=self.image_channels)
+        if self.decode_jpeg_region:
+            image = decode_jpeg_region(image, channels=self.image_channels, ratio=self.jpeg_decode_ratio,
+                                       crop_window=self.crop_window)
+        else:
+            image = self.decode_image(image, channels=self.image_channels)
         mask = self.decode_mask(mask, channels=self.mask_channels)
         image, mask = self._set_original_shape(image, mask)
         return image, mask
@@ -998,9 +1177,11 @@ class ImageAndMaskCropperResizerAndSaver:
         """Crops out a portion of the image and mask."""
         # crop image and mask
         if self.crop_image_and_mask and self.crop_dimension is not None:
-            image = tf.expand_dims(image, axis=-1) if image.ndim == 2 else image
-            image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width,
-                                                  self.target_height, self.target_width)
+            # JPEG images were already cropped while they were decoded.
+            if not self.decode_jpeg_region:
+                image = tf.expand_dims(image, axis=-1) if image.ndim == 2 else image
+                image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width,
+                                                      self.target_height, self.target_width)
 
             mask = tf.expand_dims(mask, axis=-1) if mask.ndim == 2 else mask
             mask = tf.image.crop_to_bounding_box(mask, self.offset_height, self.offset_width,
@@ -1092,7 +1273,23 @@ class ImageAndMaskCropperResizerAndSaver:
                   arr=mask, check_contrast=False)
         return index
 
+    def _write_image_and_mask(self, index, image, mask):
+        # encodes and saves the image and mask without leaving the TensorFlow graph
+        image_path = get_save_path(self.new_images_directory, self.image_save_prefix, index, self.image_save_format)
+        mask_path = get_save_path(self.new_masks_directory, self.mask_save_prefix, index, self.mask_save_format)
+
+        write_image_op = write_image(image, image_path, image_format=self.image_save_format,
+                                     png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+        write_mask_op = write_image(mask, mask_path, image_format=self.mask_save_format,
+                                    png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+
+        with tf.control_dependencies([write_image_op, write_mask_op]):
+            return tf.identity(index)
+
     def _tf_save_image_and_mask(self, index, image, mask):
+        if self.native_encoding:
+            return self._write_image_and_mask(index, image, mask)
+
         index_shape = index.shape
         [index_ans, ] = tf.py_function(func=self._save_image_and_mask, inp=[index, image, mask], Tout=[tf.int64])
         index_ans.set_shape(index_shape)
@@ -1117,7 +1314,23 @@ class ImageAndMaskCropperResizerAndSaver:
 
         return tf.constant(1, tf.int64)
 
+    def _write_image_and_mask_with_basename(self, image, mask, image_name, mask_name):
+        # encodes and saves the image and mask under their original names, without leaving the TensorFlow graph
+        image_path = tf.strings.join([self.new_images_directory, image_name])
+        mask_path = tf.strings.join([self.new_masks_directory, mask_name])
+
+        write_image_op = write_image(image, image_path, image_format=self.image_format,
+                                     png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+        write_mask_op = write_image(mask, mask_path, image_format=self.mask_format,
+                                    png_compression=self.png_compression, jpeg_quality=self.jpeg_quality)
+
+        with tf.control_dependencies([write_image_op, write_mask_op]):
+            return tf.constant(1, tf.int64)
+
     def _tf_save_image_and_mask_with_basename(self, image, mask, image_name, mask_name):
+        if self.native_encoding:
+            return self._write_image_and_mask_with_basename(image, mask, image_name, mask_name)
+
         [index_ans, ] = tf.py_function(func=self._save_image_and_mask_with_base_name,
                                        inp=[image, mask, image_name, mask_name], Tout=[tf.int64])
         # index_ans.set_shape(index_shape)
@@ -1166,37 +1379,100 @@ class ImageAndMaskCropperResizerAndSaver:
             list(dataset.as_numpy_iterator())
             del dataset
 
+    def _get_image_and_mask_paths_to_process(self):
+        """Returns the paths of the image-mask pairs whose outputs are missing or out of date."""
+        if not self.skip_up_to_date or self.create_new_name:
+            return self.original_image_paths, self.original_mask_paths
+
+        image_paths, mask_paths = [], []
+        for image_path, mask_path in zip(self.original_image_paths, self.original_mask_paths):
+            new_image_path = os.path.join(self.new_images_directory, os.path.basename(image_path))
+            new_mask_path = os.path.join(self.new_masks_directory, os.path.basename(mask_path))
+            if not (output_is_up_to_date(image_path, new_image_path, self.new_image_height, self.new_image_width,
+                                         channels=self.image_channels) and
+                    output_is_up_to_date(mask_path, new_mask_path, self.new_image_height, self.new_image_width,
+                                         channels=self.mask_channels)):
+                image_paths.append(image_path)
+                mask_paths.append(mask_path)
+        return image_paths, mask_paths
+
     def process_data(self):
         print('\nProcessing started....')
-        self._process_and_save_image_mask_dataset(image_paths=self.original_image_paths,
-                                                  mask_paths=self.original_mask_paths)
-        print("\nProcess complete!")
+        image_paths, mask_paths = self._get_image_and_mask_paths_to_process()
+        if image_paths:
+            self._process_and_save_image_mask_dataset(image_paths=image_paths, mask_paths=mask_paths)
+        print(f"\nProcess complete! {len(image_paths)} of {len(self.original_image_paths)} image-mask pairs "
+              f"processed.")
+
+
+def get_tile_grid(parent_image_shape: Tuple[int, int], new_image_shape: Tuple[int, int],
+                  resulting_image_grid: Union[Tuple[int, int], None] = (2, 2),
+                  overlap: Union[int, Tuple[int, int]] = 0):
+    """
+    Works out how child images are laid out on the parent image. The child images are spread evenly, with the first
+    at the top/left edge and the last at the bottom/right edge (or at the top/left edge, if there is a single one).
+
+    :param parent_image_shape: (tuple) The [height, width] of the parent image
+    :param new_image_shape: (tuple) The [height, width] of the new images
+    :param resulting_image_grid: (tuple) The [number_of_images_per_column, number_of_images_per_row]. If None, the
+        smallest grid that covers the parent image with neighbours overlapping by at least `overlap` is used.
+    :param overlap: (int, tuple) Minimum overlap between neighbouring images, as an int or a (vertical, horizontal)
+        tuple. Only used when resulting_image_grid is None.
+    :return: (tuple) the grid (images_per_column, images_per_row), and the (vertical, horizontal) distance between
+        the top-left corners of neighbouring images.
+    :raises ValueError: if the new images are larger than the parent image, or do not fit the grid.
+    """
+    overlaps = (overlap, overlap) if isinstance(overlap, int) else tuple(overlap)
+
+    grid = []
+    strides = []
+    for axis, name in enumerate(('height', 'width')):
+        parent_size, new_size = int(parent_image_shape[axis]), int(new_image_shape[axis])
+        if new_size > parent_size:
+            raise ValueError(f'The new images ({new_size}) cannot be larger than the parent image ({parent_size}) '
+                             f'along the {name}.')
+
+        if resulting_image_grid is None:
+            if not 0 <= overlaps[axis] < new_size:
+                raise ValueError(f'The overlap along the {name} must be between 0 and {new_size - 1}.')
+            step = new_size - overlaps[axis]
+            count = max(-(-(parent_size - overlaps[axis]) // step), 1)
+        else:
+            count = int(resulting_image_grid[axis])
+            if count < 1:
+                raise ValueError('The grid must contain at least one image along each axis.')
+
+        if count == 1:
+            # A single image along this axis; the stride only has to step past the parent image.
+            stride = parent_size - new_size + 1
+        else:
+            stride = (parent_size - new_size) // (count - 1)
+            if stride < 1:
+                raise ValueError(f'{count} images of {name} {new_size} cannot be laid out on a parent image of '
+                                 f'{name} {parent_size}.')
+
+        grid.append(count)
+        strides.append(stride)
+
+    return tuple(grid), tuple(strides)
 
 
 def produce_multiple_crop_dimensions(parent_image_shape: tuple[int, int], new_image_shape: tuple[int, int],
-                                     resulting_image_grid: tuple[int, int] = (2, 2)):
+                                     resulting_image_grid: tuple[int, int] = (2, 2),
+                                     overlap: Union[int, Tuple[int, int]] = 0):
     """produces a list containing list of crop dimension to the crop the child images from the parent image.
 
     :param parent_image_shape: (tuple) The [height, width] of the parent image
     :param new_image_shape: (tuple) The [height, width] of the new images
     :param resulting_image_grid: (tuple) The [number_of_images_per_column, number_of_images_per_row] that would be generated from the input image
+    :param overlap: (int, tuple) Minimum overlap between neighbouring images, used when resulting_image_grid is None.
     """
-
-    parent_image_height = parent_image_shape[0]
-    parent_image_width = parent_image_shape[1]
+    (images_per_column, images_per_row), (vertical_interval, horizontal_interval) = get_tile_grid(
+        parent_image_shape, new_image_shape, resulting_image_grid=resulting_image_grid, overlap=overlap)
 
     new_image_height = new_image_shape[0]
     new_image_width = new_image_shape[1]
 
-    images_per_row = resulting_image_grid[1]
-    images_per_column = resulting_image_grid[0]
-
-    horizontal_delta = (parent_image_width - (new_image_width * images_per_row)) // (images_per_row - 1)
-    vertical_delta = (parent_image_height - (new_image_height * images_per_column)) // (images_per_column - 1)
-
-    horizontal_interval = new_image_width + horizontal_delta
-    vertical_interval = new_image_height + vertical_delta
-
     horizontal_points = [horizontal_interval * idx for idx in range(0, images_per_row)]
     vertical_points = [vertical_interval * idx for idx in range(0, images_per_column)]
 
@@ -1208,11 +1484,151 @@ def produce_multiple_crop_dimensions(parent_image_shape: tuple[int, int], new_im
     return crop_dimension_list
 
 
+def extract_tiles(image, tile_shape: Tuple[int, int], grid: Tuple[int, int], strides: Tuple[int, int]):
+    """
+    Crops a grid of tiles out of an image with a single `tf.image.extract_patches` op, instead of one crop per tile.
+
+    :param image: (Tensor) Image of shape [height, width, channels].
+    :param tile_shape: (tuple) The [height, width] of the tiles.
+    :param grid: (tuple) The [number_of_tiles_per_column, number_of_tiles_per_row], see `get_tile_grid`.
+    :param strides: (tuple) The (vertical, horizontal) distance between neighbouring tiles, see `get_tile_grid`.
+    :return: (Tensor) Tiles of shape [number_of_tiles, tile_height, tile_width, channels], ordered column by column
+        like the crop dimensions of `produce_multiple_crop_dimensions`.
+    """
+    tile_height, tile_width = tile_shape
+    images_per_column, images_per_row = grid
+
+    patches = tf.image.extract_patches(images=image[tf.newaxis], sizes=[1, tile_height, tile_width, 1],
+                                       strides=[1, strides[0], strides[1], 1], rates=[1, 1, 1, 1], padding='VALID')
+
+    # The strides are rounded down, so the patches may extend one row or column past the grid.
+    patches = patches[0, :images_per_column, :images_per_row]
+    patches = tf.transpose(patches, perm=[1, 0, 2])
+    tiles = tf.reshape(patches, shape=[images_per_column * images_per_row, tile_height, tile_width, -1])
+    if image.shape[-1] is not None:
+        tiles.set_shape([images_per_column * images_per_row, tile_height, tile_width, image.shape[-1]])
+    return tiles
+
+
+NATIVE_ENCODING_FORMATS = ('png', 'jpg', 'jpeg')
+
+
+def supports_native_encoding(image_format: str) -> bool:
+    """Returns True if images saved in `image_format` can be encoded inside the TensorFlow graph."""
+    return image_format is not None and image_format.lower().lstrip('.') in NATIVE_ENCODING_FORMATS
+
+
+def get_save_path(directory: str, prefix: str, index, image_format: str):
+    """
+    Builds the path '<directory>/<prefix>_<index>.<image_format>' as a string tensor.
+
+    :param directory: (str) Directory where the file would be saved.
+    :param prefix: (str) Prefix of the file name, e.g. 'img'.
+    :param index: (Tensor) Integer index of the file.
+    :param image_format: (str) Extension of the file, with or without the leading dot.
+    :return: (Tensor) Scalar string tensor containing the file path.
+    """
+    return tf.strings.join([os.path.join(directory, f'{prefix}_'),
+                            tf.strings.as_string(index),
+                            f".{image_format.lstrip('.')}"])
+
+
+def encode_image(image, image_format: str = 'png', png_compression: int = -1, jpeg_quality: int = 95):
+    """
+    Encodes an image tensor as PNG or JPEG inside the TensorFlow graph.
+
+    :param image: (Tensor) Image of shape [height, width, channels]. Non uint8 images are converted to uint8.
+    :param image_format: (str) 'png', 'jpg' or 'jpeg'.
+    :param png_compression: (int) zlib compression level from 0 (fastest, largest file) to 9 (slowest, smallest
+        file). -1 uses the zlib default.
+    :param jpeg_quality: (int) JPEG quality from 0 to 100.
+    :return: (Tensor) Scalar string tensor containing the encoded image.
+    """
+    if image.dtype != tf.uint8:
+        image = tf.image.convert_image_dtype(image, dtype=tf.uint8, saturate=True)
+
+    if image_format.lower().lstrip('.') in ['jpg', 'jpeg']:
+        return tf.io.encode_jpeg(image, quality=jpeg_quality)
+    return tf.io.encode_png(image, compression=png_compression)
+
+
+def write_image(image, file_path, image_format: str = 'png', png_compression: int = -1, jpeg_quality: int = 95):
+    """
+    Encodes an image and writes it to `file_path` with `tf.io.write_file`. Unlike `skimage.io.imsave` wrapped in a
+    `tf.py_function`, this does not hold the GIL, so it scales with `num_parallel_calls`.
+
+    :return: The write operation, to be used as a control dependency.
+    """
+    contents = encode_image(image, image_format=image_format, png_compression=png_compression,
+                            jpeg_quality=jpeg_quality)
+    return tf.io.write_file(file_path, contents)
+
+
+# Scales at which libjpeg can decode a JPEG through its DCT (1/8, 1/4 and 1/2), from the smallest.
+JPEG_DECODE_RATIOS = (8, 4, 2)
+
+
+def is_jpeg_format(image_format: str) -> bool:
+    return image_format.lower().lstrip('.') in ['jpg', 'jpeg']
+
+
+def get_jpeg_decode_ratio(source_shape: Tuple[int, int], target_shape: Tuple[int, int],
+                          crop_window: Union[Tuple[int, int, int, int], None] = None) -> int:
+    """
+    Returns the largest DCT scaling ratio (1, 2, 4 or 8) at which a JPEG can be decoded, without the decoded region
+    becoming smaller than the size it is later resized to.
+
+    :param source_shape: (tuple) (height, width) of the JPEG.
+    :param target_shape: (tuple) (height, width) the decoded region is resized to.
+    :param crop_window: (tuple) (offset_height, offset_width, target_height, target_width) of the region that is
+        cropped from the JPEG, at full resolution. Its values must be multiples of the ratio, so that the region
+        matches the one cropped from the full-resolution mask exactly.
+    """
+    region_height, region_width = crop_window[2:] if crop_window is not None else source_shape
+    for ratio in JPEG_DECODE_RATIOS:
+        if region_height // ratio < target_shape[0] or region_width // ratio < target_shape[1]:
+            continue
+        if crop_window is not None and any(value % ratio for value in crop_window):
+            continue
+        return ratio
+    return 1
+
+
+def get_decoded_jpeg_shape(source_shape: Tuple[int, int], channels: int, ratio: int = 1,
+                           crop_window: Union[Tuple[int, int, int, int], None] = None):
+    """Returns the shape of the tensor returned by `decode_jpeg_region`."""
+    if crop_window is not None:
+        return crop_window[2] // ratio, crop_window[3] // ratio, channels
+
+    # libjpeg rounds the scaled dimensions up.
+    return -(-source_shape[0] // ratio), -(-source_shape[1] // ratio), channels
+
+
+def decode_jpeg_region(contents, channels: int, ratio: int = 1,
+                       crop_window: Union[Tuple[int, int, int, int], None] = None):
+    """
+    Decodes a JPEG at 1/ratio of its resolution and, if a crop window is given, only decodes the rows and columns of
+    the window. Both reduce the decoding time and the memory used, compared with decoding the whole image at full
+    resolution before cropping and resizing it.
+
+    :param contents: (Tensor) the encoded JPEG.
+    :param channels: (int) number of channels of the decoded image.
+    :param ratio: (int) DCT scaling ratio: 1, 2, 4 or 8 (see `get_jpeg_decode_ratio`).
+    :param crop_window: (tuple) (offset_height, offset_width, target_height, target_width) of the region to decode,
+        at full resolution.
+    """
+    if crop_window is None:
+        return tf.io.decode_jpeg(contents, channels=channels, ratio=ratio)
+
+    # The crop window of decode_and_crop_jpeg is given in the coordinates of the scaled image.
+    scaled_window = tf.constant([value // ratio for value in crop_window], dtype=tf.int32)
+    return tf.io.decode_and_crop_jpeg(contents, scaled_window, channels=channels, ratio=ratio)
+
+
 def resize_image(original_image_path, resized_image_path, size=(256, 256)):
-    """Resize image to a specific dimension and save."""
-    with Image.open(original_image_path) as img:
-        img = img.resize(size, Image.Resampling.BILINEAR)
-        img.save(resized_image_path)
+    """Resize image to a specific (width, height) and save."""
+    img = load_thumbnail(original_image_path, size=(size[1], size[0]))
+    img.save(resized_image_path)
 
 
 def resize_images_and_masks(original_directory: str, new_directory: str, new_size: Tuple[int, int]):
@@ -1231,9 +1647,8 @@ def resize_images_and_masks(original_directory: str, new_directory: str, new_siz
 
                 # Open, resize, and save the image
                 try:
-                    with Image.open(file_path) as img:
-                        resized_img = img.resize(new_size, Image.Resampling.BILINEAR)
-                        resized_img.save(resized_file_path)
+                    resized_img = load_thumbnail(file_path, size=(new_size[1], new_size[0]))
+                    resized_img.save(resized_file_path)
                         # print(f"Resized and saved: {resized_file_path}")
                 except Exception as e:
                     print(f"Failed to process {file_path}: {e}")
\ No newline at end of file
@@ -1,33 +1,44 @@
+import functools
 import json
 import logging
 import os
-import subprocess
 from datetime import timedelta
 from typing import Union, Optional, List
 
 from google.api_core.exceptions import NotFound, GoogleAPIError
-from google.auth import default
-from google.auth import impersonated_credentials
-from google.auth.credentials import Credentials
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
 from google.cloud.exceptions import NotFound
 from google.oauth2 import service_account
 
 from app.config.google_cloud_storage import GoogleCloudStorageConfig
+from app.services.gcs_clients import storage_clients
+from app.services.gcs_sync import DirectorySync, SyncResult, sync_cache
+from app.services.gcs_transfer import LocalBucket, TransferManager, TransferResult
 from app.services.session_store import session_store
+from app.services.url_signer import BatchUrlSigner
 from app.utils.directory_file_management import sort_filenames
 
 logger = logging.getLogger(__name__)
 
 GCS_KEY_CONTENT = os.getenv("GCS_SIGNED_URL_KEY")
 
-if GCS_KEY_CONTENT:
-    credentials_info = json.loads(GCS_KEY_CONTENT)
-    bucket_credentials_for_signed_urls = service_account.Credentials.from_service_account_info(credentials_info)
-else:
+# If set, bulk transfers use a directory on the local filesystem (one subdirectory per bucket) instead of GCS.
+LOCAL_GCS_DIRECTORY = os.getenv("LOCAL_GCS_DIRECTORY")
+
+
+@functools.lru_cache(maxsize=None)
+def get_signing_credentials() -> service_account.Credentials:
+    """
+    Returns the service account credentials that sign URLs, from GCS_SIGNED_URL_KEY or the key file. They are loaded
+    on first use, so the module can be imported without a key, e.g. by tests.
+    """
+    if GCS_KEY_CONTENT:
+        credentials_info = json.loads(GCS_KEY_CONTENT)
+        return service_account.Credentials.from_service_account_info(credentials_info)
+
     gc_config = session_store.gcs_config
-    bucket_credentials_for_signed_urls = service_account.Credentials.from_service_account_file(
-        gc_config.service_account_key_file_path)
+    return service_account.Credentials.from_service_account_file(gc_config.service_account_key_file_path)
 
 
 def create_google_cloud_storage_bucket(bucket_name: Optional[str],
@@ -52,18 +63,10 @@ def create_google_cloud_storage_bucket(bucket_name: Optional[str],
 
         cors = google_cloud_config.cors
 
-        # Prepare credentials if provided; otherwise use default credentials.
-        credentials, project = default()
-
-        if isinstance(credentials, Credentials):
-            credentials = impersonated_credentials.Credentials(
-                source_credentials=credentials,
-                target_principal=google_cloud_config.service_account_email,
-                target_scopes=google_cloud_config.target_scopes,
-                lifetime=3600
-            )
-
-        storage_client = storage.Client(credentials=credentials, project=project)
+        # Impersonate the service account with the default credentials. The client is shared across requests.
+        storage_client = storage_clients.get_client(target_principal=google_cloud_config.service_account_email,
+                                                    target_scopes=google_cloud_config.target_scopes)
+        project = storage_client.project
 
         # Check if bucket exist
         bucket = storage_client.lookup_bucket(bucket_name)
@@ -192,9 +195,9 @@ def get_bucket_for_signed_url(session_id: str) -> Union[storage.Bucket, None]:
         enable_uniform_bucket_level_access = google_cloud_config.enable_uniform_bucket_level_access or False
         cors = google_cloud_config.cors
 
-        # Initialize the storage client.
-        storage_client = storage.Client(credentials=bucket_credentials_for_signed_urls,
-                                        project=project)
+        # Get the shared storage client for the signing service account.
+        storage_client = storage_clients.get_client(credentials=get_signing_credentials(),
+                                                    project=project)
 
         # Check if bucket exist using lookup_bucket
         bucket = storage_client.lookup_bucket(bucket_name)
@@ -271,9 +274,35 @@ def generate_signed_url(session_id: str,
                                     service_account_email=config.service_account_email)
 
 
+def generate_signed_urls(session_id: str,
+                         blob_names: List[str],
+                         method: str = 'GET',
+                         expiration: int = 720,
+                         content_type: Optional[str] = None) -> List[str]:
+    """
+    Generates signed URLs for many GCS blobs at once. URLs are signed in parallel, and cached for the session until
+    shortly before they expire.
+
+    :param session_id: Session ID to identify the bucket.
+    :param blob_names: Names of the GCS blobs.
+    :param method: HTTP method allowed for the signed URLs (e.g., GET, PUT).
+    :param expiration: Time in minutes until the URLs expire.
+    :param content_type: MIME type of the blobs (optional).
+    :return: A signed URL for each blob, in the order of blob_names.
+    """
+    if not blob_names:
+        return []
+
+    signer = BatchUrlSigner(bucket=get_bucket_for_signed_url(session_id=session_id),
+                            cache=session_store.get_signed_url_cache(session_id),
+                            expiration=timedelta(minutes=expiration),
+                            service_account_email=session_store.gcs_config.service_account_email)
+    return signer.sign(blob_names, method=method, content_type=content_type)
+
+
 def delete_google_cloud_storage_bucket(session_id: str):
     """
-    Deletes a GCS bucket associated with a given session ID using the gcloud CLI.
+    Deletes a GCS bucket associated with a given session ID, after deleting its objects concurrently.
 
     :param session_id: The session identifier.
     :return: True if deletion succeeds, False otherwise.
@@ -281,9 +310,7 @@ def delete_google_cloud_storage_bucket(session_id: str):
     bucket_name = session_store.get_bucket_name(session_id=session_id)
 
     try:
-        credentials, project = default()
-        storage_client = storage.Client(project=project,
-                                        credentials=credentials)
+        storage_client = storage_clients.get_client()
 
         # Check if the bucket exists
         bucket = storage_client.lookup_bucket(bucket_name)
@@ -292,17 +319,13 @@ def delete_google_cloud_storage_bucket(session_id: str):
             logger.info(f"Bucket {bucket_name} does not exist.")
             return False
 
-        gcloud_command = [
-            "gcloud",
-            "storage",
-            "rm",
-            f"gs://{bucket_name}",
-            "--recursive"# Destination in GCS
-        ]
-
-        result = subprocess.run(gcloud_command, check=True, capture_output=True)
+        result = TransferManager(bucket).delete_prefix()
+        if not result.success:
+            logger.error(f"{len(result.failed)} objects could not be deleted from bucket {bucket_name}.")
+            return False
 
-        print({result.stdout.decode('utf-8')})
+        bucket.delete(retry=DEFAULT_RETRY)
+        sync_cache.forget(bucket_name)
         logging.info(f"Successfully deleted bucket {bucket_name}.")
 
         return True
@@ -315,19 +338,17 @@ def delete_google_cloud_storage_bucket(session_id: str):
 def delete_and_recreate_directories_in_gcs_bucket(session_id: str,
                                                   directories: list):
     """
-    Deletes specified folders and their contents in a GCS bucket,
-    then recreates them as empty directories.
+    Deletes the contents of specified folders in a GCS bucket, concurrently, leaving them as empty directories.
 
     :param session_id: The session identifier.
-    :param directories: List of directories to delete and recreate.
+    :param directories: List of directories to empty.
     :return: None
     """
     bucket_name = session_store.get_bucket_name(session_id=session_id)
     try:
-        # Use Google Cloud configuration defaults if provided and parameters are not set.
-
         # Get the bucket
         bucket = get_bucket(session_id=session_id)
+        transfer_manager = TransferManager(bucket)
 
         for directory in directories:
             # List all blobs in the directory
@@ -336,14 +357,19 @@ def delete_and_recreate_directories_in_gcs_bucket(session_id: str,
             if not blobs:
                 raise FileNotFoundError(f"Directory '{directory}' does not exist in bucket {bucket_name}.")
 
-            # Delete all blobs in the directory
-            bucket.delete_blobs(blobs)
+            # Delete all blobs in the directory, except the empty blob that keeps the directory.
+            contents = [blob for blob in blobs if blob.name != f"{directory}/"]
+            result = transfer_manager.delete_blobs(contents,
+                                                   description=f"Deletion from gs://{bucket_name}/{directory}")
+            sync_cache.forget(bucket_name, [blob.name for blob in contents])
+            if not result.success:
+                raise GoogleAPIError(f"{len(result.failed)} objects could not be deleted from '{directory}'.")
             logging.info(f"Deleted all contents of directory '{directory}'.")
 
-            # Recreate the directory by uploading an empty blob
-            empty_blob = bucket.blob(f"{directory}/")
-            empty_blob.upload_from_string("")
-            logging.info(f"Recreated empty directory '{directory}'.")
+            # Recreate the directory if it was only implied by its contents.
+            if len(contents) == len(blobs):
+                bucket.blob(f"{directory}/").upload_from_string("")
+                logging.info(f"Recreated empty directory '{directory}'.")
 
     except NotFound:
         logging.info(f"Bucket '{bucket_name}' does not exist.")
@@ -361,8 +387,8 @@ def bucket_exists(bucket_name: str) -> bool:
     :return: True if the bucket exists, False otherwise.
     """
     try:
-        # Initialize the Google Cloud Storage client
-        storage_client = storage.Client()
+        # Get the shared Google Cloud Storage client
+        storage_client = storage_clients.get_client()
 
         # Attempt to get the bucket
         bucket = storage_client.lookup_bucket(bucket_name)
@@ -390,10 +416,8 @@ def list_files_in_bucket_directory(session_id: str,
         :return: Sorted list of file names in the directory.
     """
 
-    credentials, project_name = default()
-
     bucket_name = session_store.get_bucket_name(session_id=session_id)
-    storage_client = storage.Client(project=project_name, credentials=credentials)
+    storage_client = storage_clients.get_client()
 
     # list all blobs (files) in teh specific directory
     blobs = storage_client.list_blobs(bucket_or_name=bucket_name,
@@ -407,93 +431,104 @@ def upload_file_to_gcs_bucket(session_id: str,
                               source_file_name:str,
                               destination_blob_name:str):
     """
-    Uploads a single file to a GCS bucket.
+    Uploads a single file to the session's bucket (see `get_transfer_bucket`), in resumable chunks if it is large, and
+    with CRC32C verification.
 
     :param session_id: The session identifier.
     :param source_file_name: Local path to the source file.
     :param destination_blob_name: Name of the destination blob in GCS.
-    :return: None
+    :return: TransferResult of the upload.
+    :raises GoogleAPIError: if the file could not be uploaded.
     """
+    bucket = get_transfer_bucket(session_store.get_bucket_name(session_id=session_id))
 
-    # Instantiate bucket object linked to the client
-    bucket = get_bucket(session_id=session_id)
-
-    # Instantiate existing blob
-    blob = bucket.blob(destination_blob_name)
+    result = TransferManager(bucket).upload_files([(source_file_name, destination_blob_name)])
+    if not result.success:
+        raise GoogleAPIError(f"File {source_file_name} could not be uploaded: {result.failed[0][1]}")
 
-    # upload file to blob
-    blob.upload_from_filename(source_file_name)
     logging.info(f"File {source_file_name} uploaded to {destination_blob_name}.")
+    return result
+
+
+def get_transfer_bucket(bucket_name: str):
+    """
+    Returns the bucket used for bulk transfers: a `LocalBucket` if LOCAL_GCS_DIRECTORY is set, the GCS bucket otherwise.
+
+    :param bucket_name: GCS bucket name.
+    """
+    if LOCAL_GCS_DIRECTORY:
+        return LocalBucket(os.path.join(LOCAL_GCS_DIRECTORY, bucket_name), name=bucket_name)
+
+    return storage_clients.get_client().bucket(bucket_name)
 
 
 def upload_files_to_gcs_bucket(bucket_name: str,
                                source_folder_path: str,
                                destination_folder_path: str,
-                               copy=True):
+                               copy=True,
+                               recursive=False,
+                               progress_callback=None) -> TransferResult:
     """
-    Uploads or moves multiple files from a local folder to a GCS bucket using gcloud CLI.
+    Uploads or moves multiple files from a local folder to a GCS bucket, concurrently and with CRC32C verification.
 
     :param bucket_name: GCS bucket name.
     :param source_folder_path: Local source directory.
     :param destination_folder_path: Target folder in GCS.
-    :param copy: If True, files are copied. If False, files are moved.
-    :return: Output or error message.
+    :param copy: If True, files are copied. If False, files are moved: each local file is deleted once its upload has
+        been verified.
+    :param recursive: If True, files in subdirectories are uploaded too, keeping their relative paths.
+    :param progress_callback: Called with the TransferProgress after each file.
+    :return: TransferResult with the number of files and bytes uploaded, the throughput and the failed files.
     """
-
-    try:
-        upload_mode = 'cp' if copy else 'mv'  # Choose between copy or move
-        source_directory = source_folder_path.rstrip("/") + "/*"  # Ensure no trailing slash
-        destination_directory = destination_folder_path.rstrip("/")  # Ensure no trailing slash
-
-        gcloud_command = [
-            "gcloud",
-            "storage",
-            upload_mode,
-            source_directory,  # Local source folder
-            f"gs://{bucket_name}/{destination_directory}/",  # Destination in GCS
-        ]
-
-        result = subprocess.run(gcloud_command, check=True, capture_output=True)
-
-        print(f"File uploaded successfully!\n{result.stdout.decode('utf-8')}\n")
-
-    except subprocess.CalledProcessError as e:
-        print("Error while uploading file to Google Cloud Storage:", e.stderr.decode('utf-8'))
-        return e.stderr.decode('utf-8')
+    transfer_manager = TransferManager(get_transfer_bucket(bucket_name), progress_callback=progress_callback)
+    return transfer_manager.upload_directory(source_directory=source_folder_path,
+                                             destination_prefix=destination_folder_path,
+                                             move=not copy,
+                                             recursive=recursive)
 
 
 def download_files_from_gcs_folder(bucket_name: str,
                                    source_folder_path: str,
                                    destination_folder_path: str,
-                                   copy= True):
+                                   copy=True,
+                                   progress_callback=None) -> TransferResult:
     """
-    Downloads or moves files from a GCS bucket to a local directory.
+    Downloads or moves files from a GCS bucket to a local directory, concurrently and with CRC32C verification.
 
     :param bucket_name: GCS bucket name.
     :param source_folder_path: Source path in the GCS bucket.
     :param destination_folder_path: Local path to download the files.
-    :param copy: If True, files are copied. If False, files are moved.
-    :return: Tuple (bool, message) indicating success and message.
+    :param copy: If True, files are copied. If False, files are moved: each object is deleted from the bucket once
+        its download has been verified.
+    :param progress_callback: Called with the TransferProgress after each file.
+    :return: TransferResult with the number of files and bytes downloaded, the throughput and the failed files.
     """
+    transfer_manager = TransferManager(get_transfer_bucket(bucket_name), progress_callback=progress_callback)
+    return transfer_manager.download_prefix(source_prefix=source_folder_path,
+                                            destination_directory=destination_folder_path,
+                                            move=not copy)
+
+
+def sync_files_to_gcs_bucket(bucket_name: str,
+                             source_folder_path: str,
+                             destination_folder_path: str,
+                             recursive=False,
+                             delete=True,
+                             progress_callback=None) -> SyncResult:
+    """
+    Makes a folder of a GCS bucket mirror a local folder: only new or changed files are uploaded, and the objects whose
+    local file is gone are deleted. The local files are kept.
 
-    try:
-        download_mode = 'cp' if copy else 'mv'
-        source_directory = source_folder_path[:-2] if source_folder_path.endswith("/") else source_folder_path
-        gcloud_command = ["gcloud",
-                          "storage",
-                          download_mode,
-                          f"gs://{bucket_name}/{source_directory}/*",
-                          destination_folder_path
-                          ]
-
-        result = subprocess.run(gcloud_command, check=True, capture_output=True)
-
-        logger.info(f"File(s) downloaded successfully from GCS:\n{result.stdout}")
-        return True, f"File downloaded successfully to {destination_folder_path}."
-
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr.decode("utf-8") if e.stderr else "Unknown error"
-        logger.error(f"Error while copying file from Google Cloud Storage: {error_msg}")
-        return False, error_msg
-
-
+    :param bucket_name: GCS bucket name.
+    :param source_folder_path: Local source directory.
+    :param destination_folder_path: Target folder in GCS.
+    :param recursive: If True, files in subdirectories are synced too, keeping their relative paths.
+    :param delete: If True, objects without a local file are deleted. Nothing is deleted if the local folder is empty.
+    :param progress_callback: Called with the TransferProgress after each file.
+    :return: SyncResult with the uploads, the deletions and the number of unchanged files.
+    """
+    directory_sync = DirectorySync(get_transfer_bucket(bucket_name), progress_callback=progress_callback)
+    return directory_sync.sync(source_directory=source_folder_path,
+                               destination_prefix=destination_folder_path,
+                               recursive=recursive,
+                               delete=delete)
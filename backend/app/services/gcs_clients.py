@@ -0,0 +1,159 @@
+import datetime
+import logging
+import os
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+import google.auth
+import requests
+from google.auth import impersonated_credentials
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of connections kept open per host by each pooled session. It should be at least the number of
+# threads that use a client at the same time, e.g. the TransferManager's workers.
+CONNECTION_POOL_SIZE = int(os.getenv("GCS_CONNECTION_POOL_SIZE", "32"))
+
+# Tokens are refreshed when they expire within this margin, so requests do not wait for a refresh.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Lifetime, in seconds, of impersonated access tokens.
+IMPERSONATED_TOKEN_LIFETIME = 3600
+
+
+def get_principal(credentials: Credentials) -> str:
+    """Returns the identity credentials act as: the service account email, if known."""
+    for attribute in ('service_account_email', 'signer_email', '_target_principal'):
+        principal = getattr(credentials, attribute, None)
+        if isinstance(principal, str) and principal != 'default':
+            return principal
+    return type(credentials).__name__
+
+
+class ClientEntry(NamedTuple):
+    """
+    A cached client, with its credentials, its pooled session, and the request and lock its token is refreshed with.
+    """
+    client: storage.Client
+    credentials: Credentials
+    session: AuthorizedSession
+    refresh_request: Request
+    refresh_lock: threading.Lock
+
+
+class StorageClientRegistry:
+    """
+    Process-wide cache of `storage.Client` objects, keyed by (credentials principal, project, kind of credentials).
+    The kind keeps apart clients that act as the same service account through different credentials, e.g.
+    impersonated credentials and the account's own key file.
+
+    Each client shares one `AuthorizedSession` whose connection pool holds up to `pool_size` keep-alive connections,
+    so requests after the first reuse an open TLS connection instead of creating a client, an HTTP session and a
+    handshake each time. Application default credentials are looked up once.
+
+    Tokens are refreshed under a lock per client, ahead of their expiry, when a client is handed out, and in the background
+    while it is in use, so concurrent requests never trigger several refreshes or wait on an expired token. Clients
+    may be shared across threads.
+    """
+
+    def __init__(self, pool_size: int = CONNECTION_POOL_SIZE,
+                 refresh_margin: datetime.timedelta = TOKEN_REFRESH_MARGIN):
+        """
+        :param pool_size: (int) maximum number of open connections per host, for each client.
+        :param refresh_margin: (timedelta) tokens expiring within this margin are refreshed before a client is returned.
+        """
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+
+        self._lock = threading.Lock()
+        self._default_credentials: Optional[Tuple[Credentials, str]] = None
+        self._clients = {}
+
+    def get_default_credentials(self) -> Tuple[Credentials, str]:
+        """Returns the application default credentials and project, looking them up only once."""
+        with self._lock:
+            if self._default_credentials is None:
+                self._default_credentials = google.auth.default()
+            return self._default_credentials
+
+    def _create_session(self, credentials: Credentials) -> AuthorizedSession:
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _refresh_if_expiring(self, credentials: Credentials, request: Request):
+        expiry = getattr(credentials, 'expiry', None)
+        if credentials.valid and expiry is not None:
+            # google-auth stores expiry as a naive UTC datetime.
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if expiry - now > self.refresh_margin:
+                return
+        elif credentials.valid:
+            return
+
+        credentials.refresh(request)
+
+    def get_client(self, credentials: Optional[Credentials] = None, project: Optional[str] = None,
+                   target_principal: Optional[str] = None, target_scopes: Optional[List[str]] = None) -> storage.Client:
+        """
+        Returns the client for a set of credentials and a project, creating it on first use.
+
+        :param credentials: (Credentials) credentials of the client. The application default credentials are used,
+            if None.
+        :param project: (str) project of the client. The default credentials' project is used, if None.
+        :param target_principal: (str) service account to impersonate with the credentials, if any.
+        :param target_scopes: (list) scopes of the impersonated credentials.
+        """
+        if credentials is None:
+            credentials, default_project = self.get_default_credentials()
+            project = project or default_project
+
+        principal = target_principal or get_principal(credentials)
+        kind = 'impersonated' if target_principal is not None else type(credentials).__name__
+        key = (principal, project, kind)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                if target_principal is not None:
+                    credentials = impersonated_credentials.Credentials(source_credentials=credentials,
+                                                                       target_principal=target_principal,
+                                                                       target_scopes=target_scopes,
+                                                                       lifetime=IMPERSONATED_TOKEN_LIFETIME)
+
+                # Refresh tokens in a background thread once they are close to expiring, rather than blocking the
+                # request that notices it.
+                if hasattr(credentials, 'with_non_blocking_refresh'):
+                    credentials.with_non_blocking_refresh()
+
+                session = self._create_session(credentials)
+                client = storage.Client(project=project, credentials=credentials, _http=session)
+                # Tokens are refreshed over a plain session: the authorized one would attach the expiring token to
+                # the token request, e.g. calling IAM as the impersonated account instead of the source credentials.
+                entry = ClientEntry(client=client, credentials=credentials, session=session,
+                                    refresh_request=Request(requests.Session()), refresh_lock=threading.Lock())
+                self._clients[key] = entry
+                logger.info(f"Created storage client for '{principal}' ({kind}) in project '{project}'.")
+
+        # Only requests for the same client wait for its refresh; the registry lock just guards the cache.
+        with entry.refresh_lock:
+            self._refresh_if_expiring(entry.credentials, entry.refresh_request)
+        return entry.client
+
+    def clear(self):
+        """Closes the pooled sessions and forgets all clients and credentials."""
+        with self._lock:
+            for entry in self._clients.values():
+                entry.session.close()
+                entry.refresh_request.session.close()
+            self._clients = {}
+            self._default_credentials = None
+
+
+storage_clients = StorageClientRegistry()
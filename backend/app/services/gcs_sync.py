@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.gcs_transfer import TransferManager, TransferProgress, TransferResult, file_crc32c
+
+logger = logging.getLogger(__name__)
+
+# Fields requested when listing a prefix: only what is needed to compare objects with local files.
+LISTING_FIELDS = 'items(name,size,crc32c,md5Hash,generation),nextPageToken'
+
+
+def file_md5(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the MD5 of a file, base64 encoded like the `md5_hash` of a GCS blob."""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode('utf-8')
+
+
+def get_file_signature(file_path: str) -> Tuple[int, int]:
+    """Returns the size and modification time of a file, which change whenever its content does."""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class SyncResult(NamedTuple):
+    """Outcome of a sync: the uploads, the deletions, and the number of files that were already up to date."""
+    uploaded: TransferResult
+    deleted: TransferResult
+    unchanged: int
+
+    @property
+    def failed(self) -> List[Tuple[str, str]]:
+        return self.uploaded.failed + self.deleted.failed
+
+    @property
+    def success(self) -> bool:
+        return not self.failed
+
+    def to_dict(self) -> dict:
+        return {'uploaded': self.uploaded.to_dict(),
+                'deleted': self.deleted.to_dict(),
+                'unchanged': self.unchanged}
+
+
+class SyncCache:
+    """
+    Objects found identical to a local file, keyed by (bucket name, object name), with the object's generation and the
+    file's size and modification time at that point.
+
+    GCS gives an object a new generation each time it is written, so while both the generation in a listing and the
+    local file are unchanged, the object is known to be up to date without reading the file to checksum it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Tuple[int, Tuple[int, int]]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_up_to_date(self, bucket_name: str, blob_name: str, generation: int, signature: Tuple[int, int]) -> bool:
+        with self._lock:
+            return self._entries.get((bucket_name, blob_name)) == (generation, signature)
+
+    def set(self, bucket_name: str, blob_name: str, generation: int, signature: Tuple[int, int]):
+        with self._lock:
+            self._entries[(bucket_name, blob_name)] = (generation, signature)
+
+    def forget(self, bucket_name: str, blob_names: Optional[List[str]] = None):
+        """
+        Forgets objects of a bucket.
+
+        :param bucket_name: (str) name of the bucket.
+        :param blob_names: (list) objects to forget. Every object of the bucket is forgotten, if None.
+        """
+        with self._lock:
+            if blob_names is None:
+                self._entries = {key: entry for key, entry in self._entries.items() if key[0] != bucket_name}
+            else:
+                for blob_name in blob_names:
+                    self._entries.pop((bucket_name, blob_name), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+class DirectorySync:
+    """
+    Makes a prefix of a bucket mirror a local directory, transferring only what differs.
+
+    The prefix is listed once. A local file is uploaded when no object has its name, or the object's size differs, or
+    its CRC32C (MD5 when the object has no CRC32C) differs from the file's. Objects without a local file are deleted,
+    concurrently. Objects the `SyncCache` knows to be up to date, by generation, are not checksummed again, so a sync
+    that follows another one with no change reads no file.
+
+    The bucket may be a `storage.Bucket` or a `LocalBucket`.
+    """
+
+    def __init__(self, bucket, cache: Optional[SyncCache] = None, max_workers: int = 16,
+                 progress_callback: Optional[Callable[[TransferProgress], None]] = None):
+        """
+        :param bucket: (storage.Bucket, LocalBucket) the bucket synced to.
+        :param cache: (SyncCache) objects known to be up to date. The process-wide `sync_cache` is used, if None.
+        :param max_workers: (int) maximum number of files uploaded or deleted at the same time.
+        :param progress_callback: (callable) called with the TransferProgress each time a file is done or failed.
+        """
+        self.bucket = bucket
+        self.cache = cache if cache is not None else sync_cache
+        self.transfer_manager = TransferManager(bucket, max_workers=max_workers, progress_callback=progress_callback)
+
+    def list_remote(self, prefix: str, recursive: bool = False) -> dict:
+        """
+        Returns the objects under a prefix, by name, from a single listing. The folder placeholder is left out.
+
+        :param prefix: (str) folder in the bucket, without a trailing '/'.
+        :param recursive: (bool) If True, objects in sub-folders are returned too.
+        """
+        prefix = prefix.strip('/') + '/'
+        blobs = self.bucket.list_blobs(prefix=prefix, delimiter=None if recursive else '/', fields=LISTING_FIELDS)
+
+        remote = {}
+        for blob in blobs:
+            relative_name = blob.name[len(prefix):]
+            if not relative_name or (not recursive and '/' in relative_name):
+                continue
+            remote[blob.name] = blob
+        return remote
+
+    @staticmethod
+    def list_local(directory: str, prefix: str, recursive: bool = False) -> dict:
+        """Returns the local paths of the files in a directory, by the name of the object they are synced to."""
+        prefix = prefix.strip('/')
+        local = {}
+        for current_directory, _, filenames in os.walk(directory):
+            for filename in filenames:
+                file_path = os.path.join(current_directory, filename)
+                relative_path = os.path.relpath(file_path, directory).replace(os.sep, '/')
+                local[f'{prefix}/{relative_path}' if prefix else relative_path] = file_path
+            if not recursive:
+                break
+        return local
+
+    def _is_up_to_date(self, file_path: str, blob) -> bool:
+        signature = get_file_signature(file_path)
+        if blob.size is not None and signature[0] != blob.size:
+            return False
+
+        generation = getattr(blob, 'generation', None)
+        if generation is not None and self.cache.is_up_to_date(self.bucket.name, blob.name, generation, signature):
+            return True
+
+        if blob.crc32c is not None:
+            up_to_date = file_crc32c(file_path) == blob.crc32c
+        elif getattr(blob, 'md5_hash', None) is not None:
+            up_to_date = file_md5(file_path) == blob.md5_hash
+        else:
+            up_to_date = False
+
+        if up_to_date and generation is not None:
+            self.cache.set(self.bucket.name, blob.name, generation, signature)
+        return up_to_date
+
+    def _record_upload(self, file_path: str, blob):
+        generation = getattr(blob, 'generation', None)
+        if generation is not None:
+            self.cache.set(self.bucket.name, blob.name, generation, get_file_signature(file_path))
+
+    def sync(self, source_directory: str, destination_prefix: str, recursive: bool = False,
+             delete: bool = True) -> SyncResult:
+        """
+        Uploads the new and changed files of a local directory to a prefix of the bucket, and deletes the objects whose
+        file no longer exists.
+
+        Nothing is deleted when the local directory has no file, so that a directory that was cleared or never filled
+        (e.g. because its files were streamed to the bucket) does not wipe the prefix.
+
+        :param source_directory: (str) local directory.
+        :param destination_prefix: (str) folder in the bucket, without a trailing '/'.
+        :param recursive: (bool) If True, files in subdirectories are synced too, under the same relative path.
+        :param delete: (bool) If True, objects without a local file are deleted.
+        """
+        destination_prefix = destination_prefix.strip('/')
+        local = self.list_local(source_directory, destination_prefix, recursive=recursive)
+        remote = self.list_remote(destination_prefix, recursive=recursive)
+
+        uploads = []
+        unchanged = 0
+        for blob_name, file_path in sorted(local.items()):
+            blob = remote.get(blob_name)
+            if blob is not None and self._is_up_to_date(file_path, blob):
+                unchanged += 1
+            else:
+                uploads.append((file_path, blob_name))
+
+        deletions = []
+        if delete and local:
+            deletions = [blob for blob_name, blob in sorted(remote.items()) if blob_name not in local]
+
+        logger.info(f'Sync of {source_directory} to gs://{self.bucket.name}/{destination_prefix}: {len(uploads)} to '
+                    f'upload, {len(deletions)} to delete, {unchanged} unchanged.')
+
+        uploaded = self.transfer_manager.upload_files(
+            uploads, on_uploaded=self._record_upload,
+            description=f'Upload to gs://{self.bucket.name}/{destination_prefix}')
+
+        deleted = self.transfer_manager.delete_blobs(
+            deletions, description=f'Deletion from gs://{self.bucket.name}/{destination_prefix}')
+        self.cache.forget(self.bucket.name, [blob.name for blob in deletions])
+
+        return SyncResult(uploaded=uploaded, deleted=deleted, unchanged=unchanged)
+
+
+sync_cache = SyncCache()
@@ -0,0 +1,375 @@
+import base64
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import google_crc32c
+from google.api_core.exceptions import NotFound
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.resumable_media import DataCorruption
+
+logger = logging.getLogger(__name__)
+
+# Files larger than this are uploaded with a resumable upload, in chunks of this size. GCS requires chunk sizes to be
+# a multiple of 256 KiB.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of times a file is transferred again when its checksum does not match after the transfer.
+MAX_ATTEMPTS = 3
+
+
+class ChecksumMismatchError(Exception):
+    """Raised when a transferred file's CRC32C differs from the CRC32C of its source."""
+
+
+def file_crc32c(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the CRC32C of a file, base64 encoded in big-endian order like the `crc32c` of a GCS blob."""
+    checksum = google_crc32c.Checksum()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode('utf-8')
+
+
+class TransferResult(NamedTuple):
+    """Outcome of a transfer: the files and bytes moved, how long it took, and the files that failed."""
+    files: int
+    bytes: int
+    seconds: float
+    failed: List[Tuple[str, str]]
+
+    @property
+    def success(self) -> bool:
+        return not self.failed
+
+    @property
+    def throughput(self) -> float:
+        """Bytes transferred per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {'files': self.files,
+                'bytes': self.bytes,
+                'seconds': round(self.seconds, 3),
+                'bytes_per_second': round(self.throughput),
+                'failed': [{'name': name, 'error': error} for name, error in self.failed]}
+
+
+class TransferProgress:
+    """Thread-safe counters of a transfer in progress, passed to the progress callback after each file."""
+
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.bytes_done = 0
+        self.failed: List[Tuple[str, str]] = []
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def file_done(self, number_of_bytes: int):
+        with self._lock:
+            self.files_done += 1
+            self.bytes_done += number_of_bytes
+
+    def file_failed(self, name: str, error: Exception):
+        with self._lock:
+            self.failed.append((name, str(error)))
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    @property
+    def throughput(self) -> float:
+        """Bytes transferred per second so far."""
+        elapsed = self.elapsed
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    def to_result(self) -> TransferResult:
+        with self._lock:
+            return TransferResult(files=self.files_done, bytes=self.bytes_done, seconds=self.elapsed,
+                                  failed=list(self.failed))
+
+
+class LocalBlob:
+    """
+    Stand-in for `storage.Blob` that stores the object as a file under a `LocalBucket`'s root directory. It implements
+    the part of the Blob API used by `TransferManager`.
+    """
+
+    def __init__(self, bucket: 'LocalBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = None
+        self.size = None
+        self.crc32c = None
+        self.md5_hash = None
+        self.generation = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bucket.root_directory, *self.name.split('/'))
+
+    def exists(self, **kwargs) -> bool:
+        return os.path.isfile(self.path)
+
+    def reload(self, **kwargs):
+        if not self.exists():
+            raise NotFound(f'{self.name} does not exist in {self.bucket.name}.')
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        # The modification time changes whenever the file is replaced, like the generation of a GCS object.
+        self.generation = stat.st_mtime_ns
+        self.crc32c = file_crc32c(self.path)
+
+    def upload_from_filename(self, filename: str, checksum: Optional[str] = None, **kwargs):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f'{self.path}.tmp'
+        shutil.copyfile(filename, temporary_path)
+        os.replace(temporary_path, self.path)
+        self.reload()
+
+    def upload_from_string(self, data, **kwargs):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not self.name.endswith('/'):
+            with open(self.path, 'wb') as file:
+                file.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def open(self, mode: str = 'rb', **kwargs):
+        if 'w' in mode:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return open(self.path, mode)
+
+    def download_to_filename(self, filename: str, checksum: Optional[str] = None, **kwargs):
+        self.reload()
+        shutil.copyfile(self.path, filename)
+        if checksum == 'crc32c' and file_crc32c(filename) != self.crc32c:
+            os.remove(filename)
+            raise DataCorruption(None, f'Checksum mismatch while downloading {self.name}.')
+
+    def delete(self, **kwargs):
+        if not self.exists():
+            raise NotFound(f'{self.name} does not exist in {self.bucket.name}.')
+        os.remove(self.path)
+
+
+class LocalBucket:
+    """
+    Stand-in for `storage.Bucket` backed by a local directory, so transfers can run without GCS. Objects are files
+    under `root_directory`, with the '/' in their names mapped to subdirectories.
+    """
+
+    def __init__(self, root_directory: str, name: Optional[str] = None):
+        self.root_directory = root_directory
+        self.name = name or os.path.basename(os.path.normpath(root_directory))
+        os.makedirs(root_directory, exist_ok=True)
+
+    def blob(self, blob_name: str) -> LocalBlob:
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name: str) -> Optional[LocalBlob]:
+        blob = self.blob(blob_name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix: str = '', **kwargs) -> List[LocalBlob]:
+        blobs = []
+        for directory, _, filenames in os.walk(self.root_directory):
+            for filename in filenames:
+                relative_path = os.path.relpath(os.path.join(directory, filename), self.root_directory)
+                name = relative_path.replace(os.sep, '/')
+                if name.startswith(prefix) and not name.endswith('.tmp'):
+                    blobs.append(self.get_blob(name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+    def rename_blob(self, blob: LocalBlob, new_name: str, **kwargs) -> LocalBlob:
+        new_blob = self.blob(new_name)
+        os.makedirs(os.path.dirname(new_blob.path), exist_ok=True)
+        os.replace(blob.path, new_blob.path)
+        new_blob.reload()
+        return new_blob
+
+    def delete(self, **kwargs):
+        shutil.rmtree(self.root_directory, ignore_errors=True)
+
+
+class TransferManager:
+    """
+    Moves files between a local directory and a GCS bucket concurrently, in-process.
+
+    Every transfer is verified with CRC32C: uploads are compared with the checksum GCS computed for the stored object,
+    and downloads are checked by google-cloud-storage as they are written. A file whose checksum does not match is
+    transferred again, up to `max_attempts` times. In move mode, the source is only deleted once its copy has been
+    verified. Requests that fail with transient errors are retried with the library's default retry policy.
+
+    The bucket may be a `storage.Bucket`, or a `LocalBucket` to run transfers offline. Pointing google-cloud-storage at
+    a GCS emulator (STORAGE_EMULATOR_HOST) works too.
+    """
+
+    def __init__(self, bucket, max_workers: int = 16, chunk_size: int = CHUNK_SIZE, max_attempts: int = MAX_ATTEMPTS,
+                 progress_callback: Optional[Callable[[TransferProgress], None]] = None):
+        """
+        :param bucket: (storage.Bucket, LocalBucket) the bucket files are transferred to and from.
+        :param max_workers: (int) maximum number of files transferred at the same time.
+        :param chunk_size: (int) files larger than this are uploaded in resumable chunks of this size.
+        :param max_attempts: (int) maximum number of times a file is transferred when its checksum does not match.
+        :param progress_callback: (callable) called with the TransferProgress each time a file is done or failed.
+        """
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.progress_callback = progress_callback
+
+    def _run(self, jobs: List[tuple], transfer: Callable, description: str) -> TransferResult:
+        """
+        Runs `transfer(*job)` for each job in a thread pool. The first value of each job is its name, and the second
+        its size in bytes.
+        """
+        progress = TransferProgress(total_files=len(jobs), total_bytes=sum(job[1] for job in jobs))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(transfer, *job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    progress.file_done(future.result())
+                except Exception as e:
+                    logger.error(f'{description} of {name} failed: {e}')
+                    progress.file_failed(name, e)
+
+                if self.progress_callback is not None:
+                    self.progress_callback(progress)
+
+        result = progress.to_result()
+        logger.info(f'{description}: {result.files} of {len(jobs)} files, {result.bytes / 1e6:.1f} MB in '
+                    f'{result.seconds:.1f}s ({result.throughput / 1e6:.1f} MB/s), {len(result.failed)} failed.')
+        return result
+
+    def _with_attempts(self, transfer: Callable):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return transfer()
+            except (ChecksumMismatchError, DataCorruption):
+                if attempt == self.max_attempts:
+                    raise
+
+    def _upload_file(self, file_path: str, size: int, blob_name: str, move: bool,
+                     on_uploaded: Optional[Callable] = None) -> int:
+        local_crc32c = file_crc32c(file_path)
+        blob = self.bucket.blob(blob_name)
+
+        def upload():
+            if size > self.chunk_size:
+                blob.chunk_size = self.chunk_size
+            blob.upload_from_filename(file_path, checksum='crc32c', retry=DEFAULT_RETRY)
+            if blob.crc32c != local_crc32c:
+                raise ChecksumMismatchError(f'{blob_name} was stored with CRC32C {blob.crc32c}, '
+                                            f'expected {local_crc32c}.')
+
+        self._with_attempts(upload)
+        if on_uploaded is not None:
+            on_uploaded(file_path, blob)
+        if move:
+            os.remove(file_path)
+        return size
+
+    def _download_blob(self, blob_name: str, size: int, blob, file_path: str, move: bool) -> int:
+        self._with_attempts(lambda: blob.download_to_filename(file_path, checksum='crc32c', retry=DEFAULT_RETRY))
+        if move:
+            try:
+                blob.delete(retry=DEFAULT_RETRY)
+            except NotFound:
+                pass
+        return size
+
+    def _delete_blob(self, blob_name: str, size: int, blob) -> int:
+        try:
+            blob.delete(retry=DEFAULT_RETRY)
+        except NotFound:
+            pass
+        return size
+
+    def upload_directory(self, source_directory: str, destination_prefix: str, move: bool = False,
+                         recursive: bool = False) -> TransferResult:
+        """
+        Uploads the files in a local directory under a prefix of the bucket.
+
+        :param source_directory: (str) local directory.
+        :param destination_prefix: (str) folder in the bucket, without a trailing '/'.
+        :param move: (bool) If True, each local file is deleted once its upload has been verified.
+        :param recursive: (bool) If True, files in subdirectories are uploaded too, under the same relative path.
+        """
+        destination_prefix = destination_prefix.strip('/')
+        files = []
+        for directory, subdirectories, filenames in os.walk(source_directory):
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                relative_path = os.path.relpath(file_path, source_directory).replace(os.sep, '/')
+                blob_name = f'{destination_prefix}/{relative_path}' if destination_prefix else relative_path
+                files.append((file_path, blob_name))
+            if not recursive:
+                break
+
+        return self.upload_files(files, move=move,
+                                 description=f'Upload to gs://{self.bucket.name}/{destination_prefix}')
+
+    def upload_files(self, files: List[Tuple[str, str]], move: bool = False,
+                     on_uploaded: Optional[Callable] = None, description: Optional[str] = None) -> TransferResult:
+        """
+        Uploads local files to the given objects of the bucket.
+
+        :param files: (list) (local path, object name) pairs.
+        :param move: (bool) If True, each local file is deleted once its upload has been verified.
+        :param on_uploaded: (callable) called with the local path and the uploaded blob, once the upload is verified.
+        :param description: (str) description of the transfer in logs.
+        """
+        jobs = [(file_path, os.path.getsize(file_path), blob_name, move, on_uploaded) for file_path, blob_name in files]
+        return self._run(jobs, self._upload_file, description=description or f'Upload to gs://{self.bucket.name}')
+
+    def download_prefix(self, source_prefix: str, destination_directory: str, move: bool = False) -> TransferResult:
+        """
+        Downloads the objects directly under a prefix of the bucket (not those in sub-folders) to a local directory.
+
+        :param source_prefix: (str) folder in the bucket.
+        :param destination_directory: (str) local directory. It is created if it does not exist.
+        :param move: (bool) If True, each object is deleted from the bucket once its download has been verified.
+        """
+        source_prefix = source_prefix.strip('/') + '/'
+        os.makedirs(destination_directory, exist_ok=True)
+
+        jobs = []
+        for blob in self.bucket.list_blobs(prefix=source_prefix):
+            filename = blob.name[len(source_prefix):]
+            # Skip the folder placeholder and objects in sub-folders.
+            if not filename or '/' in filename:
+                continue
+            jobs.append((blob.name, blob.size or 0, blob, os.path.join(destination_directory, filename), move))
+
+        return self._run(jobs, self._download_blob, description=f'Download from gs://{self.bucket.name}/{source_prefix}')
+
+    def delete_prefix(self, prefix: str = '') -> TransferResult:
+        """
+        Deletes every object whose name starts with `prefix` from the bucket, concurrently.
+
+        :param prefix: (str) prefix of the objects to delete. Every object is deleted, if empty.
+        """
+        return self.delete_blobs(list(self.bucket.list_blobs(prefix=prefix)),
+                                 description=f'Deletion from gs://{self.bucket.name}/{prefix}')
+
+    def delete_blobs(self, blobs: list, description: Optional[str] = None) -> TransferResult:
+        """
+        Deletes the given objects from the bucket, concurrently. Objects that no longer exist are counted as deleted.
+
+        :param blobs: (list) blobs to delete, e.g. from a listing of the bucket.
+        :param description: (str) description of the deletion in logs.
+        """
+        jobs = [(blob.name, blob.size or 0, blob) for blob in blobs]
+        return self._run(jobs, self._delete_blob, description=description or f'Deletion from gs://{self.bucket.name}')
@@ -3,7 +3,9 @@ from typing import Optional, List
 
 from google.cloud import storage
 from app.config import GoogleCloudStorageConfig
+from app.services.url_signer import SignedUrlCache
 from app.utils.directory_file_management import DirectoryStore
+from app.utils.pagination import natural_sort_key
 
 logger = logging.getLogger(__name__)
 
@@ -87,10 +89,7 @@ class SessionStore:
         self._signed_url_bucket_cache: dict[str, storage.Bucket] = {}
         self._directory_store_cache: dict[str, DirectoryStore] = {}
 
-        self._signed_resized_image_mask_urls: dict[str, Optional[List[str]]] = {}
-        self._signed_training_set_urls: dict[str, Optional[List[str]]] = {}
-        self._signed_validation_set_urls: dict[str, Optional[List[str]]] = {}
-        self._signed_test_set_urls: dict[str, Optional[List[str]]] = {}
+        self._signed_url_caches: dict[str, SignedUrlCache] = {}
 
         self._session_is_running: dict[str, bool] = {}
         self._augmentation_is_running: dict[str, bool] = {}
@@ -99,6 +98,10 @@ class SessionStore:
 
         self._image_dimension: dict[str, Optional[dict[str, int]]] = {}
 
+        # Names of the files augmentation streamed to the session's bucket, by bucket folder. Nothing is saved to the
+        # local directories in that case, so these replace their file indexes.
+        self._streamed_files: dict[str, dict[str, set[str]]] = {}
+
     def set_image_dimension(self, session_id: str, height: int, width: int):
         """Set the image height and width for a session."""
         self._image_dimension[session_id] = {'height': height, 'width': width}
@@ -139,8 +142,10 @@ class SessionStore:
         return directory_store
 
     def clear_directory_store(self, session_id: str):
-        """Clears the cached directory store for a session."""
-        self._directory_store_cache.pop(session_id, None)
+        """Clears the cached directory store for a session, after persisting its file indexes."""
+        directory_store = self._directory_store_cache.pop(session_id, None)
+        if directory_store is not None:
+            directory_store.close()
 
     def get_bucket(self, session_id: str) -> Optional[storage.Bucket]:
         """Returns the cached GCS bucket for a session, if it exists."""
@@ -172,61 +177,54 @@ class SessionStore:
         """Clears the signed URL bucket cache for a session."""
         self._signed_url_bucket_cache.pop(session_id, None)
 
-    def get_signed_resized_image_mask_urls(self, session_id) -> Optional[List[str]]:
-        """Gets the signed URLs for resized image and mask set for a session."""
-        return self._signed_resized_image_mask_urls.get(session_id)
-
-    def get_signed_training_set_urls(self, session_id) -> Optional[List[str]]:
-        """Gets the signed URLs for training set for a session."""
-        return self._signed_training_set_urls.get(session_id)
-
-    def get_signed_validation_set_urls(self, session_id) -> Optional[List[str]]:
-        """Gets the signed URLs for validation set for a session."""
-        return self._signed_validation_set_urls.get(session_id)
-
-    def get_signed_test_set_urls(self, session_id) -> Optional[List[str]]:
-        """Gets the signed URLs for test set for a session."""
-        return self._signed_test_set_urls.get(session_id)
-
-    def set_signed_resized_image_mask_urls(self, session_id: str, urls: List[str]) -> None:
-        """Sets the signed URLs for resized image and mask set for a session."""
-        self._signed_resized_image_mask_urls[session_id] = urls
-
-    def set_signed_training_set_urls(self, session_id: str, urls: List[str]) -> None:
-        """Sets the signed URLs for training set for a session."""
-        self._signed_training_set_urls[session_id] = urls
-
-    def set_signed_validation_set_urls(self, session_id: str, urls: List[str]) -> None:
-        """Sets the signed URLs for validation set for a session."""
-        self._signed_validation_set_urls[session_id] = urls
+    def get_signed_url_cache(self, session_id: str) -> SignedUrlCache:
+        """Gets the cache of signed URLs for a session, creating it if needed."""
+        cache = self._signed_url_caches.get(session_id)
+        if cache is None:
+            cache = self._signed_url_caches.setdefault(session_id, SignedUrlCache())
+        return cache
 
-    def set_signed_test_set_urls(self, session_id: str, urls: List[str]) -> None:
-        """Sets the signed URLs for test set for a session."""
-        self._signed_test_set_urls[session_id] = urls
+    def _reset_signed_urls(self, session_id: str, directories: Optional[List[str]] = None) -> None:
+        cache = self._signed_url_caches.get(session_id)
+        if cache is not None:
+            cache.clear(prefixes=None if directories is None else [f"{directory}/" for directory in directories])
 
     def reset_signed_urls_for_resized_images_and_masks(self, session_id: str) -> None:
         """Resets (clears) the signed URLs for resized images and masks."""
-        self._signed_resized_image_mask_urls[session_id] = None
+        self._reset_signed_urls(session_id, [self.gcs_config.resized_image_dir, self.gcs_config.resized_mask_dir])
 
     def reset_signed_urls_for_train_val_test_data(self, session_id: str) -> None:
         """Resets signed URLs for train, validation, and test datasets."""
-        self._signed_training_set_urls[session_id] = None
-        self._signed_validation_set_urls[session_id] = None
-        self._signed_test_set_urls[session_id] = None
+        self._reset_signed_urls(session_id, [self.gcs_config.resized_augmented])
 
     def reset_all_signed_download_urls(self, session_id: str) -> None:
         """Resets all signed download URLs for the session."""
-        self._signed_resized_image_mask_urls[session_id] = None
-        self._signed_training_set_urls[session_id] = None
-        self._signed_validation_set_urls[session_id] = None
-        self._signed_test_set_urls[session_id] = None
+        self._reset_signed_urls(session_id)
 
     def clear_all_signed_download_urls(self, session_id: str) -> None:
         """Clears all signed download URLs from the cache for a session."""
-        self._signed_resized_image_mask_urls.pop(session_id, None)
-        self._signed_training_set_urls.pop(session_id, None)
-        self._signed_validation_set_urls.pop(session_id, None)
-        self._signed_test_set_urls.pop(session_id, None)
+        self._signed_url_caches.pop(session_id, None)
+
+    def add_streamed_objects(self, session_id: str, object_names: List[str]) -> None:
+        """Records objects streamed to the session's bucket, e.g. the `object_names` of a BucketSink."""
+        streamed_files = self._streamed_files.setdefault(session_id, {})
+        for object_name in object_names:
+            folder, _, filename = object_name.rpartition('/')
+            streamed_files.setdefault(folder, set()).add(filename)
+
+    def get_streamed_filenames(self, session_id: str, folder: str) -> Optional[List[str]]:
+        """
+        Returns the names of the files streamed to a folder of the session's bucket, naturally sorted, or None if the
+        session's outputs were not streamed to the bucket.
+        """
+        streamed_files = self._streamed_files.get(session_id)
+        if streamed_files is None:
+            return None
+        return sorted(streamed_files.get(folder.strip('/'), ()), key=natural_sort_key)
+
+    def clear_streamed_objects(self, session_id: str) -> None:
+        """Forgets the objects streamed to the session's bucket, e.g. once they are deleted or replaced locally."""
+        self._streamed_files.pop(session_id, None)
 
     def set_session_running(self, session_id):
         """Marks the session as currently running."""
@@ -258,6 +256,7 @@ class SessionStore:
         self.clear_signed_url_bucket(session_id)
         self.clear_directory_store(session_id)
         self.clear_all_signed_download_urls(session_id)
+        self.clear_streamed_objects(session_id)
         self.clear_augmentation_running(session_id)
         self.clear_session_running(session_id)
 
@@ -265,11 +264,11 @@ class SessionStore:
         """Clears all session-related caches and states across all sessions."""
         self._bucket_cache.clear()
         self._signed_url_bucket_cache.clear()
+        for directory_store in self._directory_store_cache.values():
+            directory_store.close()
         self._directory_store_cache.clear()
-        self._signed_resized_image_mask_urls.clear()
-        self._signed_training_set_urls.clear()
-        self._signed_validation_set_urls.clear()
-        self._signed_test_set_urls.clear()
+        self._signed_url_caches.clear()
+        self._streamed_files.clear()
         self._session_is_running.clear()
         self._augmentation_is_running.clear()
 
@@ -0,0 +1,222 @@
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List
+
+from google.api_core.exceptions import NotFound
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from app.services.gcs_transfer import CHUNK_SIZE
+
+# Suffix of the temporary object an object opened for writing is uploaded to, until it is complete.
+PARTIAL_OBJECT_SUFFIX = '.tmp'
+
+
+class ObjectWriter:
+    """
+    Writable file object that uploads an object of a bucket in resumable chunks.
+
+    The data is uploaded to a temporary object, which is renamed to the object's name once the writer is closed. If
+    the writer is aborted instead, e.g. because the `with` block it was used in raised, the temporary object is
+    deleted, so an incomplete upload never replaces the object or appears under its name.
+    """
+
+    def __init__(self, bucket, object_name: str):
+        """
+        :param bucket: (storage.Bucket, LocalBucket) the bucket the object is uploaded to.
+        :param object_name: (str) name of the object in the bucket.
+        """
+        self.bucket = bucket
+        self.object_name = object_name
+        self._blob = bucket.blob(object_name + PARTIAL_OBJECT_SUFFIX)
+        self._file = self._blob.open('wb', chunk_size=CHUNK_SIZE, ignore_flush=True,
+                                     content_type=mimetypes.guess_type(object_name)[0])
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __getattr__(self, name):
+        # write, tell, flush, etc. are those of the underlying writer.
+        return getattr(self._file, name)
+
+    def close(self):
+        """Completes the upload and renames the temporary object to the object's name."""
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            self.bucket.rename_blob(self._blob, self.object_name, retry=DEFAULT_RETRY)
+
+    def abort(self):
+        """Discards the upload: the temporary object is deleted and the object is left as it was."""
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            try:
+                self._blob.delete(retry=DEFAULT_RETRY)
+            except NotFound:
+                pass
+
+
+class BucketSink:
+    """
+    Uploads files to a bucket as they are produced, instead of saving them to the local filesystem first.
+
+    Files are addressed by the local path they would otherwise have been saved to; `path_prefixes` maps local
+    directories to the bucket folders their files are uploaded to. Uploads run in a thread pool. At most
+    `max_in_flight` files are held in memory waiting for, or during, their upload: once the window is full, `write`
+    blocks until an upload finishes, which slows the producer down to the speed of the uploads. The names of the
+    uploaded objects are recorded in `object_names`, so the outputs can be listed without listing the bucket.
+
+    With a `LocalBucket`, the files are written to a local directory instead, e.g. for tests.
+    """
+
+    def __init__(self, bucket, path_prefixes: Dict[str, str], max_workers: int = 8, max_in_flight: int = 64):
+        """
+        :param bucket: (storage.Bucket, LocalBucket) the bucket files are uploaded to.
+        :param path_prefixes: (dict) maps local directories to folders of the bucket.
+        :param max_workers: (int) maximum number of files uploaded at the same time.
+        :param max_in_flight: (int) maximum number of files queued or being uploaded.
+        """
+        self.bucket = bucket
+        # The most specific directory is matched first.
+        self.path_prefixes = sorted(((os.path.abspath(directory), prefix.strip('/'))
+                                     for directory, prefix in path_prefixes.items()),
+                                    key=lambda item: len(item[0]), reverse=True)
+        self.number_of_objects = 0
+        self.number_of_bytes = 0
+        self.object_names: List[str] = []
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._error = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def get_object_name(self, file_path: str) -> str:
+        """
+        Returns the name of the object a local path is uploaded to.
+
+        :raises ValueError: if the path is not within one of the sink's directories.
+        """
+        path = os.path.abspath(file_path)
+        for directory, prefix in self.path_prefixes:
+            if path.startswith(directory + os.sep):
+                relative_path = os.path.relpath(path, directory).replace(os.sep, '/')
+                return f'{prefix}/{relative_path}' if prefix else relative_path
+        raise ValueError(f'{file_path} is not within any directory of the sink.')
+
+    def _upload_done(self, future, object_name: str, number_of_bytes: int):
+        self._slots.release()
+        with self._lock:
+            self._pending.discard(future)
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        with self._lock:
+            if error is not None:
+                self._error = self._error or error
+            else:
+                self.number_of_objects += 1
+                self.number_of_bytes += number_of_bytes
+                self.object_names.append(object_name)
+
+    def _submit(self, upload, object_name: str, number_of_bytes: int):
+        if self._closed:
+            raise RuntimeError('The storage sink has already been closed.')
+        if self._error is not None:
+            raise self._error
+
+        # Wait for a free slot in the in-flight window.
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(upload)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda done_future: self._upload_done(done_future, object_name, number_of_bytes))
+
+    def write(self, file_path: str, data: bytes):
+        """
+        Uploads the content of a file.
+
+        :param file_path: (str) local path of the file, mapped to the object name with `path_prefixes`.
+        :param data: (bytes) content of the file.
+        """
+        object_name = self.get_object_name(file_path)
+        content_type = mimetypes.guess_type(object_name)[0]
+
+        def upload():
+            blob = self.bucket.blob(object_name)
+            blob.upload_from_string(data, content_type=content_type, checksum='crc32c', retry=DEFAULT_RETRY)
+
+        self._submit(upload, object_name, len(data))
+
+    def write_file(self, file_path: str, source_path: str):
+        """
+        Uploads a file that exists on disk under another path.
+
+        :param file_path: (str) local path the file would be saved to, mapped to the object name.
+        :param source_path: (str) path of the file to upload.
+        """
+        object_name = self.get_object_name(file_path)
+
+        def upload():
+            blob = self.bucket.blob(object_name)
+            blob.upload_from_filename(source_path, checksum='crc32c', retry=DEFAULT_RETRY)
+
+        self._submit(upload, object_name, os.path.getsize(source_path))
+
+    def open_object(self, object_name: str) -> ObjectWriter:
+        """
+        Opens an object for writing, as a file-like object that is uploaded in resumable chunks while it is written.
+        The object is created once the returned writer is closed; if it is aborted, the object is left untouched.
+
+        :param object_name: (str) name of the object in the bucket.
+        """
+        return ObjectWriter(self.bucket, object_name)
+
+    def flush(self):
+        """
+        Waits for the uploads queued so far to finish, leaving the sink open. Raises the first upload error, if any, so
+        that whatever depends on the uploads (e.g. an archive of the same files) can be discarded.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """Waits for the queued uploads to finish. Raises the first upload error, if any."""
+        if not self._closed:
+            self._closed = True
+            self._executor.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        """Cancels the uploads that have not started yet."""
+        if not self._closed:
+            self._closed = True
+            self._executor.shutdown(wait=True, cancel_futures=True)
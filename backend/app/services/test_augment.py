@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.augment import DataSplitterAugmenterAndSaver
+
+NUMBER_OF_IMAGES = 10
+
+
+@pytest.fixture(scope='module')
+def data_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('data')
+    rng = np.random.default_rng(0)
+    os.makedirs(directory / 'images')
+    os.makedirs(directory / 'masks')
+    for index in range(NUMBER_OF_IMAGES):
+        image = rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)
+        Image.fromarray(image).save(directory / 'images' / f'img_{index}.png')
+        mask = np.zeros((32, 32, 3), dtype=np.uint8)
+        mask[8:20, 8:20] = [255, 0, 0]
+        Image.fromarray(mask).save(directory / 'masks' / f'mask_{index}.png')
+    return directory
+
+
+def create_augmenter(data_directory, output_directory, number_of_images: int, initial_save_id: int = 0, **kwargs):
+    return DataSplitterAugmenterAndSaver(images_directory=str(data_directory / 'images'),
+                                         masks_directory=str(data_directory / 'masks'),
+                                         train_directory=str(output_directory / 'train'),
+                                         val_directory=str(output_directory / 'val'),
+                                         test_directory=str(output_directory / 'test'),
+                                         image_mask_channels=(3, 3),
+                                         initial_save_id_train=initial_save_id,
+                                         initial_save_id_val=0,
+                                         initial_save_id_test=0,
+                                         visual_attributes_json_path=None,
+                                         image_save_format='png',
+                                         seed=7,
+                                         val_size=0.2,
+                                         test_size=0.2,
+                                         number_of_training_images_after_augmentation=number_of_images,
+                                         **kwargs)
+
+
+def get_saved_indices(directory: str, prefix: str) -> list:
+    return sorted(int(name[len(prefix) + 1:-len('.png')]) for name in os.listdir(directory))
+
+
+def get_digests(directory: str) -> dict:
+    digests = {}
+    for root, _, files in os.walk(directory):
+        for file in files:
+            with open(os.path.join(root, file), 'rb') as image_file:
+                digests[os.path.relpath(os.path.join(root, file), directory)] = hashlib.md5(image_file.read()).digest()
+    return digests
+
+
+@pytest.mark.parametrize('number_of_images, variants, extra_variants', [(6, 1, 0), (13, 2, 1), (18, 3, 0), (3, 1, 0)])
+def test_number_of_variants(data_directory, tmp_path, number_of_images, variants, extra_variants):
+    augmenter = create_augmenter(data_directory, tmp_path, number_of_images)
+
+    assert augmenter.no_of_train_examples == 6
+    assert (augmenter.variants_per_train_image, augmenter.extra_train_variants) == (variants, extra_variants)
+
+
+def test_exact_number_of_training_images_is_saved_with_contiguous_indices(data_directory, tmp_path):
+    augmenter = create_augmenter(data_directory, tmp_path, number_of_images=13, initial_save_id=100,
+                                 max_variants_per_step=2)
+    augmenter.process_data()
+
+    expected_indices = list(range(100, 113))
+    assert get_saved_indices(str(tmp_path / 'train' / 'images'), 'img') == expected_indices
+    assert get_saved_indices(str(tmp_path / 'train' / 'masks'), 'mask') == expected_indices
+    assert get_saved_indices(str(tmp_path / 'val' / 'images'), 'img') == [0, 1]
+
+
+def test_images_do_not_depend_on_the_variants_per_step(data_directory, tmp_path):
+    for max_variants_per_step in (2, 8):
+        create_augmenter(data_directory, tmp_path / str(max_variants_per_step), number_of_images=13,
+                         max_variants_per_step=max_variants_per_step, corrupt_brightness=True).process_data()
+
+    digests = get_digests(str(tmp_path / '2'))
+    image_digests = [digest for name, digest in digests.items() if os.path.basename(name).startswith('img')]
+    assert len(set(image_digests)) == len(image_digests)
+    assert digests == get_digests(str(tmp_path / '8'))
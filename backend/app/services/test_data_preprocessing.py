@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from PIL import Image
+
+from app.services.data_preprocessing import (decode_jpeg_region, extract_tiles, get_decoded_jpeg_shape,
+                                             get_jpeg_decode_ratio, get_tile_grid, produce_multiple_crop_dimensions)
+
+
+def encode_jpeg(height: int, width: int) -> bytes:
+    # Chroma is not subsampled, so the pixels on the edges of a crop window do not depend on their neighbours.
+    pixels = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', subsampling=0)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('source_shape, target_shape, crop_window, ratio', [
+    ((800, 600), (100, 75), None, 8),
+    ((800, 600), (300, 300), None, 2),
+    ((800, 600), (800, 600), None, 1),
+    ((800, 600), (1000, 1000), None, 1),
+    ((800, 600), (50, 50), (0, 0, 400, 400), 8),
+    # The offset is not a multiple of 8 or 4, so the crop would not line up with the full resolution mask.
+    ((800, 600), (50, 50), (2, 0, 400, 400), 2),
+    ((800, 600), (50, 50), (1, 0, 400, 400), 1),
+])
+def test_jpeg_decode_ratio(source_shape, target_shape, crop_window, ratio):
+    assert get_jpeg_decode_ratio(source_shape, target_shape, crop_window=crop_window) == ratio
+
+
+@pytest.mark.parametrize('ratio, crop_window', [(1, None), (2, None), (8, None), (1, (8, 16, 40, 24)),
+                                                (4, (8, 16, 40, 24))])
+def test_decoded_jpeg_shape(ratio, crop_window):
+    contents = encode_jpeg(height=75, width=101)
+
+    image = decode_jpeg_region(contents, channels=3, ratio=ratio, crop_window=crop_window)
+
+    assert tuple(image.shape) == get_decoded_jpeg_shape((75, 101), channels=3, ratio=ratio, crop_window=crop_window)
+
+
+def test_crop_window_decodes_the_cropped_region():
+    contents = encode_jpeg(height=64, width=64)
+
+    image = decode_jpeg_region(contents, channels=3, crop_window=(8, 16, 40, 24))
+
+    full_image = tf.io.decode_jpeg(contents, channels=3)
+    np.testing.assert_array_equal(image.numpy(), full_image[8:48, 16:40].numpy())
+
+
+@pytest.mark.parametrize('parent_shape, tile_shape, grid, expected_grid, expected_strides', [
+    ((100, 100), (50, 50), (2, 2), (2, 2), (50, 50)),
+    ((100, 120), (40, 50), (3, 2), (3, 2), (30, 70)),
+    # A single tile along an axis sits at the top/left edge, instead of dividing by zero.
+    ((100, 100), (50, 50), (1, 3), (1, 3), (51, 25)),
+    # Without a grid, the smallest one covering the parent image, with tiles overlapping by at least 10, is used.
+    ((100, 100), (40, 40), None, (3, 3), (30, 30)),
+])
+def test_tile_grid(parent_shape, tile_shape, grid, expected_grid, expected_strides):
+    assert get_tile_grid(parent_shape, tile_shape, resulting_image_grid=grid, overlap=10) == (expected_grid,
+                                                                                              expected_strides)
+
+
+@pytest.mark.parametrize('parent_shape, tile_shape, grid', [
+    ((100, 100), (120, 50), (1, 2)),
+    ((100, 100), (50, 50), (0, 2)),
+    ((100, 100), (50, 50), (60, 2)),
+])
+def test_invalid_tile_grid_raises_value_error(parent_shape, tile_shape, grid):
+    with pytest.raises(ValueError):
+        get_tile_grid(parent_shape, tile_shape, resulting_image_grid=grid)
+
+
+@pytest.mark.parametrize('grid', [(2, 3), (1, 3), None])
+def test_tiles_match_the_crop_dimensions(grid):
+    image = tf.reshape(tf.range(100 * 120 * 2, dtype=tf.int32), (100, 120, 2))
+    tile_shape = (40, 50)
+    tile_grid, strides = get_tile_grid((100, 120), tile_shape, resulting_image_grid=grid, overlap=5)
+
+    tiles = extract_tiles(image, tile_shape, tile_grid, strides)
+
+    crops = [image[top:top + height, left:left + width]
+             for top, left, height, width in produce_multiple_crop_dimensions((100, 120), tile_shape,
+                                                                              resulting_image_grid=grid, overlap=5)]
+    assert tiles.shape == (tile_grid[0] * tile_grid[1], 40, 50, 2)
+    np.testing.assert_array_equal(tiles.numpy(), np.stack([crop.numpy() for crop in crops]))
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+from google.auth import impersonated_credentials
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import credentials as oauth2_credentials
+
+from app.services.gcs_clients import StorageClientRegistry
+
+TARGET_PRINCIPAL = 'target@project.iam.gserviceaccount.com'
+
+
+@pytest.fixture
+def token_requests(monkeypatch):
+    """Records the IAM token requests of impersonated credentials, and answers them with a token valid for an hour."""
+    calls = []
+
+    def make_iam_token_request(request, headers, **kwargs):
+        calls.append({'request': request, 'headers': dict(headers)})
+        expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+        return f'impersonated-token-{len(calls)}', expiry
+
+    monkeypatch.setattr(impersonated_credentials, '_make_iam_token_request', make_iam_token_request)
+    return calls
+
+
+@pytest.fixture
+def registry():
+    registry = StorageClientRegistry(pool_size=2)
+    yield registry
+    registry.clear()
+
+
+def get_impersonated_client(registry: StorageClientRegistry):
+    source_credentials = oauth2_credentials.Credentials(token='source-token')
+    return registry.get_client(credentials=source_credentials, project='project', target_principal=TARGET_PRINCIPAL,
+                               target_scopes=['https://www.googleapis.com/auth/cloud-platform'])
+
+
+def test_impersonated_token_is_requested_with_the_source_credentials(registry, token_requests):
+    get_impersonated_client(registry)
+
+    assert len(token_requests) == 1
+    assert token_requests[0]['headers']['authorization'] == 'Bearer source-token'
+    assert not isinstance(token_requests[0]['request'].session, AuthorizedSession)
+
+
+def test_expiring_impersonated_token_is_refreshed(registry, token_requests):
+    client = get_impersonated_client(registry)
+    client._credentials.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    assert get_impersonated_client(registry) is client
+    assert len(token_requests) == 2
+    assert token_requests[1]['headers']['authorization'] == 'Bearer source-token'
+    assert client._credentials.token == 'impersonated-token-2'
+
+
+def test_valid_token_is_not_refreshed(registry, token_requests):
+    get_impersonated_client(registry)
+    get_impersonated_client(registry)
+
+    assert len(token_requests) == 1
+
+
+def test_clients_are_keyed_by_credential_kind(registry, token_requests):
+    impersonated_client = get_impersonated_client(registry)
+    key_file_credentials = oauth2_credentials.Credentials(token='key-file-token')
+    key_file_credentials.service_account_email = TARGET_PRINCIPAL
+
+    assert registry.get_client(credentials=key_file_credentials, project='project') is not impersonated_client
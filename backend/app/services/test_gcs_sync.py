@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from app.services import gcs_sync
+from app.services.gcs_sync import DirectorySync, SyncCache
+from app.services.gcs_transfer import LocalBucket
+
+
+def write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket(str(tmp_path / 'bucket'), name='test-bucket')
+
+
+@pytest.fixture
+def source_directory(tmp_path):
+    directory = str(tmp_path / 'source')
+    write_file(os.path.join(directory, 'a.png'), b'first image')
+    write_file(os.path.join(directory, 'b.png'), b'second image')
+    return directory
+
+
+@pytest.fixture
+def directory_sync(bucket):
+    return DirectorySync(bucket, cache=SyncCache(), max_workers=2)
+
+
+@pytest.fixture
+def checksum_calls(monkeypatch):
+    """Counts the files the sync checksums to compare them with their object."""
+    calls = []
+    file_crc32c = gcs_sync.file_crc32c
+
+    def counting_file_crc32c(file_path, *args, **kwargs):
+        calls.append(file_path)
+        return file_crc32c(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(gcs_sync, 'file_crc32c', counting_file_crc32c)
+    return calls
+
+
+def test_first_sync_uploads_every_file(directory_sync, source_directory, bucket):
+    result = directory_sync.sync(source_directory, 'images')
+
+    assert result.success
+    assert result.uploaded.files == 2
+    assert result.unchanged == 0
+    assert [blob.name for blob in bucket.list_blobs(prefix='images/')] == ['images/a.png', 'images/b.png']
+
+
+def test_unchanged_sync_reads_no_file(directory_sync, source_directory, checksum_calls):
+    directory_sync.sync(source_directory, 'images')
+
+    result = directory_sync.sync(source_directory, 'images')
+
+    assert result.uploaded.files == 0
+    assert result.deleted.files == 0
+    assert result.unchanged == 2
+    assert checksum_calls == []
+
+
+def test_changed_file_of_the_same_size_is_uploaded(directory_sync, source_directory, bucket):
+    directory_sync.sync(source_directory, 'images')
+    write_file(os.path.join(source_directory, 'a.png'), b'FIRST IMAGE')
+
+    result = directory_sync.sync(source_directory, 'images')
+
+    assert result.uploaded.files == 1
+    assert result.unchanged == 1
+    with open(bucket.blob('images/a.png').path, 'rb') as file:
+        assert file.read() == b'FIRST IMAGE'
+
+
+def test_deleted_file_is_removed_from_the_bucket(directory_sync, source_directory, bucket):
+    directory_sync.sync(source_directory, 'images')
+    os.remove(os.path.join(source_directory, 'b.png'))
+
+    result = directory_sync.sync(source_directory, 'images')
+
+    assert result.deleted.files == 1
+    assert [blob.name for blob in bucket.list_blobs(prefix='images/')] == ['images/a.png']
+
+
+def test_empty_directory_deletes_nothing(directory_sync, source_directory, bucket, tmp_path):
+    directory_sync.sync(source_directory, 'images')
+    empty_directory = str(tmp_path / 'empty')
+    os.makedirs(empty_directory)
+
+    result = directory_sync.sync(empty_directory, 'images')
+
+    assert result.deleted.files == 0
+    assert len(bucket.list_blobs(prefix='images/')) == 2
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from app.services import gcs_transfer
+from app.services.gcs_transfer import LocalBlob, LocalBucket, TransferManager
+
+
+def write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket(str(tmp_path / 'bucket'), name='test-bucket')
+
+
+@pytest.fixture
+def source_directory(tmp_path):
+    directory = tmp_path / 'source'
+    write_file(str(directory / 'a.png'), b'first image')
+    write_file(str(directory / 'b.png'), b'second image')
+    write_file(str(directory / 'nested' / 'c.png'), b'nested image')
+    return str(directory)
+
+
+def test_upload_directory_copies_files(bucket, source_directory):
+    result = TransferManager(bucket, max_workers=2).upload_directory(source_directory, 'images')
+
+    assert result.success
+    assert result.files == 2
+    assert [blob.name for blob in bucket.list_blobs(prefix='images/')] == ['images/a.png', 'images/b.png']
+    assert read_file(bucket.blob('images/a.png').path) == b'first image'
+    assert os.path.isfile(os.path.join(source_directory, 'a.png'))
+
+
+def test_upload_directory_moves_files(bucket, source_directory):
+    result = TransferManager(bucket).upload_directory(source_directory, 'images', move=True)
+
+    assert result.success
+    assert sorted(os.listdir(source_directory)) == ['nested']
+
+
+def test_upload_directory_recursive(bucket, source_directory):
+    result = TransferManager(bucket).upload_directory(source_directory, 'images', recursive=True)
+
+    assert result.files == 3
+    assert read_file(bucket.blob('images/nested/c.png').path) == b'nested image'
+
+
+def test_download_prefix_skips_sub_folders(bucket, source_directory, tmp_path):
+    manager = TransferManager(bucket)
+    manager.upload_directory(source_directory, 'images', recursive=True)
+
+    destination = str(tmp_path / 'destination')
+    result = manager.download_prefix('images', destination)
+
+    assert result.success
+    assert sorted(os.listdir(destination)) == ['a.png', 'b.png']
+    assert read_file(os.path.join(destination, 'b.png')) == b'second image'
+    assert bucket.get_blob('images/a.png') is not None
+
+
+def test_download_prefix_moves_objects(bucket, source_directory, tmp_path):
+    manager = TransferManager(bucket)
+    manager.upload_directory(source_directory, 'images', recursive=True)
+
+    result = manager.download_prefix('images', str(tmp_path / 'destination'), move=True)
+
+    assert result.files == 2
+    assert [blob.name for blob in bucket.list_blobs(prefix='images/')] == ['images/nested/c.png']
+
+
+def corrupt_uploads(monkeypatch, times: int) -> list:
+    """Makes the next `times` uploads of a LocalBlob report a wrong CRC32C, and returns the list of upload calls."""
+    calls = []
+    upload_from_filename = LocalBlob.upload_from_filename
+
+    def upload(blob, filename, **kwargs):
+        calls.append(blob.name)
+        upload_from_filename(blob, filename, **kwargs)
+        if len(calls) <= times:
+            blob.crc32c = 'AAAAAA=='
+
+    monkeypatch.setattr(LocalBlob, 'upload_from_filename', upload)
+    return calls
+
+
+def test_upload_retries_on_checksum_mismatch(bucket, source_directory, monkeypatch):
+    calls = corrupt_uploads(monkeypatch, times=1)
+
+    result = TransferManager(bucket).upload_files([(os.path.join(source_directory, 'a.png'), 'images/a.png')])
+
+    assert result.success
+    assert calls == ['images/a.png', 'images/a.png']
+
+
+def test_upload_fails_after_max_attempts_and_keeps_the_file(bucket, source_directory, monkeypatch):
+    calls = corrupt_uploads(monkeypatch, times=gcs_transfer.MAX_ATTEMPTS)
+    file_path = os.path.join(source_directory, 'a.png')
+
+    result = TransferManager(bucket).upload_files([(file_path, 'images/a.png')], move=True)
+
+    assert not result.success
+    assert result.failed[0][0] == file_path
+    assert len(calls) == gcs_transfer.MAX_ATTEMPTS
+    assert os.path.isfile(file_path)
+
+
+def test_delete_prefix(bucket, source_directory):
+    manager = TransferManager(bucket)
+    manager.upload_directory(source_directory, 'images', recursive=True)
+    manager.upload_directory(source_directory, 'masks')
+
+    result = manager.delete_prefix('images/')
+
+    assert result.files == 3
+    assert bucket.list_blobs(prefix='images/') == []
+    assert len(bucket.list_blobs(prefix='masks/')) == 2
@@ -0,0 +1,104 @@
+import contextlib
+import os
+import zipfile
+
+import pytest
+
+from app.services.gcs_transfer import LocalBlob, LocalBucket
+from app.services.storage_sink import BucketSink
+from app.services.zip_writer import StreamingZipWriter
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket(str(tmp_path / 'bucket'), name='test-bucket')
+
+
+@pytest.fixture
+def output_directory(tmp_path):
+    return str(tmp_path / 'augmented')
+
+
+def object_names(bucket: LocalBucket) -> list:
+    return [blob.name for blob in bucket.list_blobs()]
+
+
+def test_write_uploads_under_the_mapped_prefix(bucket, output_directory):
+    with BucketSink(bucket, path_prefixes={output_directory: 'augmented'}) as sink:
+        sink.write(os.path.join(output_directory, 'train', 'images', 'img_0.png'), b'image')
+
+    assert sink.number_of_objects == 1
+    assert sink.object_names == ['augmented/train/images/img_0.png']
+    assert object_names(bucket) == ['augmented/train/images/img_0.png']
+
+
+def test_flush_raises_the_first_upload_error(bucket, output_directory, monkeypatch):
+    def failing_upload(blob, data, **kwargs):
+        raise OSError(f'{blob.name} could not be uploaded.')
+
+    monkeypatch.setattr(LocalBlob, 'upload_from_string', failing_upload)
+    sink = BucketSink(bucket, path_prefixes={output_directory: 'augmented'})
+    sink.write(os.path.join(output_directory, 'img_0.png'), b'image')
+
+    with pytest.raises(OSError):
+        sink.flush()
+    sink.abort()
+
+
+def test_object_is_created_when_the_writer_is_closed(bucket):
+    with BucketSink(bucket, path_prefixes={}) as sink:
+        with sink.open_object('augmented/augmented_data.zip') as file:
+            file.write(b'archive')
+            assert object_names(bucket) == []
+
+    assert object_names(bucket) == ['augmented/augmented_data.zip']
+
+
+def test_aborted_writer_leaves_the_object_untouched(bucket):
+    sink = BucketSink(bucket, path_prefixes={})
+    with sink.open_object('augmented/augmented_data.zip') as file:
+        file.write(b'previous archive')
+
+    with pytest.raises(ValueError):
+        with sink.open_object('augmented/augmented_data.zip') as file:
+            file.write(b'incomplete archive')
+            raise ValueError('The augmentation failed.')
+    sink.close()
+
+    assert object_names(bucket) == ['augmented/augmented_data.zip']
+    with open(bucket.blob('augmented/augmented_data.zip').path, 'rb') as file:
+        assert file.read() == b'previous archive'
+
+
+def test_failed_upload_does_not_publish_the_archive(bucket, output_directory, monkeypatch):
+    def failing_upload(blob, data, **kwargs):
+        raise OSError(f'{blob.name} could not be uploaded.')
+
+    monkeypatch.setattr(LocalBlob, 'upload_from_string', failing_upload)
+    image_path = os.path.join(output_directory, 'train', 'images', 'img_0.png')
+
+    with pytest.raises(OSError):
+        with contextlib.ExitStack() as stack:
+            sink = stack.enter_context(BucketSink(bucket, path_prefixes={output_directory: 'augmented'}))
+            file = stack.enter_context(sink.open_object('augmented/augmented_data.zip'))
+            zip_writer = stack.enter_context(StreamingZipWriter(zip_path=file, root_directory=output_directory))
+            zip_writer.add_bytes(image_path, b'image')
+            sink.write(image_path, b'image')
+            sink.flush()
+
+    assert object_names(bucket) == []
+
+
+def test_streamed_archive_is_readable(bucket, output_directory):
+    image_path = os.path.join(output_directory, 'train', 'images', 'img_0.png')
+
+    with contextlib.ExitStack() as stack:
+        sink = stack.enter_context(BucketSink(bucket, path_prefixes={output_directory: 'augmented'}))
+        file = stack.enter_context(sink.open_object('augmented/augmented_data.zip'))
+        zip_writer = stack.enter_context(StreamingZipWriter(zip_path=file, root_directory=output_directory))
+        zip_writer.add_bytes(image_path, b'image')
+        sink.write(image_path, b'image')
+        sink.flush()
+
+    with zipfile.ZipFile(bucket.blob('augmented/augmented_data.zip').path) as archive:
+        assert archive.read('train/images/img_0.png') == b'image'
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services.url_signer import REFRESH_MARGIN, SIGNING_CHUNK_SIZE, BatchUrlSigner, SignedUrlCache
+
+
+class SigningBucket:
+    """Bucket whose blobs sign URLs locally, recording every URL signed."""
+
+    def __init__(self):
+        self.signed = []
+
+    def blob(self, blob_name: str):
+        return SigningBlob(self, blob_name)
+
+
+class SigningBlob:
+    def __init__(self, bucket: SigningBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def generate_signed_url(self, method: str, content_type=None, **kwargs) -> str:
+        self.bucket.signed.append((self.name, method, content_type))
+        return f'https://storage.test/{self.name}?method={method}&signature={len(self.bucket.signed)}'
+
+
+@pytest.fixture
+def bucket():
+    return SigningBucket()
+
+
+def in_future(delta: timedelta) -> datetime:
+    return datetime.now(timezone.utc) + delta
+
+
+def test_url_is_returned_until_it_is_about_to_expire():
+    cache = SignedUrlCache()
+    key = cache.get_key('images/a.png', 'GET')
+    cache.set(key, 'valid-url', in_future(REFRESH_MARGIN + timedelta(minutes=5)))
+    assert cache.get(key) == 'valid-url'
+
+    cache.set(key, 'expiring-url', in_future(REFRESH_MARGIN - timedelta(minutes=5)))
+    assert cache.get(key) is None
+
+
+def test_methods_do_not_share_urls():
+    cache = SignedUrlCache()
+    cache.set(cache.get_key('images/a.png', 'PUT', 'image/png'), 'upload-url', in_future(timedelta(hours=12)))
+
+    assert cache.get(cache.get_key('images/a.png', 'GET')) is None
+    assert cache.get(cache.get_key('images/a.png', 'put', 'image/png')) == 'upload-url'
+
+
+def test_cache_is_bounded():
+    cache = SignedUrlCache(max_size=2)
+    for name in ['a.png', 'b.png', 'c.png']:
+        cache.set(cache.get_key(name, 'GET'), name, in_future(timedelta(hours=12)))
+
+    assert len(cache) == 2
+    assert cache.get(cache.get_key('a.png', 'GET')) is None
+    assert cache.get(cache.get_key('c.png', 'GET')) == 'c.png'
+
+
+def test_clear_forgets_urls_under_the_prefixes():
+    cache = SignedUrlCache()
+    for name in ['images/a.png', 'masks/a.png']:
+        cache.set(cache.get_key(name, 'GET'), name, in_future(timedelta(hours=12)))
+
+    cache.clear(prefixes=['images/'])
+
+    assert cache.get(cache.get_key('images/a.png', 'GET')) is None
+    assert cache.get(cache.get_key('masks/a.png', 'GET')) == 'masks/a.png'
+
+
+def test_signer_reuses_cached_urls(bucket):
+    signer = BatchUrlSigner(bucket, cache=SignedUrlCache())
+
+    first_urls = signer.sign(['images/a.png', 'images/b.png'])
+    second_urls = signer.sign(['images/b.png', 'images/c.png'])
+
+    assert second_urls[0] == first_urls[1]
+    assert [name for name, _, _ in bucket.signed] == ['images/a.png', 'images/b.png', 'images/c.png']
+
+
+def test_signer_signs_upload_and_download_urls_separately(bucket):
+    signer = BatchUrlSigner(bucket, cache=SignedUrlCache())
+
+    upload_url, = signer.sign(['images/a.png'], method='PUT', content_type='image/png')
+    download_url, = signer.sign(['images/a.png'])
+
+    assert 'method=PUT' in upload_url
+    assert 'method=GET' in download_url
+
+
+def test_signer_keeps_the_order_of_many_chunks(bucket):
+    blob_names = [f'images/{index}.png' for index in range(SIGNING_CHUNK_SIZE * 2 + 1)]
+
+    urls = BatchUrlSigner(bucket, cache=SignedUrlCache(), max_workers=3).sign(blob_names)
+
+    assert [url.split('?')[0] for url in urls] == [f'https://storage.test/{name}' for name in blob_names]
@@ -0,0 +1,92 @@
+import os
+import zipfile
+
+import pytest
+
+from app.services.zip_writer import StreamingZipWriter
+
+
+def write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+@pytest.fixture
+def augmented_directory(tmp_path):
+    return str(tmp_path / 'augmented')
+
+
+@pytest.fixture
+def zip_path(augmented_directory):
+    os.makedirs(augmented_directory, exist_ok=True)
+    return os.path.join(augmented_directory, 'augmented_data.zip')
+
+
+def test_files_and_bytes_are_archived(augmented_directory, zip_path):
+    image_path = os.path.join(augmented_directory, 'train', 'images', 'img_0.png')
+    config_path = os.path.join(augmented_directory, 'config.json')
+    write_file(config_path, b'{}')
+
+    with StreamingZipWriter(zip_path=zip_path, root_directory=augmented_directory) as zip_writer:
+        zip_writer.add_bytes(image_path, b'image')
+        zip_writer.add_file(config_path)
+
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.read('train/images/img_0.png') == b'image'
+        assert archive.getinfo('train/images/img_0.png').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('config.json').compress_type == zipfile.ZIP_DEFLATED
+    assert zip_writer.number_of_entries == 2
+
+
+def test_add_directory_archives_earlier_files_once(augmented_directory, zip_path):
+    earlier_path = os.path.join(augmented_directory, 'train', 'images', 'img_0.png')
+    current_path = os.path.join(augmented_directory, 'train', 'images', 'img_1.png')
+    write_file(earlier_path, b'earlier image')
+    write_file(current_path, b'current image')
+
+    with StreamingZipWriter(zip_path=zip_path, root_directory=augmented_directory) as zip_writer:
+        zip_writer.add_bytes(current_path, b'current image')
+        zip_writer.add_directory()
+
+    with zipfile.ZipFile(zip_path) as archive:
+        assert sorted(archive.namelist()) == ['train/images/img_0.png', 'train/images/img_1.png']
+        assert archive.read('train/images/img_0.png') == b'earlier image'
+
+
+def test_aborted_archive_is_removed(augmented_directory, zip_path):
+    with pytest.raises(ValueError):
+        with StreamingZipWriter(zip_path=zip_path, root_directory=augmented_directory) as zip_writer:
+            zip_writer.add_bytes(os.path.join(augmented_directory, 'img_0.png'), b'image')
+            raise ValueError('The augmentation failed.')
+
+    assert not os.path.exists(zip_path)
+
+
+def test_aborted_archive_in_a_file_object_has_no_central_directory(augmented_directory, tmp_path):
+    object_path = str(tmp_path / 'object.zip')
+
+    with open(object_path, 'wb') as file:
+        zip_writer = StreamingZipWriter(zip_path=file, root_directory=augmented_directory)
+        zip_writer.add_bytes(os.path.join(augmented_directory, 'img_0.png'), b'image')
+        zip_writer.abort()
+        del zip_writer
+        assert not file.closed
+
+    assert not zipfile.is_zipfile(object_path)
+
+
+def test_write_error_is_raised_on_close(augmented_directory, zip_path):
+    zip_writer = StreamingZipWriter(zip_path=zip_path, root_directory=augmented_directory)
+    zip_writer.add_file(os.path.join(augmented_directory, 'missing.png'))
+
+    with pytest.raises(FileNotFoundError):
+        zip_writer.close()
+
+
+def test_closed_writer_rejects_files(augmented_directory, zip_path):
+    zip_writer = StreamingZipWriter(zip_path=zip_path, root_directory=augmented_directory)
+    zip_writer.close()
+
+    with pytest.raises(RuntimeError):
+        zip_writer.add_bytes(os.path.join(augmented_directory, 'img_0.png'), b'image')
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+from PIL import Image
+
+from app.utils import probe_image
+
+# Pillow mode used for each number of channels.
+CHANNEL_MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+# Modes that Image.reduce supports.
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F')
+
+# Pillow can only save these modes as JPEG.
+JPEG_MODES = ('L', 'RGB', 'CMYK')
+
+
+def output_is_up_to_date(source_path: str, output_path: str, height: int, width: int,
+                         channels: Union[int, None] = None):
+    """
+    Checks whether a processed file can be reused: it exists, was written after its source was last modified, and has
+    the expected dimensions and number of channels (read from its header).
+
+    :param source_path: (str) path to the original image or mask.
+    :param output_path: (str) path to the processed image or mask.
+    :param height: (int) expected height of the processed file.
+    :param width: (int) expected width of the processed file.
+    :param channels: (int) expected number of channels of the processed file. Not checked, if None.
+    """
+    try:
+        source_stat = os.stat(source_path)
+        output_stat = os.stat(output_path)
+    except FileNotFoundError:
+        return False
+
+    if output_stat.st_mtime_ns < source_stat.st_mtime_ns:
+        return False
+
+    try:
+        output_info = probe_image(output_path)
+    except ValueError:
+        return False
+    if channels is not None and output_info.channels != channels:
+        return False
+    return (output_info.height, output_info.width) == (height, width)
+
+
+def get_thumbnail_channels(thumbnail_path: str, channels: Union[int, None]) -> Union[int, None]:
+    """Returns the number of channels a thumbnail is saved with, given the number requested (see `create_thumbnail`)."""
+    if channels == 4 and thumbnail_path.lower().endswith(('.jpg', '.jpeg')):
+        return 3
+    return channels if channels in CHANNEL_MODES else None
+
+
+def remove_orphaned_files(directory: str, names: List[str]) -> List[str]:
+    """
+    Deletes the files of a directory of processed files whose source no longer exists.
+
+    :param directory: (str) directory of processed files.
+    :param names: (list) names of the files that still have a source.
+    :return: (list) names of the files that were deleted.
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    names = set(names)
+    removed_names = []
+    for name in os.listdir(directory):
+        file_path = os.path.join(directory, name)
+        if name not in names and os.path.isfile(file_path):
+            os.remove(file_path)
+            removed_names.append(name)
+    return removed_names
+
+
+def load_thumbnail(image_path: str, size: Tuple[int, int], is_mask: bool = False, channels: Union[int, None] = None):
+    """
+    Loads an image downscaled to `size`, without decoding it at full resolution when it can be avoided.
+
+    Images are downscaled in up to three steps: JPEG files are decoded at a reduced scale by the DCT (draft mode),
+    the result is shrunk by the largest integer factor that keeps it at least as large as `size` (Image.reduce),
+    and the last step is a bilinear resample to the exact size. Masks are resampled directly with nearest neighbour,
+    since averaging pixels would create colours that are not classes.
+
+    :param image_path: (str) path to the image or mask.
+    :param size: (tuple) (height, width) of the thumbnail.
+    :param is_mask: (bool) True if the file is a mask.
+    :param channels: (int) number of channels of the thumbnail (1, 3 or 4). The image's own mode is kept, if None.
+    :return: (PIL.Image.Image) the thumbnail.
+    """
+    height, width = size
+    with Image.open(image_path) as image:
+        if not is_mask and image.format == 'JPEG':
+            image.draft(image.mode, (width, height))
+
+        mode = CHANNEL_MODES.get(channels)
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+
+        if is_mask:
+            return image.resize((width, height), Image.Resampling.NEAREST)
+
+        factor = min(image.width // width, image.height // height)
+        if factor >= 2 and image.mode in REDUCIBLE_MODES:
+            image = image.reduce(factor)
+        return image.resize((width, height), Image.Resampling.BILINEAR)
+
+
+def create_thumbnail(image_path: str, thumbnail_path: str, size: Tuple[int, int], is_mask: bool = False,
+                     channels: Union[int, None] = None):
+    """
+    Saves a downscaled copy of an image (see `load_thumbnail`). The format is taken from the thumbnail's extension.
+
+    :return: (str) thumbnail_path
+    """
+    thumbnail = load_thumbnail(image_path, size=size, is_mask=is_mask, channels=channels)
+    if thumbnail_path.lower().endswith(('.jpg', '.jpeg')) and thumbnail.mode not in JPEG_MODES:
+        thumbnail = thumbnail.convert('RGB')
+    thumbnail.save(thumbnail_path)
+    return thumbnail_path
+
+
+def create_thumbnails(image_paths: List[str], thumbnail_directory: str, size: Tuple[int, int], is_mask: bool = False,
+                      channels: Union[int, None] = None, skip_up_to_date: bool = False,
+                      remove_orphans: bool = False, max_workers: Union[int, None] = None):
+    """
+    Saves a downscaled copy of each image in `thumbnail_directory`, under the image's name. The images are processed
+    in a thread pool; Pillow releases the GIL while decoding, resampling and encoding.
+
+    :param image_paths: (list) paths to the images or masks.
+    :param thumbnail_directory: (str) directory where the thumbnails are saved. It is created if it does not exist.
+    :param size: (tuple) (height, width) of the thumbnails.
+    :param is_mask: (bool) True if the files are masks.
+    :param channels: (int) number of channels of the thumbnails. Each image's own mode is kept, if None.
+    :param skip_up_to_date: (bool) If True, images whose thumbnail is newer than the image and already has the
+        requested size and number of channels are skipped.
+    :param remove_orphans: (bool) If True, `image_paths` holds every image of its directory, and thumbnails of images
+        that no longer exist are deleted from `thumbnail_directory`.
+    :param max_workers: (int) maximum number of threads. Defaults to the executor's default.
+    :return: (list) paths to the thumbnails that were written.
+    """
+    os.makedirs(thumbnail_directory, exist_ok=True)
+    height, width = size
+
+    if remove_orphans:
+        remove_orphaned_files(thumbnail_directory, [os.path.basename(image_path) for image_path in image_paths])
+
+    jobs = []
+    for image_path in image_paths:
+        thumbnail_path = os.path.join(thumbnail_directory, os.path.basename(image_path))
+        if skip_up_to_date and output_is_up_to_date(image_path, thumbnail_path, height, width,
+                                                    channels=get_thumbnail_channels(thumbnail_path, channels)):
+            continue
+        jobs.append((image_path, thumbnail_path))
+
+    if not jobs:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(create_thumbnail, image_path, thumbnail_path, size, is_mask, channels)
+                   for image_path, thumbnail_path in jobs]
+        return [future.result() for future in futures]
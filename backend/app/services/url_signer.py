@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from app.utils import LRUCache
+
+# Signed URLs are regenerated when they expire within this margin, so a URL handed out is valid for at least as long.
+REFRESH_MARGIN = timedelta(minutes=30)
+
+# Number of URLs signed by each task of the thread pool.
+SIGNING_CHUNK_SIZE = 64
+
+# Maximum number of signed URLs cached for a session. The least recently used ones are signed again when needed.
+MAX_CACHED_URLS = 20000
+
+
+class SignedUrlCache:
+    """
+    Signed URLs of a session, keyed by blob name, HTTP method and content type, together with the time they expire.
+    A URL signed for one method is never returned for another, e.g. an upload URL for a download. At most `max_size`
+    URLs are kept, the least recently used ones being evicted first.
+    """
+
+    def __init__(self, refresh_margin: timedelta = REFRESH_MARGIN, max_size: int = MAX_CACHED_URLS):
+        """
+        :param refresh_margin: (timedelta) URLs expiring within this margin are treated as missing.
+        :param max_size: (int) maximum number of URLs kept.
+        """
+        self.refresh_margin = refresh_margin
+        self._entries = LRUCache(max_size=max_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def get_key(blob_name: str, method: str, content_type: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+        """Returns the key of the URL signed for `blob_name`, `method` and `content_type`."""
+        return blob_name, method.upper(), content_type
+
+    def get(self, key: Tuple[str, str, Optional[str]]) -> Optional[str]:
+        """Returns the URL stored for `key`, or None if there is none or it is about to expire."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        url, expires_at = entry
+        if expires_at - datetime.now(timezone.utc) <= self.refresh_margin:
+            return None
+        return url
+
+    def set(self, key: Tuple[str, str, Optional[str]], url: str, expires_at: datetime):
+        self._entries.set(key, (url, expires_at))
+
+    def clear(self, prefixes: Optional[Iterable[str]] = None):
+        """
+        Forgets the stored URLs.
+
+        :param prefixes: (Iterable) only URLs of blobs whose names start with one of these prefixes are forgotten.
+            Every URL is forgotten, if None.
+        """
+        if prefixes is None:
+            self._entries.clear()
+            return
+
+        prefixes = tuple(prefixes)
+        for key in self._entries.keys():
+            if key[0].startswith(prefixes):
+                self._entries.pop(key)
+
+
+class BatchUrlSigner:
+    """
+    Signs V4 URLs for many blobs of a bucket at once.
+
+    Only URLs that are not cached, or are about to expire, are signed. They are signed in a thread pool, in chunks, by
+    the bucket client's credentials, whose private key is parsed once when the credentials are loaded. Signing does
+    not make any request to GCS.
+    """
+
+    def __init__(self, bucket, cache: SignedUrlCache, expiration: timedelta = timedelta(minutes=720),
+                 service_account_email: Optional[str] = None, max_workers: int = 8):
+        """
+        :param bucket: (storage.Bucket) bucket of the blobs. Its client's credentials sign the URLs.
+        :param cache: (SignedUrlCache) where signed URLs are stored and reused from.
+        :param expiration: (timedelta) time until the signed URLs expire.
+        :param service_account_email: (str) service account the URLs are signed as.
+        :param max_workers: (int) maximum number of threads signing URLs.
+        """
+        self.bucket = bucket
+        self.cache = cache
+        self.expiration = expiration
+        self.service_account_email = service_account_email
+        self.max_workers = max_workers
+
+    def _sign_chunk(self, blob_names: List[str], method: str, content_type: Optional[str]) -> List[Tuple[str, datetime]]:
+        signed_urls = []
+        for blob_name in blob_names:
+            # The expiry is taken before signing, so it is never later than the URL's real expiry.
+            expires_at = datetime.now(timezone.utc) + self.expiration
+            url = self.bucket.blob(blob_name).generate_signed_url(version="v4",
+                                                                  expiration=self.expiration,
+                                                                  method=method,
+                                                                  content_type=content_type,
+                                                                  service_account_email=self.service_account_email)
+            signed_urls.append((url, expires_at))
+        return signed_urls
+
+    def sign(self, blob_names: List[str], method: str = 'GET', content_type: Optional[str] = None) -> List[str]:
+        """
+        Returns a signed URL for each blob, in the order of `blob_names`.
+
+        :param blob_names: (list) names of the blobs.
+        :param method: (str) HTTP method allowed by the URLs.
+        :param content_type: (str) MIME type the URLs are restricted to (optional).
+        """
+        keys = [self.cache.get_key(blob_name, method, content_type) for blob_name in blob_names]
+        urls = [self.cache.get(key) for key in keys]
+        missing = [index for index, url in enumerate(urls) if url is None]
+        if not missing:
+            return urls
+
+        missing_names = [blob_names[index] for index in missing]
+        chunks = [missing_names[start:start + SIGNING_CHUNK_SIZE]
+                  for start in range(0, len(missing_names), SIGNING_CHUNK_SIZE)]
+
+        if len(chunks) == 1:
+            signed_chunks = [self._sign_chunk(chunks[0], method, content_type)]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                signed_chunks = list(executor.map(lambda chunk: self._sign_chunk(chunk, method, content_type), chunks))
+
+        signed_urls = [signed_url for signed_chunk in signed_chunks for signed_url in signed_chunk]
+        for index, (url, expires_at) in zip(missing, signed_urls):
+            self.cache.set(keys[index], url, expires_at)
+            urls[index] = url
+        return urls
@@ -0,0 +1,144 @@
+import os
+import queue
+import threading
+import zipfile
+from typing import BinaryIO, Iterable, Union
+
+# Already compressed formats are stored as they are, since deflating them again costs CPU without reducing their size.
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class StreamingZipWriter:
+    """
+    Builds a ZIP archive while its files are being produced.
+
+    Files are queued with `add_bytes` (for data that is already in memory) or `add_file`, and written to the archive
+    by a background thread, so producers are not blocked by compression or disk writes. The queue is bounded, which
+    slows producers down if the archive falls behind. The central directory is written when the writer is closed.
+    """
+    _CLOSE = object()
+
+    def __init__(self, zip_path: Union[str, BinaryIO], root_directory: str, max_queue_size: int = 256):
+        """
+        :param zip_path: (str, file) path of the ZIP file to create, or a writable file object (which does not need to
+            be seekable, e.g. an object being uploaded by `BucketSink.open_object`). File objects are not closed.
+        :param root_directory: (str) directory that the names of the archived files are relative to.
+        :param max_queue_size: (int) maximum number of files waiting to be written to the archive.
+        """
+        self.zip_path = zip_path
+        self.root_directory = root_directory
+        self.number_of_entries = 0
+
+        self._arcnames = set()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._error = None
+        self._closed = False
+        self._zip_file = zipfile.ZipFile(file=zip_path, mode='w', allowZip64=True)
+        self._thread = threading.Thread(target=self._write_entries, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _get_arcname(self, file_path: str):
+        return os.path.relpath(file_path, self.root_directory)
+
+    @staticmethod
+    def _get_compression(arcname: str):
+        if arcname.lower().endswith(STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def add_bytes(self, file_path: str, data: bytes):
+        """
+        Adds the content of a file to the archive, without reading the file from disk.
+
+        :param file_path: (str) path of the file. Its path relative to `root_directory` is used as its name in the
+            archive.
+        :param data: (bytes) content of the file.
+        """
+        self._put((self._get_arcname(file_path), data, None))
+
+    def add_file(self, file_path: str):
+        """Adds a file on disk to the archive."""
+        self._put((self._get_arcname(file_path), None, file_path))
+
+    def add_directory(self, exclude: Iterable[str] = ()):
+        """
+        Adds the files under `root_directory` that are not in the archive yet, e.g. the files left by earlier runs.
+
+        :param exclude: (Iterable) names, relative to `root_directory`, of files that are not added.
+        """
+        exclude = set(exclude)
+        if isinstance(self.zip_path, str):
+            exclude.add(self._get_arcname(self.zip_path))
+
+        for root, _, files in os.walk(self.root_directory):
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                arcname = self._get_arcname(file_path)
+                if arcname not in self._arcnames and arcname not in exclude:
+                    self.add_file(file_path)
+
+    def _put(self, entry):
+        if self._closed:
+            raise RuntimeError(f'{self.zip_path} has already been closed.')
+        if self._error is not None:
+            raise self._error
+        self._arcnames.add(entry[0])
+        self._queue.put(entry)
+
+    def _write_entries(self):
+        while True:
+            entry = self._queue.get()
+            if entry is self._CLOSE:
+                break
+
+            # After a failure, the remaining entries are drained so producers are never blocked.
+            if self._error is not None:
+                continue
+
+            arcname, data, file_path = entry
+            try:
+                if data is None:
+                    self._zip_file.write(filename=file_path, arcname=arcname,
+                                         compress_type=self._get_compression(arcname))
+                else:
+                    self._zip_file.writestr(zinfo_or_arcname=arcname, data=data,
+                                            compress_type=self._get_compression(arcname))
+                self.number_of_entries += 1
+            except Exception as e:
+                self._error = e
+
+    def _stop(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+
+    def close(self):
+        """Waits for the queued files to be archived, then writes the archive's central directory."""
+        self._stop()
+        self._zip_file.close()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        """
+        Stops archiving and deletes the incomplete archive. An archive written to a file object is left without its
+        central directory, so it is never a valid ZIP file; discarding it is up to the owner of the file object.
+        """
+        self._stop()
+        if isinstance(self.zip_path, str):
+            self._zip_file.close()
+            if os.path.exists(self.zip_path):
+                os.remove(self.zip_path)
+        else:
+            # Detach the file object, so the central directory is not written when the ZipFile is garbage collected.
+            self._zip_file.fp = None
@@ -9,7 +9,26 @@ from .directory_file_management import (create_project_directories,
                                         get_sorted_filepaths,
                                         create_resized_augmentation_directories,
                                         delete_directory,
-                                        get_file_extension
+                                        get_file_extension,
+                                        link_or_copy_file
                                         )
 
-from .errors import ValidationError
\ No newline at end of file
+from .errors import ValidationError
+
+from .file_index import FileIndex, get_paired_names, natural_sort_key
+
+from .image_probe import (ImageInfo,
+                          probe_image,
+                          probe_images,
+                          probe_directory,
+                          check_uniform_dimensions)
+
+from .lru_cache import LRUCache
+
+from .pagination import (encode_cursor,
+                         decode_cursor,
+                         resolve_list_cursor,
+                         get_page_bounds,
+                         get_next_cursor,
+                         quote_filename,
+                         split_urls)
@@ -1,9 +1,10 @@
 import os
-import re
 import shutil
 
 import attr
 
+from .file_index import FileIndex, natural_sort_key
+
 current_dir = os.path.dirname(__file__)
 base_dir = os.path.abspath(os.path.join(current_dir, '../..'))
 
@@ -39,6 +40,9 @@ class DirectoryStore:
 
     stratification_data_file_dir = attr.ib(type=str, init=False)
 
+    index_dir = attr.ib(type=str, init=False)
+    _file_indexes = attr.ib(type=dict, init=False, factory=dict, repr=False)
+
     def __attrs_post_init__(self):
         # Set the paths that depend on other attributes
         self.asset_dir = os.path.join(base_dir, f"assets-{self.session_id}")
@@ -69,6 +73,27 @@ class DirectoryStore:
 
         self.stratification_data_file_dir = os.path.join(self.asset_dir, 'stratification')
 
+        # The file indexes are persisted outside the indexed directories, so they are not listed as data files.
+        self.index_dir = os.path.join(self.asset_dir, '.index')
+
+    def get_file_index(self, directory: str) -> FileIndex:
+        """
+        Returns the index of the files in one of the session's directories, creating it the first time.
+
+        :param directory: (str) one of the session's directories, e.g. `image_dir` or `resized_train_mask_dir`.
+        """
+        directory = os.path.normpath(directory)
+        if directory not in self._file_indexes:
+            index_name = os.path.relpath(directory, self.asset_dir).replace(os.sep, '__')
+            self._file_indexes[directory] = FileIndex(directory=directory,
+                                                      index_path=os.path.join(self.index_dir, f'{index_name}.json'))
+        return self._file_indexes[directory]
+
+    def close(self):
+        """Writes the changes of the session's file indexes that are not persisted yet."""
+        for file_index in self._file_indexes.values():
+            file_index.save()
+
 
 def create_directory(dir_name, return_dir=False, overwrite_if_existing=False):
     """
@@ -229,9 +254,7 @@ def current_directory(file_path=None):
 
 
 def sort_filenames(file_paths):
-        return sorted(file_paths, key=lambda var: [
-            int(x) if x.isdigit() else x.lower() for x in re.findall(r'\D+|\d+', var)
-        ])
+        return sorted(file_paths, key=natural_sort_key)
 
 
 def list_filenames(directory_path):
@@ -288,3 +311,47 @@ def get_file_extension(file_path, remove_dot: bool = True):
         return ext.split('.')[-1]
     return ext
 
+
+# ioctl request used on Linux to clone a file's extents (a reflink) on copy-on-write filesystems (btrfs, XFS, ...).
+FICLONE = 0x40049409
+
+
+def _reflink_file(source_path, destination_path):
+    """Attempts to create a copy-on-write clone of a file. Returns True if the clone was created."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        delete_file(destination_path)
+        return False
+
+
+def link_or_copy_file(source_path, destination_path):
+    """
+    Places a file at a new path, without reading and re-writing its content when possible. A hard link is created
+    when both paths are on the same filesystem; otherwise a reflink is attempted, before falling back to a buffered
+    copy.
+
+    :param source_path: (str) path to the existing file.
+    :param destination_path: (str) path of the new file. An existing file at this path is replaced.
+    :return: (str) 'link', 'reflink' or 'copy', the method used to create the file.
+    """
+    delete_file(destination_path)
+
+    try:
+        os.link(source_path, destination_path)
+        return 'link'
+    except OSError:
+        pass
+
+    if _reflink_file(source_path, destination_path):
+        return 'reflink'
+
+    shutil.copyfile(source_path, destination_path)
+    return 'copy'
@@ -0,0 +1,302 @@
+import atexit
+import bisect
+import hashlib
+import json
+import os
+import threading
+import weakref
+from typing import Iterable, List, Union
+
+from .image_probe import probe_image
+from .pagination import decode_cursor, natural_sort_key
+
+# Version of the on-disk index format. Index files with another version are discarded and rebuilt.
+INDEX_VERSION = 1
+
+# Fields stored for each file, in the order they are persisted.
+FILE_FIELDS = ('size', 'mtime_ns', 'height', 'width', 'channels', 'hash')
+
+# Seconds between a change to an index and the write that persists it. Changes made within this delay, e.g. the
+# batches of an upload, are written together.
+SAVE_DELAY = 2.0
+
+# Indexes with changes that may not be written yet. They are written when the backend exits.
+_open_indexes = weakref.WeakSet()
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the BLAKE2b hex digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileIndex:
+    """
+    Naturally sorted listing of the files in a directory, with their sizes, image dimensions and content hashes.
+
+    Listing, counting and paging read from the index rather than the directory. Before each read, the directory's
+    modification time is compared to the one recorded when the index was last synchronised; the directory is listed
+    again only if it has changed since, and even then only the names that are new to the index are sorted into it.
+    Files added or removed through the index are inserted or deleted in place.
+
+    Dimensions and hashes are computed the first time they are requested, and kept until the file's size or
+    modification time changes. The index is persisted to `index_path`, so it survives a restart of the backend. Changes
+    are written `save_delay` seconds after the first one, together with those made in the meantime, rather than on
+    every change. Pending changes are written by `save`, e.g. when the session's directories are closed, and when the
+    backend exits.
+    """
+
+    def __init__(self, directory: str, index_path: Union[str, None] = None, save_delay: float = SAVE_DELAY):
+        """
+        :param directory: (str) directory being indexed.
+        :param index_path: (str) JSON file where the index is persisted. The index is kept in memory only, if None.
+        :param save_delay: (float) seconds between a change to the index and the write that persists it.
+        """
+        self.directory = directory
+        self.index_path = index_path
+        self.save_delay = save_delay
+
+        self._lock = threading.RLock()
+        self._names: List[str] = []
+        self._files = {}
+        self._directory_mtime_ns = None
+        self._dirty = False
+        self._save_timer = None
+
+        self._load()
+        _open_indexes.add(self)
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._names)
+
+    def __contains__(self, name: str):
+        with self._lock:
+            self._sync()
+            return name in self._files
+
+    def _get_directory_mtime_ns(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """Loads the persisted index, if it exists and matches the current format."""
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if data.get('version') != INDEX_VERSION or len(data['names']) != len(data['files']):
+            return
+
+        # Names are persisted in their sorted order, so they do not need to be sorted again.
+        self._names = list(data['names'])
+        self._files = {name: dict(zip(FILE_FIELDS, values)) for name, values in zip(data['names'], data['files'])}
+        self._directory_mtime_ns = data.get('directory_mtime_ns')
+
+    def _schedule_save(self):
+        """Marks the index as changed, and schedules its write unless one is already pending."""
+        self._dirty = True
+        if not self.index_path or self._save_timer is not None:
+            return
+
+        self._save_timer = threading.Timer(self.save_delay, self.save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def save(self):
+        """Writes the index to `index_path`, if it has changed since it was last written."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+            # An index is not written for a directory that has been deleted, e.g. when the session was cleared.
+            if not self.index_path or not self._dirty or not os.path.isdir(self.directory):
+                return
+
+            data = {'version': INDEX_VERSION,
+                    'directory_mtime_ns': self._directory_mtime_ns,
+                    'names': self._names,
+                    'files': [[self._files[name].get(field) for field in FILE_FIELDS] for name in self._names]}
+
+            # Write to a temporary file first, so a reader never sees a partially written index.
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            temporary_path = f'{self.index_path}.tmp'
+            with open(temporary_path, 'w') as file:
+                json.dump(data, file, separators=(',', ':'))
+            os.replace(temporary_path, self.index_path)
+            self._dirty = False
+
+    def _sync(self):
+        """Brings the index up to date, if the directory was modified outside the index."""
+        directory_mtime_ns = self._get_directory_mtime_ns()
+        if directory_mtime_ns == self._directory_mtime_ns:
+            return
+
+        names = set(os.listdir(self.directory)) if directory_mtime_ns is not None else set()
+        known_names = set(self._files)
+
+        removed_names = known_names - names
+        if removed_names:
+            self._names = [name for name in self._names if name not in removed_names]
+            for name in removed_names:
+                del self._files[name]
+
+        for name in names - known_names:
+            if os.path.isfile(os.path.join(self.directory, name)):
+                self._insert(name)
+
+        self._directory_mtime_ns = directory_mtime_ns
+        self._schedule_save()
+
+    def _insert(self, name: str):
+        if name not in self._files:
+            bisect.insort(self._names, name, key=natural_sort_key)
+        self._files[name] = {}
+
+    def add(self, names: Iterable[str]):
+        """
+        Records files that were just written to the directory, e.g. by an upload. Files that already exist in the
+        index are treated as replaced, so their cached dimensions and hash are discarded.
+
+        :param names: (Iterable) names of the files, relative to the directory.
+        """
+        with self._lock:
+            for name in names:
+                self._insert(name)
+
+            # Writing the files changed the directory's modification time. The directory is compared with the index
+            # once, which only finds files that were changed outside the index, since the new names are already known.
+            self._sync()
+            self._schedule_save()
+
+    def remove(self, names: Iterable[str]):
+        """
+        Deletes files from the directory and from the index.
+
+        :param names: (Iterable) names of the files, relative to the directory.
+        """
+        with self._lock:
+            removed_names = set()
+            for name in names:
+                file_path = os.path.join(self.directory, name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                removed_names.add(name)
+
+            self._names = [name for name in self._names if name not in removed_names]
+            for name in removed_names:
+                self._files.pop(name, None)
+
+            self._sync()
+            self._schedule_save()
+
+    def names(self) -> List[str]:
+        """Returns the naturally sorted names of all the files in the directory."""
+        with self._lock:
+            self._sync()
+            return list(self._names)
+
+    def page(self, start: int, stop: int) -> List[str]:
+        """Returns the names of the files from position `start` up to (but excluding) position `stop`."""
+        with self._lock:
+            self._sync()
+            return self._names[max(start, 0): max(stop, 0)]
+
+    def resolve_cursor(self, cursor: Union[str, None]) -> int:
+        """
+        Returns the position where the page following `cursor` starts (see `encode_cursor`). This is O(1) while the
+        files before the cursor are unchanged, and a binary search on the sorted names otherwise.
+
+        :param cursor: (str) cursor returned with the previous page. The first page starts at 0, if None.
+        """
+        if not cursor:
+            return 0
+
+        position, last_name = decode_cursor(cursor)
+        with self._lock:
+            self._sync()
+            if 0 < position <= len(self._names) and self._names[position - 1] == last_name:
+                return position
+            return bisect.bisect_right(self._names, natural_sort_key(last_name), key=natural_sort_key)
+
+    def first(self) -> Union[str, None]:
+        """Returns the name of the first file, or None if the directory is empty."""
+        names = self.page(0, 1)
+        return names[0] if names else None
+
+    def get_file_info(self, name: str) -> dict:
+        """
+        Returns the size, modification time, dimensions (height, width and channels) and content hash of a file.
+        Dimensions are None for files that are not PNG, JPEG or BMP images.
+        """
+        with self._lock:
+            self._sync()
+            if name not in self._files:
+                raise KeyError(f'{name} is not in {self.directory}.')
+
+            info = self._files[name]
+            file_path = os.path.join(self.directory, name)
+            stat = os.stat(file_path)
+
+            if info.get('size') != stat.st_size or info.get('mtime_ns') != stat.st_mtime_ns:
+                info.clear()
+                info.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                try:
+                    image_info = probe_image(file_path)
+                    info.update(height=image_info.height, width=image_info.width, channels=image_info.channels)
+                except ValueError:
+                    info.update(height=None, width=None, channels=None)
+                info['hash'] = hash_file(file_path)
+                self._schedule_save()
+
+            return dict(info)
+
+    def clear(self):
+        """Forgets the indexed files and deletes the persisted index."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            self._names = []
+            self._files = {}
+            self._directory_mtime_ns = None
+            self._dirty = False
+            if self.index_path and os.path.exists(self.index_path):
+                os.remove(self.index_path)
+
+
+@atexit.register
+def _save_open_indexes():
+    for file_index in list(_open_indexes):
+        file_index.save()
+
+
+def get_paired_names(image_index: FileIndex, mask_index: FileIndex, start: int = 0, stop: Union[int, None] = None):
+    """
+    Pairs images with their masks by position in the naturally sorted listings.
+
+    :param image_index: (FileIndex) index of the images directory.
+    :param mask_index: (FileIndex) index of the masks directory.
+    :param start: (int) position of the first pair to return.
+    :param stop: (int) position after the last pair to return. All the remaining pairs are returned, if None.
+    :return: (list) (image name, mask name) tuples.
+    :raises ValueError: if the directories do not hold the same number of files.
+    """
+    number_of_images, number_of_masks = len(image_index), len(mask_index)
+    if number_of_images != number_of_masks:
+        raise ValueError(f'Number of images ({number_of_images}) do not match number of masks ({number_of_masks}).')
+
+    stop = number_of_images if stop is None else stop
+    return list(zip(image_index.page(start, stop), mask_index.page(start, stop)))
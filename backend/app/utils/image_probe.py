@@ -0,0 +1,194 @@
+import os
+import struct
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Union
+
+from .lru_cache import LRUCache
+
+
+class ImageInfo(NamedTuple):
+    """Dimensions and encoding of an image file, as read from its header."""
+    height: int
+    width: int
+    channels: int
+    bit_depth: int
+    format: str
+
+
+# Number of channels decoded from a PNG file, for each PNG colour type. Palette images (type 3) decode to RGB.
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+# JPEG start-of-frame markers. 0xC4 (DHT), 0xC8 (JPG) and 0xCC (DAC) share the range, but are not frame headers.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# JPEG markers that are not followed by a segment length.
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+# Maximum number of image headers kept in the probe cache.
+PROBE_CACHE_SIZE = 65536
+
+_probe_cache = LRUCache(max_size=PROBE_CACHE_SIZE)
+
+
+def _probe_png(file) -> ImageInfo:
+    # 8 byte signature, followed by the IHDR chunk: length, type, width, height, bit depth and colour type.
+    header = file.read(26)
+    if len(header) < 26 or header[12:16] != b'IHDR':
+        raise ValueError('PNG file has no IHDR chunk.')
+
+    width, height, bit_depth, colour_type = struct.unpack('>IIBB', header[16:26])
+    if colour_type not in PNG_CHANNELS:
+        raise ValueError(f'Unknown PNG colour type {colour_type}.')
+    return ImageInfo(height=height, width=width, channels=PNG_CHANNELS[colour_type], bit_depth=bit_depth,
+                     format='png')
+
+
+def _probe_jpeg(file) -> ImageInfo:
+    # Walk the marker segments after the SOI marker, skipping their payloads, until a start-of-frame segment is found.
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        if not byte:
+            raise ValueError('JPEG file has no start-of-frame segment.')
+        if byte != b'\xff':
+            continue
+
+        marker = file.read(1)
+        # Markers may be preceded by any number of 0xFF fill bytes.
+        while marker == b'\xff':
+            marker = file.read(1)
+        if not marker:
+            raise ValueError('JPEG file has no start-of-frame segment.')
+
+        marker = marker[0]
+        if marker == 0xD9 or marker == 0xDA:
+            raise ValueError('JPEG file has no start-of-frame segment before its image data.')
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError('JPEG file is truncated.')
+        segment_length = struct.unpack('>H', length_bytes)[0]
+
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(6)
+            if len(frame) < 6:
+                raise ValueError('JPEG file is truncated.')
+            bit_depth, height, width, channels = struct.unpack('>BHHB', frame)
+            return ImageInfo(height=height, width=width, channels=channels, bit_depth=bit_depth, format='jpg')
+
+        file.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def _probe_bmp(file) -> ImageInfo:
+    # 14 byte file header, followed by the DIB header whose size identifies its version.
+    header = file.read(30)
+    if len(header) < 26:
+        raise ValueError('BMP file is truncated.')
+
+    dib_header_size = struct.unpack('<I', header[14:18])[0]
+    if dib_header_size == 12:
+        width, height, _, bits_per_pixel = struct.unpack('<HHHH', header[18:26])
+    elif dib_header_size >= 40 and len(header) == 30:
+        width, height, _, bits_per_pixel = struct.unpack('<iiHH', header[18:30])
+    else:
+        raise ValueError(f'Unsupported BMP header size {dib_header_size}.')
+
+    # Rows are stored top-down when the height is negative.
+    channels = {8: 1, 24: 3, 32: 4}.get(bits_per_pixel, 3)
+    return ImageInfo(height=abs(height), width=abs(width), channels=channels,
+                     bit_depth=bits_per_pixel // channels if bits_per_pixel >= 8 else bits_per_pixel, format='bmp')
+
+
+def _read_image_header(image_path: str) -> ImageInfo:
+    with open(image_path, 'rb') as file:
+        signature = file.read(8)
+        file.seek(0)
+
+        if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+            return _probe_png(file)
+        if signature.startswith(b'\xff\xd8'):
+            return _probe_jpeg(file)
+        if signature.startswith(b'BM'):
+            return _probe_bmp(file)
+
+    raise ValueError('Only PNG, JPEG and BMP files can be probed.')
+
+
+def probe_image(image_path: str) -> ImageInfo:
+    """
+    Returns the dimensions, number of channels, bit depth and format of an image, by reading only its header. Unlike
+    decoding the image, the cost does not grow with the size of the image.
+
+    Results are cached per file, and re-read when the file's modification time or size changes. The cache keeps the
+    most recently probed files only.
+
+    :param image_path: (str) path to a PNG, JPEG or BMP file.
+    :return: (ImageInfo) height, width, channels, bit_depth and format ('png', 'jpg' or 'bmp') of the image.
+    """
+    stat = os.stat(image_path)
+    cache_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+    info = _probe_cache.get(cache_key)
+    if info is not None:
+        return info
+
+    try:
+        info = _read_image_header(image_path)
+    except (ValueError, struct.error) as e:
+        raise ValueError(f'Unable to read the header of {image_path}: {e}') from e
+
+    _probe_cache.set(cache_key, info)
+    return info
+
+
+def probe_images(image_paths: List[str], max_workers: Union[int, None] = None) -> List[ImageInfo]:
+    """
+    Probes several images in parallel.
+
+    :param image_paths: (list) paths to the images.
+    :param max_workers: (int) maximum number of threads reading headers. Defaults to the executor's default.
+    :return: (list) ImageInfo of each image, in the order of image_paths.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(probe_image, image_paths))
+
+
+def probe_directory(directory: str, max_workers: Union[int, None] = None) -> dict:
+    """
+    Probes every file in a directory in parallel.
+
+    :param directory: (str) directory containing the images.
+    :param max_workers: (int) maximum number of threads reading headers.
+    :return: (dict) mapping each filename to its ImageInfo.
+    """
+    filenames = sorted(entry.name for entry in os.scandir(directory) if entry.is_file())
+    infos = probe_images([os.path.join(directory, filename) for filename in filenames], max_workers=max_workers)
+    return dict(zip(filenames, infos))
+
+
+def check_uniform_dimensions(image_paths: List[str], max_workers: Union[int, None] = None) -> ImageInfo:
+    """
+    Checks that all the images have the same height and width.
+
+    :param image_paths: (list) paths to the images.
+    :param max_workers: (int) maximum number of threads reading headers.
+    :return: (ImageInfo) header of the first image.
+    :raises ValueError: if the images do not all have the same height and width.
+    """
+    infos = probe_images(image_paths, max_workers=max_workers)
+    if not infos:
+        raise ValueError('No images to check.')
+
+    dimensions = Counter((info.height, info.width) for info in infos)
+    if len(dimensions) > 1:
+        (height, width), _ = dimensions.most_common(1)[0]
+        mismatched = [os.path.basename(path) for path, info in zip(image_paths, infos)
+                      if (info.height, info.width) != (height, width)]
+        examples = ', '.join(mismatched[:5]) + (', ...' if len(mismatched) > 5 else '')
+        raise ValueError(f'All images and masks must have the same dimensions. Most are {height}x{width}, '
+                         f'but {len(mismatched)} differ: {examples}')
+
+    return infos[0]
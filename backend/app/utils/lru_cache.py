@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that holds at most `max_size` entries. Once it is full, adding an entry evicts the entry that
+    was least recently read or written, so process-wide caches stay bounded for the life of the server.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: (int) maximum number of entries kept.
+        """
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value stored for `key`, or `default`, and marks the entry as the most recently used."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Removes the entry of `key` and returns its value, or `default` if there is none."""
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def keys(self) -> list:
+        """Returns the keys of the entries, from the least to the most recently used."""
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,121 @@
+import base64
+import bisect
+import json
+import re
+from typing import Callable, List, Sequence, Tuple, Union
+from urllib.parse import quote
+
+
+def natural_sort_key(filename: str):
+    """Sort key that orders the numbers within filenames by value, so 'img_2.png' comes before 'img_10.png'."""
+    return [int(x) if x.isdigit() else x.lower() for x in re.findall(r'\D+|\d+', filename)]
+
+
+def encode_cursor(position: int, last_name: str) -> str:
+    """
+    Creates an opaque cursor pointing after the item at `position - 1`.
+
+    The cursor stores the position and the name of the last item returned. A cursor is resolved in O(1) when the item
+    at that position still has the same name; if items were added or removed before it, the name is used to find
+    where the next page starts, so no item is skipped or repeated.
+
+    :param position: (int) position of the first item of the next page.
+    :param last_name: (str) name of the last item of the current page.
+    """
+    data = json.dumps([position, last_name], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """
+    Returns the position and last name stored in a cursor.
+
+    :raises ValueError: if the cursor was not created by `encode_cursor`.
+    """
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        position, last_name = json.loads(base64.urlsafe_b64decode(padded_cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+    if not isinstance(position, int) or position < 0 or not isinstance(last_name, str):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return position, last_name
+
+
+def resolve_list_cursor(cursor: Union[str, None], items: Sequence, key: Union[Callable, None] = None) -> int:
+    """
+    Returns the position in `items` where the page following `cursor` starts. This is O(1) while the items before
+    the cursor are unchanged, and a binary search on the names otherwise.
+
+    :param cursor: (str) cursor returned with the previous page. The first page starts at 0, if None.
+    :param items: (Sequence) the items, naturally sorted by name (see `natural_sort_key`), as they are paged.
+    :param key: (callable) returns the name of an item. The items are their names, if None.
+    """
+    if not cursor:
+        return 0
+
+    get_name = key or (lambda item: item)
+    position, last_name = decode_cursor(cursor)
+    if 0 < position <= len(items) and get_name(items[position - 1]) == last_name:
+        return position
+
+    # The list changed since the cursor was issued.
+    return bisect.bisect_right(items, natural_sort_key(last_name), key=lambda item: natural_sort_key(get_name(item)))
+
+
+def get_page_bounds(total: int, page_size: int, resolve_cursor: Callable, cursor: Union[str, None] = None,
+                    page: int = 1) -> Tuple[int, int]:
+    """
+    Returns the start and end positions of a page. A cursor takes precedence over the 1-based page number.
+
+    :param total: (int) total number of items.
+    :param page_size: (int) maximum number of items in the page.
+    :param resolve_cursor: (callable) returns the start position for a cursor.
+    :param cursor: (str) cursor returned with the previous page.
+    :param page: (int) page number, used when no cursor is given.
+    """
+    if page_size < 1:
+        raise ValueError('page_size must be a positive integer.')
+
+    start = resolve_cursor(cursor) if cursor else (page - 1) * page_size
+    start = min(max(start, 0), total)
+    return start, min(start + page_size, total)
+
+
+def get_next_cursor(end: int, total: int, names: List[str]) -> Union[str, None]:
+    """Returns the cursor of the page that follows a page ending at `end`, or None if it is the last page."""
+    if end >= total or not names:
+        return None
+    return encode_cursor(end, names[-1])
+
+
+def quote_filename(filename: str) -> str:
+    """Quotes a filename for use in the path of a URL."""
+    return quote(filename, safe='')
+
+
+def split_urls(urls: List[str], names: List[str]) -> Tuple[Union[str, None], List[str]]:
+    """
+    Splits URLs of the form `<prefix><quoted name>?<query>` into their shared prefix and their query strings.
+
+    :param urls: (list) the URLs.
+    :param names: (list) the name of the file each URL points to.
+    :return: (tuple) the shared prefix (None if the URLs do not share one), and the query string of each URL.
+    """
+    prefix = None
+    queries = []
+    for url, name in zip(urls, names):
+        base, _, query = url.partition('?')
+        quoted_name = quote_filename(name)
+        if not base.endswith(quoted_name):
+            return None, []
+
+        url_prefix = base[:len(base) - len(quoted_name)]
+        if prefix is None:
+            prefix = url_prefix
+        elif url_prefix != prefix:
+            return None, []
+        queries.append(query)
+
+    return prefix, queries
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+from app.utils.file_index import FileIndex, get_paired_names
+from app.utils.pagination import encode_cursor, get_page_bounds, resolve_list_cursor
+
+
+def write_file(directory: str, name: str, content: bytes = b'content'):
+    with open(os.path.join(directory, name), 'wb') as file:
+        file.write(content)
+
+
+def touch_directory(directory: str):
+    """Moves the directory's modification time forward, as coarse clocks may not change it between two writes."""
+    mtime_ns = os.stat(directory).st_mtime_ns + 1_000_000_000
+    os.utime(directory, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    directory = str(tmp_path / 'images')
+    os.makedirs(directory)
+    for name in ['img_10.png', 'img_2.png', 'img_1.png']:
+        write_file(directory, name)
+    return directory
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / 'index' / 'images.json')
+
+
+def test_names_are_naturally_sorted(directory):
+    assert FileIndex(directory).names() == ['img_1.png', 'img_2.png', 'img_10.png']
+
+
+def test_files_changed_outside_the_index_are_synchronised(directory):
+    file_index = FileIndex(directory)
+    file_index.names()
+
+    write_file(directory, 'img_3.png')
+    os.remove(os.path.join(directory, 'img_1.png'))
+    touch_directory(directory)
+
+    assert file_index.names() == ['img_2.png', 'img_3.png', 'img_10.png']
+
+
+def test_add_and_remove(directory):
+    file_index = FileIndex(directory)
+    write_file(directory, 'img_5.png')
+    file_index.add(['img_5.png'])
+    file_index.remove(['img_2.png'])
+
+    assert file_index.names() == ['img_1.png', 'img_5.png', 'img_10.png']
+    assert not os.path.exists(os.path.join(directory, 'img_2.png'))
+
+
+def test_cursor_is_resolved_by_position(directory):
+    file_index = FileIndex(directory)
+
+    assert file_index.resolve_cursor(None) == 0
+    assert file_index.resolve_cursor(encode_cursor(2, 'img_2.png')) == 2
+
+
+def test_cursor_is_resolved_by_name_after_a_removal(directory):
+    file_index = FileIndex(directory)
+    cursor = encode_cursor(2, 'img_2.png')
+    file_index.remove(['img_1.png'])
+
+    # 'img_10.png' is the next name after 'img_2.png', so the page starts there, without skipping or repeating it.
+    assert file_index.resolve_cursor(cursor) == 1
+    assert file_index.page(1, 3) == ['img_10.png']
+
+
+def test_invalid_cursor_raises_value_error(directory):
+    with pytest.raises(ValueError):
+        FileIndex(directory).resolve_cursor('not a cursor')
+
+
+def test_list_cursor_and_page_bounds():
+    items = ['img_1.png', 'img_3.png', 'img_10.png']
+    cursor = encode_cursor(2, 'img_2.png')
+
+    assert resolve_list_cursor(cursor, items) == 1
+    assert get_page_bounds(total=3, page_size=2, resolve_cursor=lambda c: resolve_list_cursor(c, items),
+                           cursor=cursor) == (1, 3)
+    assert get_page_bounds(total=3, page_size=2, resolve_cursor=None, page=2) == (2, 3)
+
+
+def test_index_is_persisted_and_reloaded(directory, index_path):
+    file_index = FileIndex(directory, index_path=index_path)
+    info = file_index.get_file_info('img_1.png')
+    file_index.save()
+
+    with open(index_path) as file:
+        assert json.load(file)['names'] == ['img_1.png', 'img_2.png', 'img_10.png']
+
+    reloaded_index = FileIndex(directory, index_path=index_path)
+    assert reloaded_index._files['img_1.png']['hash'] == info['hash']
+    assert reloaded_index.names() == ['img_1.png', 'img_2.png', 'img_10.png']
+
+
+def test_changed_file_info_is_recomputed(directory):
+    file_index = FileIndex(directory)
+    first_info = file_index.get_file_info('img_1.png')
+
+    write_file(directory, 'img_1.png', b'new and longer content')
+
+    info = file_index.get_file_info('img_1.png')
+    assert info['size'] == len(b'new and longer content')
+    assert info['hash'] != first_info['hash']
+    assert info['height'] is None
+
+
+def test_clear_deletes_the_persisted_index(directory, index_path):
+    file_index = FileIndex(directory, index_path=index_path)
+    file_index.names()
+    file_index.save()
+
+    file_index.clear()
+
+    assert not os.path.exists(index_path)
+
+
+def test_paired_names(directory, tmp_path):
+    mask_directory = str(tmp_path / 'masks')
+    os.makedirs(mask_directory)
+    for name in ['mask_1.png', 'mask_2.png']:
+        write_file(mask_directory, name)
+
+    with pytest.raises(ValueError):
+        get_paired_names(FileIndex(directory), FileIndex(mask_directory))
+
+    write_file(mask_directory, 'mask_10.png')
+    assert get_paired_names(FileIndex(directory), FileIndex(mask_directory), start=1) == [
+        ('img_2.png', 'mask_2.png'), ('img_10.png', 'mask_10.png')]
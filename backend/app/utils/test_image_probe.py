@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.image_probe import ImageInfo, check_uniform_dimensions, probe_directory, probe_image
+
+
+def save_image(path, height: int, width: int, mode: str, **kwargs) -> str:
+    channels = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}[mode]
+    pixels = np.zeros((height, width, channels), dtype=np.uint8).squeeze(axis=2 if channels == 1 else None)
+    Image.fromarray(pixels, mode=mode).save(path, **kwargs)
+    return str(path)
+
+
+@pytest.mark.parametrize('mode, channels', [('L', 1), ('LA', 2), ('RGB', 3), ('RGBA', 4)])
+def test_png_header(tmp_path, mode, channels):
+    image_path = save_image(tmp_path / 'image.png', height=30, width=40, mode=mode)
+
+    assert probe_image(image_path) == ImageInfo(height=30, width=40, channels=channels, bit_depth=8, format='png')
+
+
+def test_palette_png_is_probed_as_rgb(tmp_path):
+    image_path = str(tmp_path / 'palette.png')
+    Image.new('P', (40, 30)).save(image_path)
+
+    assert probe_image(image_path).channels == 3
+
+
+@pytest.mark.parametrize('mode, channels, progressive', [('L', 1, False), ('RGB', 3, False), ('RGB', 3, True)])
+def test_jpeg_header(tmp_path, mode, channels, progressive):
+    # The EXIF segment comes before the start-of-frame segment, so the probe has to skip it.
+    image_path = save_image(tmp_path / 'image.jpg', height=30, width=40, mode=mode, progressive=progressive,
+                            exif=Image.Exif().tobytes())
+
+    assert probe_image(image_path) == ImageInfo(height=30, width=40, channels=channels, bit_depth=8, format='jpg')
+
+
+def test_bmp_header(tmp_path):
+    image_path = save_image(tmp_path / 'image.bmp', height=30, width=40, mode='RGB')
+
+    info = probe_image(image_path)
+
+    assert (info.height, info.width, info.channels, info.format) == (30, 40, 3, 'bmp')
+
+
+def test_truncated_png_raises_value_error(tmp_path):
+    image_path = tmp_path / 'truncated.png'
+    image_path.write_bytes(b'\x89PNG\r\n\x1a\n\x00\x00')
+
+    with pytest.raises(ValueError):
+        probe_image(str(image_path))
+
+
+def test_unknown_format_raises_value_error(tmp_path):
+    image_path = tmp_path / 'image.gif'
+    image_path.write_bytes(b'GIF89a')
+
+    with pytest.raises(ValueError):
+        probe_image(str(image_path))
+
+
+def test_rewritten_file_is_probed_again(tmp_path):
+    image_path = save_image(tmp_path / 'image.png', height=30, width=40, mode='RGB')
+    probe_image(image_path)
+
+    save_image(image_path, height=50, width=60, mode='RGB')
+
+    assert (probe_image(image_path).height, probe_image(image_path).width) == (50, 60)
+
+
+def test_probe_directory(tmp_path):
+    save_image(tmp_path / 'b.png', height=30, width=40, mode='RGB')
+    save_image(tmp_path / 'a.jpg', height=30, width=40, mode='L')
+
+    infos = probe_directory(str(tmp_path))
+
+    assert list(infos) == ['a.jpg', 'b.png']
+    assert infos['a.jpg'].channels == 1
+
+
+def test_check_uniform_dimensions_names_the_odd_images(tmp_path):
+    image_paths = [save_image(tmp_path / f'img_{index}.png', height=30, width=40, mode='RGB') for index in range(3)]
+    image_paths.append(save_image(tmp_path / 'odd.png', height=31, width=40, mode='RGB'))
+
+    assert check_uniform_dimensions(image_paths[:3]).height == 30
+    with pytest.raises(ValueError, match='odd.png'):
+        check_uniform_dimensions(image_paths)